@@ -0,0 +1,110 @@
+""" Compares the memory use and event throughput of the ChannelStore with ChannelView dicts.
+
+Run with `python benchmarks/channel_store.py [num_channels] [num_participants]`.
+"""
+import gc
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+from typing import List, Tuple, Union
+
+from eth_utils import to_checksum_address
+
+from metrics_backend.model import TokenInfo, TokenNetwork
+from metrics_backend.utils.serialisation import token_network_to_dict
+
+# event name, channel identifier, participant and the amount or the second participant
+Event = Tuple[str, int, str, Union[str, bytes]]
+
+
+def create_events(num_channels: int, num_participants: int) -> List[Event]:
+    rnd = random.Random(42)
+    participants = [
+        to_checksum_address(rnd.getrandbits(160).to_bytes(20, 'big'))
+        for _ in range(num_participants)
+    ]
+
+    events: List[Event] = []
+    for channel_identifier in range(1, num_channels + 1):
+        participant1, participant2 = rnd.sample(participants, 2)
+        events.append(('opened', channel_identifier, participant1, participant2))
+        events.append(('deposit', channel_identifier, participant1, rnd.randbytes(9)))
+        events.append(('deposit', channel_identifier, participant2, rnd.randbytes(9)))
+        # most channels on a long running network are settled
+        if rnd.random() < 0.7:
+            events.append(('withdraw', channel_identifier, participant1, rnd.randbytes(8)))
+            events.append(('closed', channel_identifier, participant1, b''))
+            events.append(('settled', channel_identifier, participant1, b''))
+    return events
+
+
+def apply_events(token_network: TokenNetwork, events: List[Event]):
+    """ Applies the events, the amounts are decoded here like the ones of real events. """
+    for name, channel_identifier, participant, value in events:
+        if name == 'opened':
+            token_network.handle_channel_opened_event(channel_identifier, participant, value)
+        elif name == 'deposit':
+            amount = int.from_bytes(value, 'big')
+            token_network.handle_channel_new_deposit_event(channel_identifier, participant, amount)
+        elif name == 'withdraw':
+            amount = int.from_bytes(value, 'big')
+            token_network.handle_channel_withdraw_event(channel_identifier, participant, amount)
+        elif name == 'closed':
+            token_network.handle_channel_closed_event(channel_identifier)
+        elif name == 'settled':
+            token_network.handle_channel_settled_event(channel_identifier)
+
+
+def create_token_network(compact_channels: bool, events: List[Event]) -> TokenNetwork:
+    token_network = TokenNetwork(
+        '0x' + '00' * 20,
+        TokenInfo('0x' + '11' * 20, 'Token', 'TKN', 18),
+        compact_channels=compact_channels,
+    )
+    apply_events(token_network, events)
+    return token_network
+
+
+def measure(name: str, compact_channels: bool, events: List[Event]) -> TokenNetwork:
+    gc.collect()
+    start = time.perf_counter()
+    token_network = create_token_network(compact_channels, events)
+    duration = time.perf_counter() - start
+
+    # tracing slows down the event handling, so the memory is measured in a second run
+    del token_network
+    gc.collect()
+    tracemalloc.start()
+    token_network = create_token_network(compact_channels, events)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    token_network_to_dict(token_network, {})
+    serialisation_duration = time.perf_counter() - start
+    snapshot_size = len(pickle.dumps(token_network, protocol=pickle.HIGHEST_PROTOCOL))
+
+    print(
+        f'{name:>12}: {memory / 2 ** 20:>8.1f} MiB, '
+        f'{len(events) / duration:>9.0f} events/s, '
+        f'to_dict {serialisation_duration:>6.2f}s, '
+        f'snapshot {snapshot_size / 2 ** 20:>7.1f} MiB'
+    )
+    return token_network
+
+
+def main(num_channels: int = 100_000, num_participants: int = 10_000):
+    events = create_events(num_channels, num_participants)
+    print(f'{num_channels} channels, {num_participants} participants, {len(events)} events')
+
+    views = measure('ChannelView', False, events)
+    store = measure('ChannelStore', True, events)
+
+    # both stores have to describe the same network
+    assert token_network_to_dict(views, {}) == token_network_to_dict(store, {})
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
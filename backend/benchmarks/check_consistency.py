@@ -0,0 +1,183 @@
+""" Replays random channel events into token networks with `check_consistency`.
+
+After every event, the token network compares its incremental aggregates and its channel
+index against a full recomputation and raises an AssertionError on a mismatch. The events
+are replayed into both channel stores, which have to describe the same network in the end,
+in JSON as well as in the columnar MessagePack encoding.
+
+Run with `python benchmarks/check_consistency.py [num_events] [seed]`.
+"""
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import msgpack
+from eth_utils import to_checksum_address
+
+from metrics_backend.model import ChannelView, TokenInfo, TokenNetwork
+from metrics_backend.utils.columnar import networks_to_msgpack
+from metrics_backend.utils.serialisation import token_network_to_dict
+
+# event name, channel identifier, participant and the amount or the second participant
+Event = Tuple[str, int, str, object]
+
+
+def create_events(num_events: int, seed: int) -> List[Event]:
+    """ Creates a valid sequence of events, which reuses the identifiers of settled channels
+    and changes the deposits in all states. """
+    rnd = random.Random(seed)
+    participants = [
+        to_checksum_address(rnd.getrandbits(160).to_bytes(20, 'big'))
+        for _ in range(max(2, num_events // 20))
+    ]
+
+    # channel identifier -> state, participants and total deposits
+    channels: Dict[int, Tuple[ChannelView.State, Tuple[str, str], Dict[str, int]]] = {}
+    events: List[Event] = []
+    while len(events) < num_events:
+        kind = rnd.random()
+        settled = [
+            channel_identifier for channel_identifier, (state, _, _) in channels.items()
+            if state == ChannelView.State.SETTLED
+        ]
+        if kind < 0.3 or len(channels) == 0:
+            if len(settled) > 0 and rnd.random() < 0.1:
+                channel_identifier = rnd.choice(settled)
+            else:
+                channel_identifier = len(channels) + 1
+            participant1, participant2 = rnd.sample(participants, 2)
+            channels[channel_identifier] = (
+                ChannelView.State.OPENED,
+                (participant1, participant2),
+                {participant1: 0, participant2: 0},
+            )
+            events.append(('opened', channel_identifier, participant1, participant2))
+            continue
+
+        channel_identifier = rnd.choice(list(channels))
+        state, (participant1, participant2), deposits = channels[channel_identifier]
+        participant = rnd.choice((participant1, participant2))
+        if kind < 0.6:
+            deposits[participant] += rnd.getrandbits(rnd.choice((8, 64, 80)))
+            events.append(('deposit', channel_identifier, participant, deposits[participant]))
+        elif kind < 0.7:
+            deposits[participant] = rnd.randrange(deposits[participant] + 1)
+            events.append(('withdraw', channel_identifier, participant, deposits[participant]))
+        elif kind < 0.85 and state == ChannelView.State.OPENED:
+            channels[channel_identifier] = (
+                ChannelView.State.CLOSED,
+                (participant1, participant2),
+                deposits,
+            )
+            events.append(('closed', channel_identifier, participant, None))
+        elif state == ChannelView.State.CLOSED:
+            channels[channel_identifier] = (
+                ChannelView.State.SETTLED,
+                (participant1, participant2),
+                deposits,
+            )
+            events.append(('settled', channel_identifier, participant, None))
+    return events
+
+
+def replay(events: List[Event], compact_channels: bool) -> TokenNetwork:
+    token_network = TokenNetwork(
+        '0x' + '00' * 20,
+        TokenInfo('0x' + '11' * 20, 'Token', 'TKN', 18),
+        check_consistency=True,
+        compact_channels=compact_channels,
+    )
+    for name, channel_identifier, participant, value in events:
+        if name == 'opened':
+            token_network.handle_channel_opened_event(channel_identifier, participant, value)
+        elif name == 'deposit':
+            token_network.handle_channel_new_deposit_event(channel_identifier, participant, value)
+        elif name == 'withdraw':
+            token_network.handle_channel_withdraw_event(channel_identifier, participant, value)
+        elif name == 'closed':
+            token_network.handle_channel_closed_event(channel_identifier)
+        elif name == 'settled':
+            token_network.handle_channel_settled_event(channel_identifier)
+    return token_network
+
+
+def msgpack_to_dicts(body: bytes) -> List[Dict]:
+    """ Decodes the networks of `networks_to_msgpack` into the dicts of
+    `token_network_to_dict`. """
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(body)
+    document = dict(zip(unpacker, unpacker))
+    addresses = [to_checksum_address(address) for address in document['addresses']]
+    channel_states = document['channel_states']
+
+    networks = []
+    for network in document['networks']:
+        channels = network.pop('channels')
+        nodes = network.pop('nodes')
+        networks.append(dict(
+            network,
+            address=addresses[network['address']],
+            token=dict(network['token'], address=addresses[network['token']['address']]),
+            total_deposits=int.from_bytes(network['total_deposits'], 'big'),
+            channels=[
+                dict(
+                    channel_identifier=channel_identifier,
+                    status=channel_states[status],
+                    participant1=addresses[participant1],
+                    participant2=addresses[participant2],
+                    deposit1=int.from_bytes(deposit1, 'big'),
+                    deposit2=int.from_bytes(deposit2, 'big'),
+                )
+                for (
+                    channel_identifier, status, participant1, participant2, deposit1, deposit2
+                ) in zip(
+                    channels['channel_identifier'],
+                    channels['status'],
+                    channels['participant1'],
+                    channels['participant2'],
+                    channels['deposit1'],
+                    channels['deposit2'],
+                )
+            ],
+            nodes={
+                addresses[address]: dict(
+                    online=online,
+                    opened=opened,
+                    closed=closed,
+                    settled=settled,
+                )
+                for address, online, opened, closed, settled in zip(
+                    nodes['address'],
+                    nodes['online'],
+                    nodes['opened'],
+                    nodes['closed'],
+                    nodes['settled'],
+                )
+            },
+        ))
+    return networks
+
+
+def main(num_events: int = 5_000, seed: int = 42):
+    events = create_events(num_events, seed)
+    print(f'{len(events)} events, seed {seed}')
+
+    token_networks = []
+    for name, compact_channels in (('ChannelView', False), ('ChannelStore', True)):
+        start = time.perf_counter()
+        token_networks.append(replay(events, compact_channels))
+        print(f'{name:>12}: consistent after every event, {time.perf_counter() - start:.2f}s')
+
+    views, store = token_networks
+    assert token_network_to_dict(views, {}) == token_network_to_dict(store, {})
+    for token_network in token_networks:
+        assert msgpack_to_dicts(networks_to_msgpack([token_network], {})) == [
+            token_network_to_dict(token_network, {})
+        ]
+    print('MessagePack: the same networks as JSON')
+    print(f'aggregates: {views.aggregates()}')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,116 @@
+""" Compares the fast path event decoder with web3's generic event decoding.
+
+Run with `python benchmarks/event_decoder.py [num_events]`.
+"""
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+from eth_abi.codec import ABICodec
+from eth_utils import encode_hex, keccak, to_checksum_address
+from eth_utils.abi import event_abi_to_log_topic
+from hexbytes import HexBytes
+from raiden_contracts.constants import CONTRACT_TOKEN_NETWORK, CONTRACTS_VERSION, ChannelEvent
+from raiden_contracts.contract_manager import ContractManager, contracts_precompiled_path
+from web3 import Web3
+from web3._utils.abi import filter_by_type
+from web3._utils.events import get_event_data
+
+from metrics_backend.utils.event_decoder import EventDecoder
+
+EVENTS = [
+    ChannelEvent.OPENED,
+    ChannelEvent.DEPOSIT,
+    ChannelEvent.WITHDRAW,
+    ChannelEvent.CLOSED,
+    ChannelEvent.SETTLED,
+]
+
+
+def decode_event(codec: ABICodec, topic_to_event_abi: Dict[bytes, Dict], log_entry: Dict) -> Dict:
+    """ Decodes a log entry with the generic event decoding of web3. """
+    topic = log_entry["topics"][0]
+    event_abi = topic_to_event_abi[topic]
+
+    return get_event_data(codec, event_abi, log_entry)
+
+
+def random_value(abi_type: str, rnd: random.Random):
+    if abi_type == 'address':
+        return to_checksum_address(rnd.getrandbits(160).to_bytes(20, 'big'))
+    if abi_type.startswith('uint'):
+        return rnd.getrandbits(64)
+    if abi_type.startswith('bytes'):
+        return rnd.getrandbits(256).to_bytes(32, 'big')
+    raise ValueError(abi_type)
+
+
+def create_logs(web3: Web3, contract_abi: List[Dict], num_events: int) -> List[Dict]:
+    rnd = random.Random(42)
+    events_abi = [
+        event_abi for event_abi in filter_by_type('event', contract_abi)
+        if event_abi['name'] in EVENTS
+    ]
+    token_network = to_checksum_address(keccak(text='token network')[:20])
+
+    logs = []
+    for index in range(num_events):
+        event_abi = rnd.choice(events_abi)
+        topics = [HexBytes(event_abi_to_log_topic(event_abi))]
+        data_types, data_values = [], []
+        for argument in event_abi['inputs']:
+            value = random_value(argument['type'], rnd)
+            if argument['indexed']:
+                topics.append(HexBytes(web3.codec.encode_abi([argument['type']], [value])))
+            else:
+                data_types.append(argument['type'])
+                data_values.append(value)
+
+        logs.append(dict(
+            address=token_network,
+            topics=topics,
+            data=encode_hex(web3.codec.encode_abi(data_types, data_values)),
+            blockNumber=index // 10,
+            logIndex=index % 10,
+            transactionIndex=0,
+            transactionHash=HexBytes(keccak(index.to_bytes(8, 'big'))),
+            blockHash=HexBytes(keccak((index // 10).to_bytes(8, 'big'))),
+        ))
+    return logs
+
+
+def measure(name: str, decode: Callable[[Dict], Dict], logs: List[Dict]) -> float:
+    start = time.perf_counter()
+    for log_entry in logs:
+        decode(log_entry)
+    duration = time.perf_counter() - start
+    print(f'{name:>10}: {len(logs) / duration:>10.0f} events/s')
+    return duration
+
+
+def main(num_events: int = 50_000):
+    web3 = Web3()
+    contract_manager = ContractManager(contracts_precompiled_path(CONTRACTS_VERSION))
+    contract_abi = contract_manager.get_contract_abi(CONTRACT_TOKEN_NETWORK)
+    logs = create_logs(web3, contract_abi, num_events)
+
+    # the generic path as it was used by the BlockchainListener before
+    def generic_decode(log_entry: Dict) -> Dict:
+        events_abi = filter_by_type('event', contract_abi)
+        topic_to_event_abi = {
+            event_abi_to_log_topic(event_abi): event_abi for event_abi in events_abi
+        }
+        return decode_event(web3.codec, topic_to_event_abi, log_entry)
+
+    decoder = EventDecoder(web3.codec, contract_abi)
+    for log_entry in logs[:1000]:
+        assert decoder.decode(log_entry) == generic_decode(log_entry)
+
+    generic = measure('generic', generic_decode, logs)
+    fast = measure('fast path', decoder.decode, logs)
+    print(f'speedup: {generic / fast:.1f}x')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,283 @@
+""" Runs a BlockchainListener with a HeadSubscription against a stand-in node.
+
+The stand-in node serves `eth_subscribe('newHeads')` over a minimal WebSocket server and the
+other JSON-RPC requests through a web3 provider, which counts them. The script checks that
+a new head wakes the listener right away without any `eth_blockNumber` requests, that the
+listener polls while the connection is dropped, until the subscription is re-established, and
+that it asks the node for its head when the notifications stall.
+
+Run with `python benchmarks/head_subscription.py`.
+"""
+from gevent import monkey  # isort:skip # noqa
+monkey.patch_all()  # isort:skip # noqa
+
+import base64
+import hashlib
+import json
+import socket
+import struct
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+import gevent
+from eth_utils import keccak
+from gevent.server import StreamServer
+from raiden_contracts.constants import CONTRACT_TOKEN_NETWORK, CONTRACTS_VERSION
+from raiden_contracts.contract_manager import ContractManager, contracts_precompiled_path
+from web3 import Web3
+from web3.providers.base import BaseProvider
+
+from metrics_backend.utils.blockchain_listener import (
+    HEAD_SUBSCRIPTION_POLL_FACTOR,
+    BlockchainListener,
+)
+from metrics_backend.utils.head_subscription import HeadSubscription
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+SUBSCRIPTION_ID = '0x1'
+POLL_INTERVAL = 2  # seconds
+RECONNECT_INTERVAL = 1  # seconds
+# a new head has to arrive much faster than a poll would pick it up
+MAX_WAKE_UP_DELAY = 0.5  # seconds
+
+
+def block_hash(number: int) -> str:
+    return '0x' + keccak(number.to_bytes(32, 'big')).hex()
+
+
+def _recv_exactly(connection: socket.socket, length: int) -> bytes:
+    data = b''
+    while len(data) < length:
+        chunk = connection.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        data += chunk
+    return data
+
+
+def _send_text(connection: socket.socket, text: str):
+    payload = text.encode()
+    if len(payload) < 126:
+        header = struct.pack('!BB', 0x81, len(payload))
+    else:
+        header = struct.pack('!BBH', 0x81, 126, len(payload))
+    connection.sendall(header + payload)
+
+
+def _recv_text(connection: socket.socket) -> str:
+    first, second = _recv_exactly(connection, 2)
+    length = second & 0x7f
+    if length == 126:
+        length, = struct.unpack('!H', _recv_exactly(connection, 2))
+    elif length == 127:
+        length, = struct.unpack('!Q', _recv_exactly(connection, 8))
+    # frames sent by clients are always masked
+    mask = _recv_exactly(connection, 4)
+    payload = _recv_exactly(connection, length)
+    if first & 0x0f == 0x8:
+        raise ConnectionError('Connection closed by the client')
+    return bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload)).decode()
+
+
+class StandInNode:
+    """ A chain which only grows when `mine` is called, with a WebSocket server for the
+    subscriptions and a web3 provider for the other requests. """
+
+    def __init__(self, head_number: int) -> None:
+        self.head_number = head_number
+        self.requests: Counter = Counter()
+        self.accepting = True
+        self.subscribers: List[socket.socket] = []
+        self.server = StreamServer(('127.0.0.1', 0), self._handle_connection)
+
+    @property
+    def ws_uri(self) -> str:
+        return f'ws://127.0.0.1:{self.server.server_port}'
+
+    def _handle_connection(self, connection: socket.socket, _address):
+        if not self.accepting:
+            connection.close()
+            return
+
+        request = b''
+        while b'\r\n\r\n' not in request:
+            request += _recv_exactly(connection, 1)
+        headers = dict(
+            line.split(': ', 1) for line in request.decode().split('\r\n')[1:] if ': ' in line
+        )
+        accept = base64.b64encode(
+            hashlib.sha1(headers['Sec-WebSocket-Key'].encode() + WEBSOCKET_GUID).digest()
+        )
+        connection.sendall(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n'
+        )
+
+        try:
+            message = json.loads(_recv_text(connection))
+            assert message['method'] == 'eth_subscribe' and message['params'] == ['newHeads']
+            _send_text(connection, json.dumps(
+                dict(jsonrpc='2.0', id=message['id'], result=SUBSCRIPTION_ID)
+            ))
+            self.subscribers.append(connection)
+            while True:
+                _recv_text(connection)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if connection in self.subscribers:
+                self.subscribers.remove(connection)
+            connection.close()
+
+    def mine(self, notify: bool = True):
+        self.head_number += 1
+        if not notify:
+            return
+        notification = json.dumps(dict(
+            jsonrpc='2.0',
+            method='eth_subscription',
+            params=dict(
+                subscription=SUBSCRIPTION_ID,
+                result=dict(number=hex(self.head_number), hash=block_hash(self.head_number)),
+            ),
+        ))
+        for connection in list(self.subscribers):
+            _send_text(connection, notification)
+
+    def drop_connections(self):
+        """ Closes all subscriptions and refuses new ones until `accept_connections`. """
+        self.accepting = False
+        for connection in list(self.subscribers):
+            connection.shutdown(socket.SHUT_RDWR)
+
+    def accept_connections(self):
+        self.accepting = True
+
+    def handle_request(self, method: str, params: List) -> Dict:
+        self.requests[method] += 1
+        if method == 'eth_blockNumber':
+            return dict(result=hex(self.head_number))
+        if method == 'eth_getBlockByNumber':
+            number = int(params[0], 16)
+            if number > self.head_number:
+                return dict(result=None)
+            return dict(result=dict(
+                number=hex(number),
+                hash=block_hash(number),
+                parentHash=block_hash(number - 1),
+            ))
+        return dict(error=dict(code=-32601, message=f'{method} is not supported'))
+
+
+class StandInProvider(BaseProvider):
+    def __init__(self, node: StandInNode) -> None:
+        super().__init__()
+        self.node = node
+
+    def make_request(self, method, params):
+        return dict(jsonrpc='2.0', id=0, **self.node.handle_request(method, params))
+
+
+def wait_until(condition: Callable[[], bool], timeout: float) -> Optional[float]:
+    """ Returns the seconds until `condition` was met, `None` if it wasn't within `timeout`. """
+    start = time.monotonic()
+    while not condition():
+        if time.monotonic() - start > timeout:
+            return None
+        gevent.sleep(0.01)
+    return time.monotonic() - start
+
+
+def check(description: str, passed: bool):
+    print(f'{"ok" if passed else "FAILED":>6}: {description}')
+    assert passed, description
+
+
+def check_wake_up(description: str, delay: Optional[float]):
+    passed = delay is not None and delay < MAX_WAKE_UP_DELAY
+    check(f'{description} ({delay:.3f}s)' if delay is not None else description, passed)
+
+
+def main():
+    node = StandInNode(head_number=100)
+    node.server.start()
+
+    subscription = HeadSubscription(node.ws_uri, reconnect_interval=RECONNECT_INTERVAL)
+    listener = BlockchainListener(
+        Web3(StandInProvider(node)),
+        ContractManager(contracts_precompiled_path(CONTRACTS_VERSION)),
+        CONTRACT_TOKEN_NETWORK,
+        required_confirmations=2,
+        poll_interval=POLL_INTERVAL,
+        sync_start_block=90,
+        head_subscription=subscription,
+    )
+    subscription.start()
+    listener.start()
+
+    check('subscribed', wait_until(subscription.is_subscribed.is_set, 5) is not None)
+    check('synced', wait_until(listener.wait_sync_event.is_set, 5) is not None)
+
+    node.mine()
+    delay = wait_until(lambda: listener.unconfirmed_head_number == node.head_number, 5)
+    check_wake_up('a new head wakes the listener', delay)
+    requests = node.requests['eth_blockNumber']
+    gevent.sleep(2 * POLL_INTERVAL)
+    check(
+        'no eth_blockNumber requests while subscribed',
+        node.requests['eth_blockNumber'] == requests,
+    )
+
+    node.drop_connections()
+    check(
+        'the dropped subscription is noticed',
+        wait_until(lambda: not subscription.is_subscribed.is_set(), 5) is not None,
+    )
+    requests = node.requests['eth_blockNumber']
+    node.mine()
+    node.mine()
+    delay = wait_until(
+        lambda: listener.unconfirmed_head_number == node.head_number,
+        2 * POLL_INTERVAL,
+    )
+    check('the listener polls for new heads while dropped', delay is not None)
+    gevent.sleep(2 * POLL_INTERVAL)
+    polls = node.requests['eth_blockNumber'] - requests
+    check(f'the listener keeps polling while dropped ({polls} polls)', polls >= 2)
+
+    node.accept_connections()
+    check(
+        'the subscription is re-established',
+        wait_until(subscription.is_subscribed.is_set, 2 * RECONNECT_INTERVAL + 1) is not None,
+    )
+    node.mine()
+    delay = wait_until(lambda: listener.unconfirmed_head_number == node.head_number, 5)
+    check_wake_up('a new head wakes the listener again', delay)
+    requests = node.requests['eth_blockNumber']
+    gevent.sleep(2 * POLL_INTERVAL)
+    check('polling stopped again', node.requests['eth_blockNumber'] == requests)
+
+    # the connection stays open, but the new head is not announced
+    node.mine(notify=False)
+    delay = wait_until(
+        lambda: listener.unconfirmed_head_number == node.head_number,
+        POLL_INTERVAL * (HEAD_SUBSCRIPTION_POLL_FACTOR + 2),
+    )
+    check(
+        'the node is asked for its head when the notifications stall',
+        delay is not None and node.requests['eth_blockNumber'] > requests,
+    )
+    node.mine()
+    delay = wait_until(lambda: listener.unconfirmed_head_number == node.head_number, 5)
+    check_wake_up('a new head wakes the listener after the stall', delay)
+
+    listener.stop()
+    subscription.stop()
+    node.server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+""" Compares the size and the encoding time of the JSON and the columnar MessagePack `/json`.
+
+Run with `python benchmarks/response_format.py [num_channels] [num_participants]`.
+"""
+import gzip
+import random
+import sys
+import time
+from typing import Callable, List
+
+import brotli
+from eth_utils import to_checksum_address
+
+from metrics_backend.model import TokenInfo, TokenNetwork
+from metrics_backend.utils.columnar import networks_to_msgpack
+from metrics_backend.utils.serialisation import networks_to_json
+
+# the same as the API
+GZIP_COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def create_token_network(num_channels: int, num_participants: int) -> TokenNetwork:
+    rnd = random.Random(42)
+    participants = [
+        to_checksum_address(rnd.getrandbits(160).to_bytes(20, 'big'))
+        for _ in range(num_participants)
+    ]
+    token_network = TokenNetwork(
+        to_checksum_address('0x' + '01' * 20),
+        TokenInfo(to_checksum_address('0x' + '02' * 20), 'Token', 'TKN', 18),
+    )
+    for channel_identifier in range(1, num_channels + 1):
+        participant1, participant2 = rnd.sample(participants, 2)
+        token_network.handle_channel_opened_event(channel_identifier, participant1, participant2)
+        for participant in (participant1, participant2):
+            token_network.handle_channel_new_deposit_event(
+                channel_identifier,
+                participant,
+                rnd.getrandbits(72),
+            )
+        # most channels on a long running network are settled
+        if rnd.random() < 0.7:
+            token_network.handle_channel_closed_event(channel_identifier)
+            token_network.handle_channel_settled_event(channel_identifier)
+    return token_network
+
+
+def measure(name: str, encode: Callable[[], bytes]):
+    start = time.perf_counter()
+    body = encode()
+    duration = time.perf_counter() - start
+    gzip_body = gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL)
+    brotli_body = brotli.compress(body, quality=BROTLI_QUALITY)
+    print(
+        f'{name:>8}: {len(body) / 2 ** 20:>7.2f} MiB in {duration:>5.2f}s, '
+        f'gzip {len(gzip_body) / 2 ** 20:>6.2f} MiB, '
+        f'brotli {len(brotli_body) / 2 ** 20:>6.2f} MiB'
+    )
+
+
+def main(num_channels: int = 100_000, num_participants: int = 10_000):
+    token_networks: List[TokenNetwork] = [create_token_network(num_channels, num_participants)]
+    print(f'{num_channels} channels, {num_participants} participants')
+
+    measure('JSON', lambda: b''.join(networks_to_json(token_networks, {})))
+    measure('msgpack', lambda: networks_to_msgpack(token_networks, {}))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,90 @@
+import json
+import time
+from typing import Dict, Optional, Tuple
+
+from metrics_backend.api.snapshot import EncodedResponse, encode_response
+from metrics_backend.metrics_service import MetricsService
+from metrics_backend.presence_service import PresenceService
+from metrics_backend.utils.serialisation import (
+    DEFAULT_TOP_NODES,
+    metrics_to_dict,
+    token_network_changes_to_dict,
+)
+
+# number of different (since, top) responses kept encoded for the current version
+MAX_CACHED_CHANGES = 32
+
+
+def build_network_changes(
+    metrics_service: MetricsService,
+    presence_service: Optional[PresenceService],
+    since: int,
+    top: int = DEFAULT_TOP_NODES,
+) -> Dict:
+    """ Returns the token networks which changed after version `since`.
+
+    Only the changed channels and nodes of the token networks are included, together with
+    all aggregates. If the changes are not known anymore, the client has to fetch `/json`.
+    """
+    version = metrics_service.version
+    changes = metrics_service.change_log.changes_since(since)
+    if changes is None:
+        return dict(version=version, since=since, full_resync_required=True)
+
+    if presence_service is not None:
+        nodes_presence_status = presence_service.nodes_presence_status
+    else:
+        nodes_presence_status = {}
+    networks = [
+        token_network_changes_to_dict(
+            metrics_service.token_networks[token_network_address],
+            token_network_changes,
+            nodes_presence_status,
+        )
+        for token_network_address, token_network_changes in changes.items()
+        if token_network_address in metrics_service.token_networks
+    ]
+    return dict(
+        version=version,
+        since=since,
+        full_resync_required=False,
+        overall_metrics=metrics_to_dict(metrics_service.state, top),
+        networks=networks,
+    )
+
+
+class NetworkChanges:
+    """ Encodes the `/json/changes` responses, once per version for all clients. """
+
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+
+        self._version: Optional[int] = None
+        # (since, top) -> response, for the current version
+        self._responses: Dict[Tuple[int, int], EncodedResponse] = {}
+
+    def etag(self, since: int, top: int = DEFAULT_TOP_NODES) -> str:
+        """ Returns the ETag of the response `get` would return without building it. """
+        return f'{self.metrics_service.version}-{since}-{top}'
+
+    def get(self, since: int, top: int = DEFAULT_TOP_NODES) -> EncodedResponse:
+        if self.metrics_service.version != self._version:
+            self._version = self.metrics_service.version
+            self._responses = {}
+
+        responses = self._responses
+        response = responses.get((since, top))
+        if response is None:
+            body = json.dumps(
+                build_network_changes(self.metrics_service, self.presence_service, since, top)
+            ).encode()
+            response = encode_response(body, self.etag(since, top), time.monotonic())
+            if len(responses) >= MAX_CACHED_CHANGES:
+                responses.pop(next(iter(responses)))
+            responses[(since, top)] = response
+        return response
@@ -0,0 +1,76 @@
+from typing import List, Optional, Union
+
+from werkzeug.wrappers import Request, Response
+
+from metrics_backend.api.snapshot import CONTENT_TYPES, JSON_CONTENT_TYPE, EncodedResponse
+
+
+def response_content_type(request: Request) -> str:
+    """ Picks one of `CONTENT_TYPES` from the `Accept` header, JSON if none fits. """
+    return request.accept_mimetypes.best_match(CONTENT_TYPES, default=JSON_CONTENT_TYPE)
+
+
+def response_encoding(request: Request) -> str:
+    """ Picks the content coding of a response from the `Accept-Encoding` header. """
+    if request.accept_encodings['br'] > 0:
+        return 'br'
+    if request.accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return 'identity'
+
+
+def variant_etag(etag: str, encoding: str) -> str:
+    # the compressed bodies are different representations, they need their own strong ETags
+    return etag if encoding == 'identity' else f'{etag}-{encoding}'
+
+
+def not_modified(request: Request, etag: Optional[str], encoding: str) -> Optional[Response]:
+    """ Returns a 304 response if the client already has the response with `etag`. """
+    if etag is None:
+        return None
+    etag = variant_etag(etag, encoding)
+    if not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def encoded_response(encoded: EncodedResponse, encoding: str) -> Response:
+    if encoding == 'br':
+        response = Response(encoded.brotli_body, content_type=encoded.content_type)
+        response.headers['Content-Encoding'] = 'br'
+    elif encoding == 'gzip':
+        response = Response(encoded.gzip_body, content_type=encoded.content_type)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(encoded.body, content_type=encoded.content_type)
+    response.set_etag(variant_etag(encoded.etag, encoding))
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def body_parts_response(
+    parts: List[Union[bytes, memoryview]],
+    content_type: str,
+    etag: str,
+    encoding: str = 'identity',
+) -> Response:
+    """ Returns a response which sends `parts` as they are, without joining them.
+
+    `etag` is the ETag of the uncompressed body, `encoding` the content coding of `parts`.
+    """
+    # memoryviews are written to the socket like bytes
+    response = Response(
+        parts,  # type: ignore
+        content_type=content_type,
+        direct_passthrough=True,
+    )
+    # with a known length the parts are sent as they are, without chunked encoding
+    response.content_length = sum(len(part) for part in parts)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(variant_etag(etag, encoding))
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,159 @@
+import heapq
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from metrics_backend.metrics_service import MetricsService
+from metrics_backend.model import ChannelView, TokenNetwork
+from metrics_backend.utils import ChannelIdentifier
+from metrics_backend.utils.address_registry import AddressId, address_registry
+from metrics_backend.utils.serialisation import channel_to_dict, node_to_dict
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1_000
+
+CHANNEL_STATES = {
+    'opened': ChannelView.State.OPENED,
+    'closed': ChannelView.State.CLOSED,
+    'settled': ChannelView.State.SETTLED,
+}
+# channels are sorted by ascending identifier or by descending deposit
+CHANNEL_SORT_ORDERS = ('id', 'deposit')
+
+# a page of items and the cursor of the next page, `None` on the last page
+Page = Tuple[List[Dict], Optional[str]]
+
+
+def find_token_network(
+    metrics_service: MetricsService,
+    address: str,
+) -> Optional[TokenNetwork]:
+    """ Returns the token network with `address` in any case, `None` if it is unknown. """
+    try:
+        address_id = address_registry.lookup(address)
+    except ValueError:
+        return None
+    if address_id is None:
+        return None
+    return metrics_service.token_networks.get(address_registry.checksum_address(address_id))
+
+
+def _page(keys: Iterator, limit: int) -> Tuple[List, bool]:
+    """ Takes up to `limit` keys and tells if there are more of them. """
+    page = list(islice(keys, limit + 1))
+    return page[:limit], len(page) > limit
+
+
+def channels_page(
+    token_network: TokenNetwork,
+    state: Optional[ChannelView.State] = None,
+    participant: Optional[str] = None,
+    sort: str = 'id',
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Page:
+    """ Returns a page of the channels of `token_network`.
+
+    The page is read from the channel index. Filtering by participant only visits the
+    channels of the participant. Without a participant, a page costs only its size, the
+    index has the channels of each state by identifier and by deposit.
+
+    Raises:
+        ValueError: If the participant, the sort order or the cursor are invalid
+    """
+    if sort not in CHANNEL_SORT_ORDERS:
+        raise ValueError(f'sort has to be one of {", ".join(CHANNEL_SORT_ORDERS)}')
+
+    channel_index = token_network.channel_index
+    channels = token_network.channels
+    participant_id = None
+    if participant is not None:
+        try:
+            participant_id = address_registry.lookup(participant)
+        except ValueError:
+            raise ValueError(f'{participant} is not an address')
+        if participant_id is None:
+            return [], None
+
+    if sort == 'id':
+        after = _decode_id_cursor(cursor)
+        if participant_id is not None:
+            channel_ids = channel_index.channels_of_participant(participant_id, after)
+        elif state is not None:
+            channel_ids = channel_index.channels_by_state(state, after)
+        else:
+            channel_ids = heapq.merge(*[
+                channel_index.channels_by_state(channel_state, after)
+                for channel_state in ChannelView.State
+            ])
+        if state is not None and participant_id is not None:
+            channel_ids = (
+                channel_id for channel_id in channel_ids
+                if channels[channel_id].state == state
+            )
+        page_ids, has_more = _page(channel_ids, limit)
+        next_cursor = str(page_ids[-1]) if has_more else None
+    else:
+        before = _decode_deposit_cursor(cursor)
+        if participant_id is not None:
+            participant_keys = []
+            for channel_id in channel_index.channels_of_participant(participant_id):
+                channel = channels[channel_id]
+                if state is None or channel.state == state:
+                    participant_keys.append((channel.deposit_p1 + channel.deposit_p2, channel_id))
+            participant_keys.sort(reverse=True)
+            if before is not None:
+                participant_keys = [key for key in participant_keys if key < before]
+            deposit_keys = iter(participant_keys)
+        else:
+            deposit_keys = channel_index.channels_by_deposit(state, before)
+        page_keys, has_more = _page(deposit_keys, limit)
+        page_ids = [channel_id for _, channel_id in page_keys]
+        next_cursor = '{}:{}'.format(*page_keys[-1]) if has_more else None
+
+    page = [channel_to_dict(channel_id, channels[channel_id]) for channel_id in page_ids]
+    return page, next_cursor
+
+
+def nodes_page(
+    token_network: TokenNetwork,
+    nodes_presence_status: Dict[AddressId, bool],
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Page:
+    """ Returns a page of the nodes of `token_network`.
+
+    Raises:
+        ValueError: If the cursor is invalid
+    """
+    after = _decode_id_cursor(cursor)
+    page_ids, has_more = _page(token_network.channel_index.participants_after(after), limit)
+    nodes = [
+        dict(
+            address=address_registry.checksum_address(address_id),
+            **node_to_dict(
+                token_network.participants[address_id],
+                nodes_presence_status.get(address_id, False),
+            ),
+        )
+        for address_id in page_ids
+    ]
+    return nodes, str(page_ids[-1]) if has_more else None
+
+
+def _decode_id_cursor(cursor: Optional[str]) -> Optional[ChannelIdentifier]:
+    if cursor is None:
+        return None
+    try:
+        return ChannelIdentifier(int(cursor))
+    except ValueError:
+        raise ValueError(f'Invalid cursor {cursor}')
+
+
+def _decode_deposit_cursor(cursor: Optional[str]) -> Optional[Tuple[int, ChannelIdentifier]]:
+    if cursor is None:
+        return None
+    try:
+        deposit, channel_id = cursor.split(':')
+        return int(deposit), ChannelIdentifier(int(channel_id))
+    except ValueError:
+        raise ValueError(f'Invalid cursor {cursor}')
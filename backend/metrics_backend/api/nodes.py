@@ -0,0 +1,89 @@
+import re
+from typing import Dict, List, Optional
+
+from metrics_backend.metrics_service import MetricsService
+from metrics_backend.model import ChannelView
+from metrics_backend.utils.address_registry import AddressId, address_registry
+from metrics_backend.utils.serialisation import channel_to_dict, token_info_to_dict
+
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 100
+
+ADDRESS_PREFIX_RE = re.compile(r'^(0x)?[0-9a-f]{0,40}$', re.IGNORECASE)
+
+
+def find_node(metrics_service: MetricsService, address: str) -> Optional[AddressId]:
+    """ Returns the id of the node with `address` in any case, `None` if it has no channels. """
+    try:
+        node = address_registry.lookup(address)
+    except ValueError:
+        return None
+    if node is None or node not in metrics_service.node_index.token_networks:
+        return None
+    return node
+
+
+def node_info(
+    metrics_service: MetricsService,
+    nodes_presence_status: Dict[AddressId, bool],
+    node: AddressId,
+) -> Dict:
+    """ Returns the channels of a node in all token networks, with its deposits and counts.
+
+    The deposit of a token network is the node's own deposit in its open channels.
+    """
+    networks = []
+    num_channels = dict(opened=0, closed=0, settled=0)
+    for token_network_address in metrics_service.node_index.token_networks_of(node):
+        token_network = metrics_service.token_networks[token_network_address]
+        participants_channels = token_network.participants[node]
+
+        channels = []
+        deposit = 0
+        for channel_id in token_network.channel_index.channels_of_participant(node):
+            view = token_network.channels[channel_id]
+            channels.append(channel_to_dict(channel_id, view))
+            if view.state == ChannelView.State.OPENED:
+                deposit += view.deposit_p1 if view.participant1_id == node else view.deposit_p2
+
+        for state in num_channels:
+            num_channels[state] += getattr(participants_channels, state)
+        networks.append(dict(
+            address=token_network.address,
+            token=token_info_to_dict(token_network.token_info),
+            opened=participants_channels.opened,
+            closed=participants_channels.closed,
+            settled=participants_channels.settled,
+            deposit=deposit,
+            channels=channels,
+        ))
+
+    return dict(
+        address=address_registry.checksum_address(node),
+        online=nodes_presence_status.get(node, False),
+        num_channels=num_channels,
+        networks=networks,
+    )
+
+
+def search_nodes(
+    metrics_service: MetricsService,
+    nodes_presence_status: Dict[AddressId, bool],
+    prefix: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+) -> List[Dict]:
+    """ Returns the nodes whose address starts with `prefix`, for autocompletion.
+
+    Raises:
+        ValueError: If `prefix` can't be the beginning of an address
+    """
+    if ADDRESS_PREFIX_RE.match(prefix) is None:
+        raise ValueError(f'{prefix} is not the beginning of an address')
+
+    return [
+        dict(
+            address=address_registry.checksum_address(node),
+            online=nodes_presence_status.get(node, False),
+        )
+        for node in metrics_service.node_index.search(prefix, limit)
+    ]
@@ -1,45 +1,371 @@
-from typing import Tuple, Dict, List
-from operator import attrgetter
+from typing import Tuple, Dict, List, Optional
 
 import gevent
-from flask import Flask
+from flask import Flask, Response, request
 from flask_restful import Api, Resource
 from flask_cors import CORS
 from gevent import Greenlet
 from gevent.pywsgi import WSGIServer
-from cachetools import TTLCache, cachedmethod
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+from metrics_backend.api.changes import NetworkChanges
+from metrics_backend.api.negotiation import (
+    body_parts_response,
+    encoded_response,
+    not_modified,
+    response_content_type,
+    response_encoding,
+)
+from metrics_backend.api.networks import (
+    CHANNEL_STATES,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    channels_page,
+    find_token_network,
+    nodes_page,
+)
+from metrics_backend.api.nodes import (
+    DEFAULT_SEARCH_LIMIT,
+    MAX_SEARCH_LIMIT,
+    find_node,
+    node_info,
+    search_nodes,
+)
+from metrics_backend.api.shared_snapshot import publish_snapshots
+from metrics_backend.api.snapshot import (
+    CONTENT_TYPES,
+    JSON_CONTENT_TYPE,
+    MAX_TOP_NODES,
+    MIN_REBUILD_INTERVAL,
+    NetworkInfoSnapshot,
+)
+from metrics_backend.api.stream import ChangeStream
 from metrics_backend.metrics_service import MetricsService
 from metrics_backend.presence_service import PresenceService
-from metrics_backend.utils.serialisation import token_network_to_dict, metrics_to_dict
+from metrics_backend.utils.address_registry import AddressId
+from metrics_backend.utils.instrumentation import API_RESPONSE_BYTES
+from metrics_backend.utils.serialisation import (
+    DEFAULT_TOP_NODES,
+    token_network_summary_to_dict,
+)
+
+
+def _get_top_arg() -> Optional[int]:
+    """ Returns the `top` argument of the request, `None` if it is invalid. """
+    try:
+        top = int(request.args.get('top', DEFAULT_TOP_NODES))
+    except ValueError:
+        return None
+    if not 0 <= top <= MAX_TOP_NODES:
+        return None
+    return top
+
+
+def _get_limit_arg() -> Optional[int]:
+    """ Returns the `limit` argument of the request, `None` if it is invalid. """
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return None
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return None
+    return limit
+
+
+def _nodes_presence_status(presence_service: Optional[PresenceService]) -> Dict[AddressId, bool]:
+    if presence_service is None:
+        return {}
+    return presence_service.nodes_presence_status
 
 
 class NetworkInfoResource(Resource):
-    def __init__(self, metrics_service: MetricsService, presence_service: PresenceService) -> None:
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+        snapshot: NetworkInfoSnapshot,
+    ) -> None:
         self.metrics_service = metrics_service
         self.presence_service = presence_service
-        self._cache = TTLCache(maxsize=1, ttl=10)
+        self.snapshot = snapshot
 
-    @cachedmethod(attrgetter('_cache'))
     def get(self):
-        overall_metrics = metrics_to_dict(self.metrics_service.state)
-        networks = [
-            token_network_to_dict(network, self.presence_service.nodes_presence_status)
-            for network in self.metrics_service.token_networks.values()
-        ]
-        return {'overall_metrics': overall_metrics, 'networks': networks}, 200
+        top = _get_top_arg()
+        if top is None:
+            return {'error': f'top has to be between 0 and {MAX_TOP_NODES}'}, 400
+
+        content_type = response_content_type(request)
+        # only the response with the default `top` is compressed
+        encoding = response_encoding(request) if top == DEFAULT_TOP_NODES else 'identity'
+        # most clients poll without changes in between, they only cost a header comparison
+        response = not_modified(request, self.snapshot.etag(top, content_type), encoding)
+        if response is None:
+            if top == DEFAULT_TOP_NODES:
+                response = encoded_response(self.snapshot.get(content_type), encoding)
+            else:
+                etag, parts = self.snapshot.get_body_parts(top, content_type)
+                response = body_parts_response(parts, content_type, etag)
+        response.vary.add('Accept')
+        return response
+
+
+class NetworkChangesResource(Resource):
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+        changes: NetworkChanges,
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+        self.changes = changes
+
+    def get(self):
+        try:
+            since = int(request.args['since'])
+        except (KeyError, ValueError):
+            return {'error': 'since has to be the version of a previous response'}, 400
+        top = _get_top_arg()
+        if top is None:
+            return {'error': f'top has to be between 0 and {MAX_TOP_NODES}'}, 400
+
+        encoding = response_encoding(request)
+        response = not_modified(request, self.changes.etag(since, top), encoding)
+        if response is None:
+            response = encoded_response(self.changes.get(since, top), encoding)
+        return response
+
+
+class StreamResource(Resource):
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+        stream: ChangeStream,
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+        self.stream = stream
+
+    def get(self):
+        # a reconnecting EventSource sends the id of the last event it got
+        since = request.headers.get('Last-Event-ID', request.args.get('since'))
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return {'error': 'since has to be the version of a previous response'}, 400
+        top = _get_top_arg()
+        if top is None:
+            return {'error': f'top has to be between 0 and {MAX_TOP_NODES}'}, 400
+        if self.stream.is_full():
+            return {'error': 'Too many clients, poll /json/changes instead'}, 503
+
+        response = Response(self.stream.events(since, top), content_type='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # keeps reverse proxies from buffering the events
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class NetworksResource(Resource):
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+
+    def get(self):
+        return {
+            'networks': [
+                token_network_summary_to_dict(token_network)
+                for token_network in self.metrics_service.token_networks.values()
+            ]
+        }
+
+
+class NetworkResource(Resource):
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+
+    def get(self, token_network_address: str):
+        token_network = find_token_network(self.metrics_service, token_network_address)
+        if token_network is None:
+            return {'error': f'Unknown token network {token_network_address}'}, 404
+
+        return token_network_summary_to_dict(token_network)
+
+
+class NetworkChannelsResource(Resource):
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+
+    def get(self, token_network_address: str):
+        token_network = find_token_network(self.metrics_service, token_network_address)
+        if token_network is None:
+            return {'error': f'Unknown token network {token_network_address}'}, 404
+
+        state = request.args.get('state')
+        if state is not None and state not in CHANNEL_STATES:
+            return {'error': f'state has to be one of {", ".join(CHANNEL_STATES)}'}, 400
+        limit = _get_limit_arg()
+        if limit is None:
+            return {'error': f'limit has to be between 1 and {MAX_PAGE_SIZE}'}, 400
+
+        try:
+            channels, next_cursor = channels_page(
+                token_network,
+                state=CHANNEL_STATES[state] if state is not None else None,
+                participant=request.args.get('participant'),
+                sort=request.args.get('sort', 'id'),
+                limit=limit,
+                cursor=request.args.get('cursor'),
+            )
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        return {'channels': channels, 'next_cursor': next_cursor}
+
+
+class NetworkNodesResource(Resource):
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+
+    def get(self, token_network_address: str):
+        token_network = find_token_network(self.metrics_service, token_network_address)
+        if token_network is None:
+            return {'error': f'Unknown token network {token_network_address}'}, 404
+
+        limit = _get_limit_arg()
+        if limit is None:
+            return {'error': f'limit has to be between 1 and {MAX_PAGE_SIZE}'}, 400
+
+        try:
+            nodes, next_cursor = nodes_page(
+                token_network,
+                _nodes_presence_status(self.presence_service),
+                limit=limit,
+                cursor=request.args.get('cursor'),
+            )
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        return {'nodes': nodes, 'next_cursor': next_cursor}
+
+
+class NodesResource(Resource):
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+
+    def get(self):
+        prefix = request.args.get('prefix')
+        if prefix is None:
+            return {'error': 'prefix is required'}, 400
+        try:
+            limit = int(request.args.get('limit', DEFAULT_SEARCH_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_SEARCH_LIMIT:
+            return {'error': f'limit has to be between 1 and {MAX_SEARCH_LIMIT}'}, 400
+
+        try:
+            nodes = search_nodes(
+                self.metrics_service,
+                _nodes_presence_status(self.presence_service),
+                prefix,
+                limit,
+            )
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        return {'nodes': nodes}
+
+
+class NodeResource(Resource):
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+
+    def get(self, node_address: str):
+        node = find_node(self.metrics_service, node_address)
+        if node is None:
+            return {'error': f'Unknown node {node_address}'}, 404
+
+        return node_info(
+            self.metrics_service,
+            _nodes_presence_status(self.presence_service),
+            node,
+        )
 
 
 class NetworkInfoAPI:
-    def __init__(self, metrics_service: MetricsService, presence_service: PresenceService) -> None:
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+        rebuild_interval: float = MIN_REBUILD_INTERVAL,
+        shared_snapshot_path: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            shared_snapshot_path: If given, each `/json` snapshot is also written to this
+                file, to be served by the workers of `shared_snapshot.start_workers`
+        """
         self.flask_app = Flask(__name__)
         CORS(self.flask_app)
         self.api = Api(self.flask_app)
         self.rest_server: WSGIServer = None
         self.server_greenlet: Greenlet = None
 
+        # built at most once per change of the model, for all requests
+        self.network_info_snapshot = NetworkInfoSnapshot(
+            metrics_service,
+            presence_service,
+            min_rebuild_interval=rebuild_interval,
+            # the workers can't ask for a content type to be encoded
+            content_types=CONTENT_TYPES if shared_snapshot_path else (JSON_CONTENT_TYPE,),
+        )
+        if shared_snapshot_path is not None:
+            publish_snapshots(self.network_info_snapshot, shared_snapshot_path)
+        self.network_changes = NetworkChanges(metrics_service, presence_service)
+        self.change_stream = ChangeStream(metrics_service, self.network_changes)
+
         resources: List[Tuple[str, Resource, Dict]] = [
-            ('/json', NetworkInfoResource, {}),
+            ('/json', NetworkInfoResource, {'snapshot': self.network_info_snapshot}),
+            ('/json/changes', NetworkChangesResource, {'changes': self.network_changes}),
+            ('/stream', StreamResource, {'stream': self.change_stream}),
+            ('/networks', NetworksResource, {}),
+            ('/networks/<token_network_address>', NetworkResource, {}),
+            ('/networks/<token_network_address>/channels', NetworkChannelsResource, {}),
+            ('/networks/<token_network_address>/nodes', NetworkNodesResource, {}),
+            ('/nodes', NodesResource, {}),
+            ('/nodes/<node_address>', NodeResource, {}),
         ]
 
         for endpoint_url, resource, kwargs in resources:
@@ -47,6 +373,25 @@ class NetworkInfoAPI:
             kwargs['presence_service'] = presence_service
             self.api.add_resource(resource, endpoint_url, resource_class_kwargs=kwargs)
 
+        self.flask_app.add_url_rule('/metrics', 'metrics', self._metrics)
+        self.flask_app.after_request(self._record_response_size)
+
+    @staticmethod
+    def _metrics():
+        return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+    @staticmethod
+    def _record_response_size(response: Response) -> Response:
+        # the length of a stream is unknown
+        if response.is_streamed:
+            return response
+        if request.url_rule is not None and request.url_rule.rule != '/metrics':
+            API_RESPONSE_BYTES.labels(request.url_rule.rule).observe(
+                response.calculate_content_length() or 0
+            )
+        return response
+
     def run(self, port: int = 5002):
+        self.network_info_snapshot.start()
         self.rest_server = WSGIServer(('0.0.0.0', port), self.flask_app)
         self.server_greenlet = gevent.spawn(self.rest_server.serve_forever)
@@ -0,0 +1,253 @@
+""" Serves `/json` from pre-forked worker processes, apart from the process following the
+chain.
+
+The process following the chain writes each new snapshot to a file and renames it over the
+previous one, so a snapshot is published atomically. The workers map the current file into
+memory and send the bodies from the mapping without copying them. A file starts with
+`MAGIC`, followed by the length of the header, the header as JSON and the bodies. The
+header has the version of the snapshot, its overall metrics and where the encoded networks
+and the precompressed responses are in the file.
+"""
+import json
+import logging
+import mmap
+import os
+import signal
+import socket
+import struct
+import tempfile
+from typing import Dict, List, Optional, Tuple, Union
+
+import gevent
+from gevent.pywsgi import WSGIServer
+from werkzeug.wrappers import Request, Response
+
+from metrics_backend.api.negotiation import (
+    body_parts_response,
+    not_modified,
+    response_content_type,
+    response_encoding,
+)
+from metrics_backend.api.snapshot import (
+    JSON_CONTENT_TYPE,
+    MAX_TOP_NODES,
+    EncodedSnapshot,
+    NetworkInfoSnapshot,
+    snapshot_body_parts,
+    snapshot_etag,
+)
+from metrics_backend.utils.serialisation import DEFAULT_TOP_NODES
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'RNEXSNP1'
+HEADER_LENGTH = struct.Struct('>I')
+DEFAULT_SNAPSHOT_PATH = os.path.join(tempfile.gettempdir(), 'explorer-snapshot')
+LISTEN_BACKLOG = 1024
+# the workers exit once the process following the chain is gone
+PARENT_CHECK_INTERVAL = 1  # seconds
+
+# offset and length of a body in the file, the offset counts from the end of the header
+Entry = List[int]
+
+
+def write_snapshot_file(path: str, snapshot: EncodedSnapshot):
+    """ Writes the snapshot next to `path` and renames it to `path`, which replaces the
+    previous snapshot atomically. """
+    bodies: List[bytes] = []
+    length = 0
+
+    def add(body: bytes) -> Entry:
+        nonlocal length
+        bodies.append(body)
+        entry = [length, len(body)]
+        length += len(body)
+        return entry
+
+    networks = {
+        content_type: add(encoded) for content_type, encoded in snapshot.networks.items()
+    }
+    responses = {
+        content_type: {
+            'identity': add(response.body),
+            'gzip': add(response.gzip_body),
+            'br': add(response.brotli_body),
+        }
+        for content_type, response in snapshot.responses.items()
+    }
+    header = json.dumps(dict(
+        version=snapshot.version,
+        overall_metrics=snapshot.overall_metrics,
+        networks=networks,
+        responses=responses,
+    )).encode()
+
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        for body in bodies:
+            f.write(body)
+    os.replace(temp_path, path)
+
+
+def publish_snapshots(network_info_snapshot: NetworkInfoSnapshot, path: str):
+    """ Writes each new snapshot to `path` for the workers. """
+    def publish(snapshot: EncodedSnapshot):
+        # writing several megabytes shouldn't stall the hub
+        gevent.get_hub().threadpool.apply(write_snapshot_file, (path, snapshot))
+        log.debug(f'Published the /json snapshot {snapshot.version} to {path}')
+
+    network_info_snapshot.add_listener(publish)
+
+
+class MappedSnapshot:
+    """ A snapshot file mapped into memory, the bodies are views of the mapping. """
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            # stays valid after the file was replaced, until the last view is released
+            buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a snapshot file')
+        header_length, = HEADER_LENGTH.unpack_from(buffer, len(MAGIC))
+        start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(bytes(buffer[start:start + header_length]))
+        bodies = buffer[start + header_length:]
+
+        def body(entry: Entry) -> memoryview:
+            offset, length = entry
+            return bodies[offset:offset + length]
+
+        metrics_version, presence_version = header['version']
+        self.version: Tuple[int, int] = (metrics_version, presence_version)
+        self.overall_metrics: Dict = header['overall_metrics']
+        # content type -> encoded networks
+        self.networks: Dict[str, memoryview] = {
+            content_type: body(entry) for content_type, entry in header['networks'].items()
+        }
+        # content type -> content coding -> body of the response with `DEFAULT_TOP_NODES`
+        self.responses: Dict[str, Dict[str, memoryview]] = {
+            content_type: {encoding: body(entry) for encoding, entry in entries.items()}
+            for content_type, entries in header['responses'].items()
+        }
+
+
+class SnapshotFile:
+    """ Maps the snapshot file again whenever it was replaced. """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.snapshot: Optional[MappedSnapshot] = None
+
+    def current(self) -> Optional[MappedSnapshot]:
+        """ Returns the last published snapshot, `None` if there is none yet. """
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return self.snapshot
+        # the mapping keeps the old file alive, so its inode can't be reused meanwhile
+        if self.snapshot is None or self.snapshot.inode != inode:
+            self.snapshot = MappedSnapshot(self.path)
+        return self.snapshot
+
+
+def _error(message: str, status: int) -> Response:
+    return Response(json.dumps({'error': message}), status=status, content_type='application/json')
+
+
+class SnapshotWorkerApp:
+    """ The WSGI app of a worker, it only serves `/json` from the snapshot file. """
+
+    def __init__(self, path: str) -> None:
+        self.snapshot_file = SnapshotFile(path)
+
+    def __call__(self, environ, start_response):
+        response = self.handle(Request(environ))
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        return response(environ, start_response)
+
+    def handle(self, request: Request) -> Response:
+        if request.path != '/json':
+            return _error(f'Unknown resource {request.path}', 404)
+        if request.method not in ('GET', 'HEAD'):
+            return _error(f'Method {request.method} not allowed', 405)
+        try:
+            top = int(request.args.get('top', DEFAULT_TOP_NODES))
+        except ValueError:
+            top = -1
+        if not 0 <= top <= MAX_TOP_NODES:
+            return _error(f'top has to be between 0 and {MAX_TOP_NODES}', 400)
+
+        snapshot = self.snapshot_file.current()
+        if snapshot is None:
+            return _error('No snapshot has been published yet', 503)
+
+        content_type = response_content_type(request)
+        if content_type not in snapshot.networks:
+            content_type = JSON_CONTENT_TYPE
+        # only the response with the default `top` is compressed, as in `NetworkInfoSnapshot`
+        precompressed = snapshot.responses[content_type] if top == DEFAULT_TOP_NODES else None
+        encoding = response_encoding(request) if precompressed is not None else 'identity'
+        etag = snapshot_etag(snapshot.version, top, content_type)
+
+        response = not_modified(request, etag, encoding)
+        if response is None:
+            parts: List[Union[bytes, memoryview]]
+            if precompressed is not None:
+                parts = [precompressed[encoding]]
+            else:
+                parts = snapshot_body_parts(
+                    snapshot.version[0],
+                    snapshot.overall_metrics,
+                    snapshot.networks[content_type],
+                    top,
+                    content_type,
+                )
+            response = body_parts_response(parts, content_type, etag, encoding)
+        response.vary.add('Accept')
+        return response
+
+
+def start_workers(path: str, port: int, num_workers: int) -> List[int]:
+    """ Forks the workers serving the snapshot file at `path` on `port`.
+
+    Has to be called before anything else is started, the workers get a copy of the
+    process. Returns the process ids of the workers.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('0.0.0.0', port))
+    listener.listen(LISTEN_BACKLOG)
+
+    parent_pid = os.getpid()
+    pids = []
+    for _ in range(num_workers):
+        pid = gevent.fork()
+        if pid == 0:
+            try:
+                _run_worker(listener, path, parent_pid)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    listener.close()
+    return pids
+
+
+def _run_worker(listener: socket.socket, path: str, parent_pid: int):
+    server = WSGIServer(listener, SnapshotWorkerApp(path))
+    server.start()
+    while os.getppid() == parent_pid:
+        gevent.sleep(PARENT_CHECK_INTERVAL)
+    server.stop()
+
+
+def stop_workers(pids: List[int]):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
@@ -0,0 +1,333 @@
+import gzip
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import brotli
+import gevent
+import gevent.event
+import msgpack
+from gevent import Greenlet
+
+from metrics_backend.metrics_service import MetricsService
+from metrics_backend.presence_service import PresenceService
+from metrics_backend.utils.columnar import NUM_NETWORKS_ENTRIES, networks_to_msgpack
+from metrics_backend.utils.instrumentation import API_BUILD_SECONDS
+from metrics_backend.utils.serialisation import (
+    DEFAULT_TOP_NODES,
+    metrics_to_dict,
+    networks_to_json,
+)
+
+log = logging.getLogger(__name__)
+
+# while events keep coming in, e.g. during the initial sync, rebuild at most this often
+MIN_REBUILD_INTERVAL = 5  # seconds
+GZIP_COMPRESS_LEVEL = 6
+# the highest qualities are too slow for bodies of several megabytes
+BROTLI_QUALITY = 5
+MAX_TOP_NODES = 100
+
+JSON_CONTENT_TYPE = 'application/json'
+# the columnar encoding of `metrics_backend.utils.columnar`
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+# in the order of preference, if a client accepts several of them
+CONTENT_TYPES = (JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE)
+
+
+@dataclass(frozen=True)
+class EncodedResponse:
+    body: bytes
+    gzip_body: bytes
+    brotli_body: bytes
+    # strong entity tag of `body`, without quotes, the same for the same model version
+    etag: str
+    built_at: float
+    content_type: str = JSON_CONTENT_TYPE
+
+
+def encode_response(
+    body: bytes,
+    etag: str,
+    built_at: float,
+    content_type: str = JSON_CONTENT_TYPE,
+) -> EncodedResponse:
+    """ Compresses `body` once for all clients accepting gzip or brotli. """
+    return EncodedResponse(
+        body=body,
+        gzip_body=gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL),
+        brotli_body=brotli.compress(body, quality=BROTLI_QUALITY),
+        etag=etag,
+        built_at=built_at,
+        content_type=content_type,
+    )
+
+
+def with_top_nodes(overall_metrics: Dict, top: int) -> Dict:
+    """ Cuts `top_nodes_by_channels` of overall metrics built with a larger `top`. """
+    top_nodes = overall_metrics['top_nodes_by_channels']
+    # ascending, so the nodes with the most channels are at the end
+    return dict(overall_metrics, top_nodes_by_channels=top_nodes[max(len(top_nodes) - top, 0):])
+
+
+@dataclass(frozen=True)
+class EncodedSnapshot:
+    """ The networks encoded from one version of the model, never changed after the build.
+
+    Only the bytes are shared with the thread pool, never the model itself.
+    """
+    # metrics and presence version
+    version: Tuple[int, int]
+    built_at: float
+    overall_metrics: Dict
+    # content type -> encoded networks
+    networks: Dict[str, bytes]
+    # content type -> response with `DEFAULT_TOP_NODES`, the only one which is compressed
+    responses: Dict[str, EncodedResponse] = field(default_factory=dict)
+
+    def etag(self, top: int, content_type: str) -> str:
+        return snapshot_etag(self.version, top, content_type)
+
+    def body_parts(self, top: int, content_type: str) -> List[Union[bytes, memoryview]]:
+        return snapshot_body_parts(
+            self.version[0],
+            self.overall_metrics,
+            self.networks[content_type],
+            top,
+            content_type,
+        )
+
+
+def snapshot_etag(version: Tuple[int, int], top: int, content_type: str) -> str:
+    metrics_version, presence_version = version
+    etag = f'{metrics_version}-{presence_version}-{top}'
+    if content_type == MSGPACK_CONTENT_TYPE:
+        etag += '-msgpack'
+    return etag
+
+
+def snapshot_body_parts(
+    metrics_version: int,
+    overall_metrics: Dict,
+    networks: Union[bytes, memoryview],
+    top: int,
+    content_type: str,
+) -> List[Union[bytes, memoryview]]:
+    """ Returns the parts of a response body, the encoded `networks` are not copied. """
+    overall_metrics = with_top_nodes(overall_metrics, top)
+    if content_type == MSGPACK_CONTENT_TYPE:
+        # the same as packing the whole document as a map
+        packer = msgpack.Packer()
+        return [
+            packer.pack_map_header(2 + NUM_NETWORKS_ENTRIES),
+            packer.pack('version'),
+            packer.pack(metrics_version),
+            packer.pack('overall_metrics'),
+            packer.pack(overall_metrics),
+            networks,
+        ]
+    # the same as encoding the whole response with json.dumps
+    return [
+        b'{"version": %d, "overall_metrics": ' % metrics_version,
+        json.dumps(overall_metrics).encode(),
+        b', "networks": ',
+        networks,
+        b'}',
+    ]
+
+
+def encode_snapshot_response(snapshot: EncodedSnapshot, content_type: str) -> EncodedResponse:
+    """ Puts the response with `DEFAULT_TOP_NODES` together and compresses it.
+
+    Safe to run in another thread, the snapshot doesn't change.
+    """
+    return encode_response(
+        b''.join(snapshot.body_parts(DEFAULT_TOP_NODES, content_type)),
+        snapshot.etag(DEFAULT_TOP_NODES, content_type),
+        snapshot.built_at,
+        content_type,
+    )
+
+
+class NetworkInfoSnapshot:
+    """ Holds the encoded `/json` responses, shared by all requests.
+
+    A builder greenlet encodes the networks into a new `EncodedSnapshot` after the model
+    changed, at most once per `min_rebuild_interval`, and then swaps it in. Requests never
+    build a snapshot, they are served from the current one. Only reading the model runs on
+    the hub, which it can't be switched away from as the model must not change during
+    the build. Compressing the responses, which takes longer, runs in the thread pool of
+    the hub while the other greenlets go on.
+
+    Only the response with `DEFAULT_TOP_NODES` is compressed, once per snapshot. The
+    responses with other `top` values are put together from the encoded networks on each
+    request and sent uncompressed, so they cost about as much as the default one and
+    clients can't make the builder compress the whole body again for each `top`. The
+    networks are encoded in each content type which was requested so far.
+    """
+
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+        min_rebuild_interval: float = MIN_REBUILD_INTERVAL,
+        content_types: Iterable[str] = (JSON_CONTENT_TYPE,),
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+        self.min_rebuild_interval = min_rebuild_interval
+
+        self.builder_greenlet: Optional[Greenlet] = None
+        # called with each new snapshot after it was swapped in
+        self.listeners: List[Callable[[EncodedSnapshot], None]] = []
+        self._snapshot: Optional[EncodedSnapshot] = None
+        # the content types encoded on each rebuild, more are added once they are requested
+        self._content_types: Set[str] = set(content_types)
+        self._changed = gevent.event.Event()
+        # replaced by a new event after it was set for a new snapshot
+        self._swapped = gevent.event.Event()
+        metrics_service.change_log.add_listener(self._handle_change)
+
+    def add_listener(self, callback: Callable[[EncodedSnapshot], None]):
+        self.listeners.append(callback)
+
+    def _handle_change(self, _version: int):
+        self._changed.set()
+
+    def _current_version(self) -> Tuple[int, int]:
+        presence_version = (
+            self.presence_service.version if self.presence_service is not None else 0
+        )
+        return self.metrics_service.version, presence_version
+
+    def start(self):
+        """ Starts the builder, the first snapshot is built right away. """
+        if self.builder_greenlet is None:
+            self._changed.set()
+            self.builder_greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        while True:
+            self._changed.wait()
+            self._changed.clear()
+
+            snapshot = self._snapshot
+            if snapshot is not None:
+                if (
+                    snapshot.version == self._current_version() and
+                    self._content_types.issubset(snapshot.networks)
+                ):
+                    continue
+                # while events keep coming in, e.g. during the initial sync, the changes in
+                # between are merged, unless a new content type is waited for
+                delay = snapshot.built_at + self.min_rebuild_interval - time.monotonic()
+                if delay > 0 and self._content_types.issubset(snapshot.networks):
+                    gevent.sleep(delay)
+
+            try:
+                self._build()
+            except Exception:
+                # the requests keep getting the previous snapshot until the next change
+                log.exception('Failed to build the /json snapshot')
+
+    def _build(self):
+        start = time.monotonic()
+        # the model can't change during the build, there is no gevent switch in between
+        version = self._current_version()
+        token_networks = self.metrics_service.token_networks.values()
+        if self.presence_service is not None:
+            nodes_presence_status = self.presence_service.nodes_presence_status
+        else:
+            nodes_presence_status = {}
+
+        overall_metrics = metrics_to_dict(self.metrics_service.state, MAX_TOP_NODES)
+        networks = {}
+        if JSON_CONTENT_TYPE in self._content_types:
+            # only the encoded chunks are held, not the dicts of all channels and nodes
+            networks[JSON_CONTENT_TYPE] = b''.join(
+                networks_to_json(token_networks, nodes_presence_status)
+            )
+        if MSGPACK_CONTENT_TYPE in self._content_types:
+            networks[MSGPACK_CONTENT_TYPE] = networks_to_msgpack(
+                token_networks,
+                nodes_presence_status,
+            )
+        snapshot = EncodedSnapshot(version, time.monotonic(), overall_metrics, networks)
+        hub_duration = time.monotonic() - start
+
+        for content_type in networks:
+            snapshot.responses[content_type] = gevent.get_hub().threadpool.apply(
+                encode_snapshot_response,
+                (snapshot, content_type),
+            )
+
+        self._snapshot = snapshot
+        swapped, self._swapped = self._swapped, gevent.event.Event()
+        swapped.set()
+        for listener in self.listeners:
+            listener(snapshot)
+
+        duration = time.monotonic() - start
+        API_BUILD_SECONDS.labels('/json').observe(duration)
+        sizes = ', '.join(
+            f'{len(encoded)} bytes {content_type}' for content_type, encoded in networks.items()
+        )
+        log.debug(
+            f'Rebuilt /json snapshot ({sizes}) in {duration:.3f}s, '
+            f'{hub_duration:.3f}s of it on the hub'
+        )
+
+    def _get_snapshot(self, content_type: str) -> EncodedSnapshot:
+        """ Returns the current snapshot, waits for one with `content_type` if needed. """
+        snapshot = self._snapshot
+        if snapshot is None or content_type not in snapshot.networks:
+            self.start()
+            if content_type not in self._content_types:
+                self._content_types.add(content_type)
+                self._changed.set()
+            while snapshot is None or content_type not in snapshot.networks:
+                self._swapped.wait()
+                snapshot = self._snapshot
+        return snapshot
+
+    def get(self, content_type: str = JSON_CONTENT_TYPE) -> EncodedResponse:
+        """ Returns the compressed response with `DEFAULT_TOP_NODES` of the current snapshot.
+
+        Args:
+            content_type: One of `CONTENT_TYPES`
+        """
+        assert content_type in CONTENT_TYPES
+        return self._get_snapshot(content_type).responses[content_type]
+
+    def get_body_parts(
+        self,
+        top: int,
+        content_type: str = JSON_CONTENT_TYPE,
+    ) -> Tuple[str, List[Union[bytes, memoryview]]]:
+        """ Returns the ETag and the uncompressed body parts of the response with `top`.
+
+        Args:
+            top: The number of nodes in `top_nodes_by_channels`, at most `MAX_TOP_NODES`
+            content_type: One of `CONTENT_TYPES`
+        """
+        assert 0 <= top <= MAX_TOP_NODES
+        assert content_type in CONTENT_TYPES
+
+        snapshot = self._get_snapshot(content_type)
+        return snapshot.etag(top, content_type), snapshot.body_parts(top, content_type)
+
+    def etag(
+        self,
+        top: int = DEFAULT_TOP_NODES,
+        content_type: str = JSON_CONTENT_TYPE,
+    ) -> Optional[str]:
+        """ Returns the ETag of the response `get` or `get_body_parts` would return.
+
+        Returns `None` if there is no snapshot with `content_type` yet.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or content_type not in snapshot.networks:
+            return None
+        return snapshot.etag(top, content_type)
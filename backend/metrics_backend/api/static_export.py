@@ -0,0 +1,164 @@
+""" Exports the networks as static files, to be served without any Python on the read path.
+
+The export directory has an `index.json` with the overall metrics and the summary of each
+token network, and a file for each token network in `networks/` with its channels and
+nodes, the same as its entry in `/json`. Each file has gzip and brotli compressed siblings
+ending in `.gz` and `.br` for servers which serve precompressed files. Files are written
+to a temporary file first and renamed, so readers never see a partially written file.
+"""
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import brotli
+import gevent
+import gevent.event
+from gevent import Greenlet
+
+from metrics_backend.api.snapshot import BROTLI_QUALITY, GZIP_COMPRESS_LEVEL
+from metrics_backend.metrics_service import MetricsService
+from metrics_backend.presence_service import PresenceService
+from metrics_backend.utils import Address
+from metrics_backend.utils.persistence import write_atomically
+from metrics_backend.utils.serialisation import (
+    metrics_to_dict,
+    token_network_summary_to_dict,
+    token_network_to_json,
+)
+
+log = logging.getLogger(__name__)
+
+# while events keep coming in, e.g. during the initial sync, export at most this often
+MIN_EXPORT_INTERVAL = 10  # seconds
+INDEX_FILE = 'index.json'
+NETWORKS_DIR = 'networks'
+
+
+def network_file(token_network_address: Address) -> str:
+    """ Returns the path of the file of a token network, relative to the export directory. """
+    return f'{NETWORKS_DIR}/{token_network_address}.json'
+
+
+def write_files(directory: str, files: Dict[str, bytes]):
+    """ Writes the files and their compressed siblings, in the given order. """
+    for path, body in files.items():
+        path = os.path.join(directory, path)
+        write_atomically(f'{path}.gz', gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL))
+        write_atomically(f'{path}.br', brotli.compress(body, quality=BROTLI_QUALITY))
+        write_atomically(path, body)
+
+
+class StaticExporter:
+    """ Writes the networks to static files after the model changed.
+
+    Only the files of the token networks which changed since the last export are written
+    again, these are taken from the change log. Everything is written again if the changes
+    are not known anymore, e.g. after a snapshot was restored. The files are encoded on
+    the hub, as the model must not change meanwhile, but compressed and written in the
+    thread pool of the hub.
+    """
+
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        presence_service: Optional[PresenceService],
+        directory: str,
+        min_export_interval: float = MIN_EXPORT_INTERVAL,
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.presence_service = presence_service
+        self.directory = directory
+        self.min_export_interval = min_export_interval
+
+        self.export_greenlet: Optional[Greenlet] = None
+        # the version of the model which was exported last
+        self.version: Optional[int] = None
+        # token network address -> version its file was written at
+        self.network_versions: Dict[Address, int] = {}
+        self._exported_at = 0.0
+        self._changed = gevent.event.Event()
+        metrics_service.change_log.add_listener(self._handle_change)
+
+    def _handle_change(self, _version: int):
+        self._changed.set()
+
+    def start(self):
+        """ Starts the exporter, the first export happens right away. """
+        if self.export_greenlet is None:
+            os.makedirs(os.path.join(self.directory, NETWORKS_DIR), exist_ok=True)
+            self._changed.set()
+            self.export_greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        while True:
+            self._changed.wait()
+            self._changed.clear()
+            if self.metrics_service.version == self.version:
+                continue
+
+            # the changes in between are merged into the next export
+            delay = self._exported_at + self.min_export_interval - time.monotonic()
+            if delay > 0:
+                gevent.sleep(delay)
+
+            try:
+                self.export()
+            except Exception:
+                # everything changed since the last successful export is written next time
+                log.exception(f'Failed to export the networks to {self.directory}')
+
+    def changed_token_networks(self) -> List[Address]:
+        """ Returns the token networks which changed since the last export. """
+        token_networks = self.metrics_service.token_networks
+        changes = None
+        if self.version is not None:
+            changes = self.metrics_service.change_log.changes_since(self.version)
+        if changes is None:
+            return list(token_networks)
+        return [address for address in changes if address in token_networks]
+
+    def export(self):
+        start = time.monotonic()
+        # the model can't change while the files are encoded, there is no gevent switch
+        version = self.metrics_service.version
+        token_networks = self.metrics_service.token_networks
+        if self.presence_service is not None:
+            nodes_presence_status = self.presence_service.nodes_presence_status
+        else:
+            nodes_presence_status = {}
+
+        files: Dict[str, bytes] = {}
+        network_versions = dict(self.network_versions)
+        for token_network_address in self.changed_token_networks():
+            files[network_file(token_network_address)] = b''.join(token_network_to_json(
+                token_networks[token_network_address],
+                nodes_presence_status,
+            ))
+            network_versions[token_network_address] = version
+
+        index = dict(
+            version=version,
+            overall_metrics=metrics_to_dict(self.metrics_service.state),
+            networks=[
+                dict(
+                    token_network_summary_to_dict(token_network),
+                    version=network_versions[token_network.address],
+                    file=network_file(token_network.address),
+                )
+                for token_network in token_networks.values()
+            ],
+        )
+        # the index is written last, so the files it refers to already exist
+        files[INDEX_FILE] = json.dumps(index).encode()
+        gevent.get_hub().threadpool.apply(write_files, (self.directory, files))
+
+        self.version = version
+        self.network_versions = network_versions
+        self._exported_at = time.monotonic()
+        log.info(
+            f'Exported {len(files) - 1} of {len(token_networks)} token networks to '
+            f'{self.directory} in {time.monotonic() - start:.3f}s'
+        )
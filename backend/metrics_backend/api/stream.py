@@ -0,0 +1,109 @@
+import json
+import time
+from typing import Iterator, Optional
+
+import gevent
+import gevent.event
+
+from metrics_backend.api.changes import NetworkChanges
+from metrics_backend.metrics_service import MetricsService
+from metrics_backend.utils.instrumentation import STREAM_CLIENTS
+from metrics_backend.utils.serialisation import DEFAULT_TOP_NODES
+
+# a client gets at most one event per interval, the changes in between are merged
+MIN_EVENT_INTERVAL = 1  # seconds
+# a comment is sent after this long without events, so dead connections are noticed
+KEEPALIVE_INTERVAL = 15  # seconds
+MAX_STREAM_CLIENTS = 5_000
+
+
+def _format_event(event: str, data: bytes, event_id: Optional[int] = None) -> bytes:
+    """ Formats a server-sent event, `data` has to be on a single line. """
+    lines = [] if event_id is None else [b'id: %d' % event_id]
+    lines.append(b'event: ' + event.encode())
+    lines.append(b'data: ' + data)
+    return b'\n'.join(lines) + b'\n\n'
+
+
+class ChangeStream:
+    """ Pushes the changes of the model to server-sent event clients.
+
+    Clients don't get a queue of their own. Each of them only remembers the version it has
+    seen last and is sent the changes since then from `NetworkChanges`, which encodes them
+    once for all clients at the same version. A client which is slow to read, or which is
+    rate limited by `min_event_interval`, gets all changes in between merged into one
+    event. If its version is dropped from the change log in the meantime, it is told to
+    resync. Waiting clients share a single event, so idle connections cost one greenlet.
+    """
+
+    def __init__(
+        self,
+        metrics_service: MetricsService,
+        network_changes: NetworkChanges,
+        *,
+        min_event_interval: float = MIN_EVENT_INTERVAL,
+        keepalive_interval: float = KEEPALIVE_INTERVAL,
+        max_clients: int = MAX_STREAM_CLIENTS,
+    ) -> None:
+        self.metrics_service = metrics_service
+        self.network_changes = network_changes
+        self.min_event_interval = min_event_interval
+        self.keepalive_interval = keepalive_interval
+        self.max_clients = max_clients
+
+        self.num_clients = 0
+        # replaced by a new event after it was set for a new version
+        self._new_version = gevent.event.Event()
+        metrics_service.change_log.add_listener(self._handle_new_version)
+
+    def _handle_new_version(self, _version: int):
+        new_version, self._new_version = self._new_version, gevent.event.Event()
+        new_version.set()
+
+    def _wait_for_change(self, version: int) -> bool:
+        """ Waits for a version after `version`, returns `False` after the keepalive interval. """
+        if self.metrics_service.version != version:
+            return True
+        return self._new_version.wait(self.keepalive_interval)
+
+    def is_full(self) -> bool:
+        return self.num_clients >= self.max_clients
+
+    def events(
+        self,
+        since: Optional[int] = None,
+        top: int = DEFAULT_TOP_NODES,
+    ) -> Iterator[bytes]:
+        """ Yields the server-sent events for one client, starting after version `since`.
+
+        Without `since`, the client is only sent the changes after it connected.
+        """
+        self.num_clients += 1
+        STREAM_CLIENTS.inc()
+        try:
+            version = self.metrics_service.version if since is None else since
+            yield _format_event('version', json.dumps({'version': version}).encode(), version)
+
+            last_event = 0.0
+            while True:
+                if not self._wait_for_change(version):
+                    yield b': keepalive\n\n'
+                    continue
+
+                # merges the changes of the versions created while waiting
+                delay = last_event + self.min_event_interval - time.monotonic()
+                if delay > 0:
+                    gevent.sleep(delay)
+
+                changes_version = self.metrics_service.version
+                body = self.network_changes.get(version, top).body
+                last_event = time.monotonic()
+                if not self.metrics_service.change_log.knows(version):
+                    yield _format_event('resync', body, changes_version)
+                    return
+
+                version = changes_version
+                yield _format_event('changes', body, version)
+        finally:
+            self.num_clients -= 1
+            STREAM_CLIENTS.dec()
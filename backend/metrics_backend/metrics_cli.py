@@ -1,13 +1,15 @@
 from gevent import monkey  # isort:skip # noqa
 monkey.patch_all()  # isort:skip # noqa
 
+import atexit
 import contextlib
-import json
 import logging
 import os
 import sys
+import time
 import warnings
 from functools import partialmethod
+from typing import Optional
 
 import click
 import gevent
@@ -28,17 +30,26 @@ from requests.exceptions import ConnectionError
 from web3 import HTTPProvider, Web3
 
 from metrics_backend.api.rest import NetworkInfoAPI
+from metrics_backend.api.shared_snapshot import (
+    DEFAULT_SNAPSHOT_PATH,
+    start_workers,
+    stop_workers,
+)
+from metrics_backend.api.snapshot import MIN_REBUILD_INTERVAL
+from metrics_backend.api.static_export import StaticExporter
 from metrics_backend.metrics_service import MetricsService
 from metrics_backend.presence_service import PresenceService
-from metrics_backend.utils.serialisation import token_network_to_dict
+from metrics_backend.utils.event_log import EventLogWriter, has_events, iter_event_log
+from metrics_backend.utils.head_subscription import HeadSubscription
+from metrics_backend.utils.instrumentation import rpc_metrics_middleware
+from metrics_backend.utils.persistence import load_snapshot, save_snapshot, snapshot_path
+from metrics_backend.utils.token import TOKEN_INFO_CACHE_FILE, TokenInfoCache
 
 log = logging.getLogger(__name__)
 
 DEFAULT_PORT = 4567
-OUTPUT_FILE = 'network-info.json'
-TEMP_FILE = 'tmp.json'
-OUTPUT_PERIOD = 10  # seconds
 REQUIRED_CONFIRMATIONS = 5
+SNAPSHOT_INTERVAL = 300  # seconds
 
 
 @contextlib.contextmanager
@@ -54,12 +65,23 @@ def no_ssl_verification():
 
 
 @click.command()
+@click.argument(
+    'mode',
+    default='serve',
+    type=click.Choice(['serve', 'replay']),
+)
 @click.option(
     '--eth-rpc',
     default='http://geth.ropsten.ethnodes.brainbot.com:8545',
     type=str,
     help='Ethereum node RPC URI'
 )
+@click.option(
+    '--eth-ws',
+    default=None,
+    type=str,
+    help='WebSocket URI of the same Ethereum node, used to subscribe to new blocks'
+)
 @click.option(
     '--registry-address',
     type=str,
@@ -89,13 +111,78 @@ def no_ssl_verification():
     type=str,
     help='Use addresses for contracts of this version. Default: latest'
 )
+@click.option(
+    '--state-dir',
+    default=None,
+    type=click.Path(file_okay=False),
+    help='Directory to persist the state in, syncing resumes from it after a restart'
+)
+@click.option(
+    '--snapshot-interval',
+    default=SNAPSHOT_INTERVAL,
+    type=int,
+    help='Interval in seconds between state snapshots'
+)
+@click.option(
+    '--event-log-dir',
+    default=None,
+    type=click.Path(file_okay=False),
+    help='Directory to append all confirmed raw events to, used by the replay mode. '
+    'A log with events is only continued from a snapshot in --state-dir'
+)
+@click.option(
+    '--compact-channels',
+    is_flag=True,
+    help='Keep the channels in a columnar store, which needs much less memory'
+)
+@click.option(
+    '--rebuild-interval',
+    default=MIN_REBUILD_INTERVAL,
+    type=float,
+    help='Minimum interval in seconds between rebuilds of the /json response'
+)
+@click.option(
+    '--export-dir',
+    default=None,
+    type=click.Path(file_okay=False),
+    help='Directory to export the networks to as static files after changes'
+)
+@click.option(
+    '--api-workers',
+    default=0,
+    type=int,
+    help='Number of worker processes serving /json on --workers-port from a shared snapshot'
+)
+@click.option(
+    '--workers-port',
+    default=DEFAULT_PORT + 1,
+    type=int,
+    help='Port of the /json workers, the other endpoints stay on --port'
+)
+@click.option(
+    '--shared-snapshot-path',
+    default=DEFAULT_SNAPSHOT_PATH,
+    type=click.Path(dir_okay=False),
+    help='File the /json snapshot is shared with the workers in'
+)
 def main(
+    mode,
     eth_rpc,
+    eth_ws,
     registry_address,
     start_block,
     port,
     confirmations,
     contracts_version,
+    state_dir,
+    snapshot_interval,
+    event_log_dir,
+    compact_channels,
+    rebuild_interval,
+    export_dir,
+    api_workers,
+    workers_port,
+    shared_snapshot_path,
 ):
     # setup logging
     logging.basicConfig(
@@ -107,6 +194,31 @@ def main(
     logging.getLogger('web3').setLevel(logging.INFO)
     logging.getLogger('urllib3.connectionpool').setLevel(logging.ERROR)
 
+    if contracts_version is None:
+        contracts_version = CONTRACTS_VERSION
+
+    if api_workers > 0:
+        # forked before anything else is started, the workers only read the snapshot file
+        worker_pids = start_workers(shared_snapshot_path, workers_port, api_workers)
+        atexit.register(stop_workers, worker_pids)
+        print(f'Running {api_workers} /json workers at http://localhost:{workers_port}/json')
+    else:
+        shared_snapshot_path = None
+
+    if mode == 'replay':
+        if event_log_dir is None:
+            log.error('The replay mode requires --event-log-dir')
+            sys.exit(1)
+        replay(
+            event_log_dir,
+            contracts_version,
+            port,
+            compact_channels,
+            rebuild_interval,
+            shared_snapshot_path,
+        )
+        return 0
+
     log.info("Starting Raiden Metrics Server")
     try:
         log.info(f'Starting Web3 client for node at {eth_rpc}')
@@ -118,6 +230,7 @@ def main(
         )
 
         web3 = Web3(provider)
+        web3.middleware_onion.add(rpc_metrics_middleware)
     except ConnectionError:
         log.error(
             'Can not connect to the Ethereum client. Please check that it is running and that '
@@ -125,8 +238,6 @@ def main(
         )
         sys.exit()
 
-    if contracts_version is None:
-        contracts_version = CONTRACTS_VERSION
     log.info(f'Using contracts version: {contracts_version}')
 
     with no_ssl_verification():
@@ -151,14 +262,46 @@ def main(
         try:
             contract_manager = ContractManager(contracts_precompiled_path(contracts_version))
 
+            token_info_cache = None
+            if state_dir is not None:
+                os.makedirs(state_dir, exist_ok=True)
+                token_info_cache = TokenInfoCache(os.path.join(state_dir, TOKEN_INFO_CACHE_FILE))
+
             metrics_service = MetricsService(
                 web3=web3,
                 contract_manager=contract_manager,
                 registry_address=registry_address,
                 sync_start_block=start_block,
                 required_confirmations=confirmations,
+                event_log=EventLogWriter(event_log_dir) if event_log_dir is not None else None,
+                token_info_cache=token_info_cache,
+                head_subscription=HeadSubscription(eth_ws) if eth_ws is not None else None,
+                compact_channels=compact_channels,
             )
 
+            if state_dir is not None:
+                snapshot = load_snapshot(snapshot_path(state_dir))
+                if snapshot is not None:
+                    metrics_service.restore_snapshot(snapshot)
+                gevent.spawn(
+                    snapshot_task,
+                    metrics_service,
+                    snapshot_path(state_dir),
+                    snapshot_interval,
+                )
+
+            if (
+                event_log_dir is not None and
+                metrics_service.event_log_position is None and
+                has_events(event_log_dir)
+            ):
+                # a new log would have to drop the events, which may be the only copy
+                log.error(
+                    f'{event_log_dir} has events, but no snapshot with a position in it. Use '
+                    f'the --state-dir of the run which wrote them, or another --event-log-dir.'
+                )
+                sys.exit(1)
+
             presence_service = PresenceService(
                 privkey_seed=f'EXPLORER_{web3.eth.chainId}',
                 contract_manager=contract_manager,
@@ -166,11 +309,18 @@ def main(
                 block_confirmations=REQUIRED_CONFIRMATIONS,
                 service_registry_address=to_canonical_address(service_registry_address),
             )
+            # the changed online status is part of the changes of the model
+            presence_service.add_update_listener(metrics_service.handle_presence_update)
 
-            # re-enable once deployment works
-            # gevent.spawn(write_topology_task, service)
+            if export_dir is not None:
+                StaticExporter(metrics_service, presence_service, export_dir).start()
 
-            api = NetworkInfoAPI(metrics_service, presence_service)
+            api = NetworkInfoAPI(
+                metrics_service,
+                presence_service,
+                rebuild_interval,
+                shared_snapshot_path,
+            )
             api.run(port=port)
             print(f'Running metrics endpoint at http://localhost:{port}/json')
 
@@ -185,6 +335,8 @@ def main(
             if metrics_service:
                 log.info('Stopping Raiden Metrics Backend')
                 metrics_service.stop()
+                if state_dir is not None:
+                    save_state(metrics_service, snapshot_path(state_dir))
             if presence_service:
                 log.info('Stopping Raiden Presence Backend')
                 presence_service.stop()
@@ -192,28 +344,59 @@ def main(
     return 0
 
 
-def write_topology_task(pathfinding_service: MetricsService):
-    while True:
-        result = dict(
-            num_networks=len(pathfinding_service.token_networks),
-        )
+def replay(
+    event_log_dir: str,
+    contracts_version: str,
+    port: int,
+    compact_channels: bool,
+    rebuild_interval: float,
+    shared_snapshot_path: Optional[str],
+):
+    """ Rebuilds the model from the event log and serves it, without an Ethereum node. """
+    log.info(f'Replaying events from {event_log_dir} (contracts version {contracts_version})')
+    # the events are too many to log each of them
+    logging.getLogger('metrics_backend.metrics_service').setLevel(logging.WARNING)
+    logging.getLogger('metrics_backend.model').setLevel(logging.WARNING)
+
+    metrics_service = MetricsService(
+        web3=Web3(),  # only used for its ABI codec
+        contract_manager=ContractManager(contracts_precompiled_path(contracts_version)),
+        registry_address=None,
+        fetch_token_info=False,
+        compact_channels=compact_channels,
+    )
+
+    start = time.monotonic()
+    num_events = metrics_service.replay(iter_event_log(event_log_dir))
+    duration = time.monotonic() - start
+    log.info(
+        f'Replayed {num_events} events into {len(metrics_service.token_networks)} token '
+        f'networks in {duration:.1f}s ({num_events / max(duration, 1e-9):.0f} events/s)'
+    )
+
+    api = NetworkInfoAPI(
+        metrics_service,
+        presence_service=None,
+        rebuild_interval=rebuild_interval,
+        shared_snapshot_path=shared_snapshot_path,
+    )
+    api.run(port=port)
+    print(f'Running metrics endpoint at http://localhost:{port}/json')
+    api.server_greenlet.join()
 
-        result.update(
-            {
-                network.address: token_network_to_dict(network)
-                for network in pathfinding_service.token_networks.values()
-            }
-        )
 
-        # write to a temp file, then rename to have a consistent file all the time
-        # rename is atomic
-        with open(TEMP_FILE, 'w') as f:
-            json.dump(result, f)
+def save_state(metrics_service: MetricsService, path: str):
+    snapshot = metrics_service.create_snapshot()
+    if snapshot is None:
+        log.warning('Not saving a snapshot after a failed update, keeping the last one')
+        return
+    save_snapshot(path, snapshot)
 
-        os.rename(TEMP_FILE, OUTPUT_FILE)
-        log.info(f'Wrote network infos to {OUTPUT_FILE}')
 
-        gevent.sleep(OUTPUT_PERIOD)
+def snapshot_task(metrics_service: MetricsService, path: str, interval: int):
+    while True:
+        gevent.sleep(interval)
+        save_state(metrics_service, path)
 
 
 if __name__ == "__main__":
@@ -1,27 +1,42 @@
 import logging
 import sys
 import traceback
-from typing import Dict, Optional, List
+from typing import Dict, Iterable, List, Optional, Set
 
 import gevent
 from gevent.hub import Hub
 from web3 import Web3
-from eth_utils import is_checksum_address
-from metrics_backend.utils import Address
+from metrics_backend.utils import Address, ChannelIdentifier
 from raiden_contracts.contract_manager import ContractManager
 from raiden_contracts.constants import (
     ChannelEvent,
     CONTRACT_TOKEN_NETWORK,
-    CONTRACT_HUMAN_STANDARD_TOKEN,
     CONTRACT_TOKEN_NETWORK_REGISTRY,
 )
-from metrics_backend.model import TokenNetwork, PaymentNetworkMetrics
+from metrics_backend.model import (
+    ChangeLog,
+    NodeIndex,
+    PaymentNetworkMetrics,
+    TokenInfo,
+    TokenNetwork,
+)
+from metrics_backend.utils.address_registry import AddressId, address_registry
+from metrics_backend.utils.block_headers import BlockHeaderCache, HEADER_CACHE_MARGIN
 from metrics_backend.utils.blockchain_listener import (
     BlockchainListener,
     create_registry_event_topics,
     create_channel_event_topics,
 )
-from metrics_backend.utils.token import get_token_info
+from metrics_backend.utils.event_decoder import get_event_decoder
+from metrics_backend.utils.event_log import EventLogPosition, EventLogWriter
+from metrics_backend.utils.head_subscription import HeadSubscription
+from metrics_backend.utils.instrumentation import EVENTS_HANDLED
+from metrics_backend.utils.persistence import encode_snapshot
+from metrics_backend.utils.token import (
+    DEFAULT_TOKEN_DECIMALS,
+    TokenInfoCache,
+    TokenInfoResolver,
+)
 
 log = logging.getLogger(__name__)
 IGNORE_ERROR = Hub.SYSTEM_ERROR + Hub.NOT_ERROR
@@ -59,26 +74,61 @@ class MetricsService(gevent.Greenlet):
         self,
         web3: Web3,
         contract_manager: ContractManager,
-        registry_address: Address,
+        registry_address: Optional[Address],
         sync_start_block: int = 0,
         required_confirmations: int = 5,  # the default
+        event_log: Optional[EventLogWriter] = None,
+        fetch_token_info: bool = True,
+        token_info_cache: Optional[TokenInfoCache] = None,
+        head_subscription: Optional[HeadSubscription] = None,
+        compact_channels: bool = False,
     ) -> None:
         """ Creates a new metrics service
 
         Args:
             contract_manager: A contract manager
             token_network_registry_listener: A blockchain listener object for the network registry
+            event_log: A log all confirmed raw events are appended to
+            fetch_token_info: Whether to query the token contracts for their name and symbol
+            token_info_cache: A persistent cache for the token infos
+            head_subscription: A subscription to new heads, replaces polling while it is active
+            compact_channels: Whether to keep the channels in columnar ChannelStores
         """
         super().__init__()
         self.web3 = web3
         self.contract_manager = contract_manager
+        self.registry_address = registry_address
         self.required_confirmations = required_confirmations
+        self.head_subscription = head_subscription
+        self.compact_channels = compact_channels
+
+        self.event_log = event_log
+        # the event log is continued from here, `None` starts a new log in an empty directory
+        self.event_log_position: Optional[EventLogPosition] = None
 
         self.is_running = gevent.event.Event()
         self.token_networks: Dict[Address, TokenNetwork] = {}
-        self.token_network_listeners: List[BlockchainListener] = []
 
         self.state = PaymentNetworkMetrics()
+        # the token networks of each node, kept up to date by the event handlers
+        self.node_index = NodeIndex()
+        # a new version is committed after every batch of events, see `version`
+        self.change_log = ChangeLog()
+
+        # token infos are filled in by the resolver, outside of the event handlers
+        self.token_info_resolver: Optional[TokenInfoResolver] = None
+        if fetch_token_info:
+            self.token_info_resolver = TokenInfoResolver(
+                web3,
+                token_info_cache,
+                on_update=self.handle_token_infos_updated,
+            )
+
+        # the recent block hashes are shared by all listeners
+        self.block_headers = BlockHeaderCache(
+            web3,
+            self.required_confirmations + HEADER_CACHE_MARGIN,
+        )
 
         log.info('Starting TokenNetworkRegistry Listener (required confirmations: {})...'.format(
             self.required_confirmations,
@@ -90,11 +140,26 @@ class MetricsService(gevent.Greenlet):
             contract_address=registry_address,
             sync_start_block=sync_start_block,
             required_confirmations=self.required_confirmations,
+            block_headers=self.block_headers,
+            event_log=self.event_log,
+            head_subscription=self.head_subscription,
         )
         log.info(
             f'Listening to token network registry @ {registry_address} '
             f'from block {sync_start_block}'
         )
+
+        # a single listener follows all token networks, they are added as they are created
+        self.token_network_listener = BlockchainListener(
+            web3=web3,
+            contract_manager=contract_manager,
+            contract_name=CONTRACT_TOKEN_NETWORK,
+            sync_start_block=sync_start_block,
+            required_confirmations=self.required_confirmations,
+            block_headers=self.block_headers,
+            event_log=self.event_log,
+            head_subscription=self.head_subscription,
+        )
         self._setup_token_networks()
 
     def _setup_token_networks(self):
@@ -102,27 +167,178 @@ class MetricsService(gevent.Greenlet):
             create_registry_event_topics(self.contract_manager),
             self.handle_token_network_created
         )
+        self.token_network_registry_listener.add_batch_listener(self.change_log.commit)
+
+        # subscribe to event notifications from blockchain listener
+        self.token_network_listener.add_confirmed_listener(
+            create_channel_event_topics(),
+            self.handle_channel_event,
+        )
+        self.token_network_listener.add_batch_listener(self.change_log.commit)
 
     def _run(self):
         register_error_handler(error_handler)
+        if self.event_log is not None:
+            self.event_log.open(self.event_log_position)
+        if self.head_subscription is not None:
+            self.head_subscription.start()
+        if self.token_info_resolver is not None:
+            self.token_info_resolver.start()
         if self.token_network_registry_listener is not None:
             self.token_network_registry_listener.start()
+        self.token_network_listener.start()
 
         self.is_running.wait()
 
     def stop(self):
+        if self.head_subscription is not None:
+            self.head_subscription.stop()
+        if self.token_info_resolver is not None:
+            self.token_info_resolver.stop()
+        self.token_network_registry_listener.stop()
+        self.token_network_listener.stop()
         self.is_running.set()
 
+    @property
+    def version(self) -> int:
+        """ Increases with every batch of changes to the model, see `change_log`. """
+        return self.change_log.version
+
+    @property
+    def is_consistent(self) -> bool:
+        """ Whether the model contains exactly the events up to the confirmed heads.
+
+        Not the case after a listener failed while handling the events of an update, a
+        snapshot would then apply them a second time when it is restored.
+        """
+        return (
+            self.token_network_registry_listener.is_consistent and
+            self.token_network_listener.is_consistent
+        )
+
+    def create_snapshot(self) -> Optional[bytes]:
+        """ Returns a serialised snapshot of the model and the sync state of the listeners.
+
+        Both listeners are paused while the snapshot is taken, so the model contains exactly
+        the events up to their confirmed heads. Returns `None` if it doesn't, see
+        `is_consistent`.
+        """
+        registry_listener = self.token_network_registry_listener
+        with registry_listener.update_lock, self.token_network_listener.update_lock:
+            if not self.is_consistent:
+                return None
+            return encode_snapshot(dict(
+                registry_address=self.registry_address,
+                # the model refers to the addresses by their ids
+                addresses=list(address_registry.checksum_addresses),
+                token_networks=self.token_networks,
+                state=self.state,
+                registry_listener=registry_listener.get_state(),
+                token_network_listener=self.token_network_listener.get_state(),
+                event_log_position=self._event_log_position(),
+            ))
+
+    def _event_log_position(self) -> Optional[EventLogPosition]:
+        if self.event_log is None:
+            return None
+        position = self.event_log.position()
+        # before the log is opened, the events end where the restored snapshot left them
+        return position if position is not None else self.event_log_position
+
+    def restore_snapshot(self, snapshot: Dict) -> bool:
+        """ Restores the model and resumes syncing from a snapshot.
+
+        The snapshot is only used if the confirmed heads it was taken at are still part of
+        the chain. Must be called before the service is started.
+
+        Returns:
+            Whether the snapshot was restored
+        """
+        if snapshot['registry_address'] != self.registry_address:
+            log.warning(
+                f'Ignoring snapshot for token network registry {snapshot["registry_address"]}'
+            )
+            return False
+
+        listener_states = [snapshot['registry_listener'], snapshot['token_network_listener']]
+        for listener_state in listener_states:
+            head_number = listener_state['confirmed_head_number']
+            head_hash = listener_state['confirmed_head_hash']
+            if head_hash is None:
+                continue
+
+            current_hash = self.block_headers.get_hashes([head_number])[head_number]
+            if current_hash != head_hash:
+                log.warning(
+                    f'Ignoring snapshot, block {head_number} has hash {current_hash!r}, '
+                    f'but the snapshot was taken at {head_hash!r}'
+                )
+                return False
+
+        try:
+            address_registry.restore(snapshot['addresses'])
+        except ValueError as e:
+            log.warning(f'Ignoring snapshot, its addresses conflict with the known ones: {e}')
+            return False
+
+        self.token_networks = snapshot['token_networks']
+        self.state = snapshot['state']
+        self.node_index = NodeIndex.from_token_networks(self.token_networks.values())
+        self.change_log.reset()
+        self.token_network_registry_listener.restore_state(snapshot['registry_listener'])
+        self.token_network_listener.restore_state(snapshot['token_network_listener'])
+        if self.token_info_resolver is not None:
+            # fills in the token infos which were not resolved when the snapshot was taken
+            for token_network in self.token_networks.values():
+                self.token_info_resolver.resolve(token_network.token_info)
+        self.event_log_position = snapshot['event_log_position']
+        if self.event_log is not None and self.event_log_position is None:
+            log.warning('The snapshot has no event log position, the event log can\'t continue')
+        log.info(
+            'Restored %d token networks from snapshot, resuming at block %d',
+            len(self.token_networks),
+            self.token_network_listener.confirmed_head_number,
+        )
+        return True
+
+    def replay(self, raw_events: Iterable[Dict]) -> int:
+        """ Rebuilds the model from raw events, e.g. read from an event log.
+
+        Returns:
+            The number of replayed events
+        """
+        registry_decoder = get_event_decoder(
+            self.contract_manager,
+            CONTRACT_TOKEN_NETWORK_REGISTRY,
+            self.web3.codec,
+        )
+        channel_decoder = get_event_decoder(
+            self.contract_manager,
+            CONTRACT_TOKEN_NETWORK,
+            self.web3.codec,
+        )
+
+        num_events = 0
+        for raw_event in raw_events:
+            topic = bytes(raw_event['topics'][0])
+            if topic in registry_decoder.decoders:
+                self.handle_token_network_created(registry_decoder.decode(raw_event))
+            else:
+                self.handle_channel_event(channel_decoder.decode(raw_event))
+            num_events += 1
+        self.change_log.commit()
+        return num_events
+
     def follows_token_network(self, token_network_address: Address) -> bool:
         """ Checks if a token network is followed by the pathfinding service. """
-        assert is_checksum_address(token_network_address)
+        assert address_registry.is_checksum_address(token_network_address)
 
         return token_network_address in self.token_networks.keys()
 
     def _get_token_network(self, token_network_address: Address) -> Optional[TokenNetwork]:
         """ Returns the `TokenNetwork` for the given address or `None` for unknown networks. """
 
-        assert is_checksum_address(token_network_address)
+        assert address_registry.is_checksum_address(token_network_address)
 
         if not self.follows_token_network(token_network_address):
             return None
@@ -131,6 +347,7 @@ class MetricsService(gevent.Greenlet):
 
     def handle_channel_event(self, event: Dict):
         event_name = event['event']
+        EVENTS_HANDLED.labels(event_name).inc()
 
         if event_name == ChannelEvent.OPENED:
             self.handle_channel_opened(event)
@@ -167,6 +384,9 @@ class MetricsService(gevent.Greenlet):
             participant1,
             participant2
         )
+        self.node_index.add(address_registry.intern(participant1), token_network.address)
+        self.node_index.add(address_registry.intern(participant2), token_network.address)
+        self._record_channel_change(token_network, channel_identifier)
 
     def handle_channel_new_deposit(self, event: Dict):
         token_network = self._get_token_network(event['address'])
@@ -190,6 +410,7 @@ class MetricsService(gevent.Greenlet):
             participant_address,
             total_deposit
         )
+        self._record_channel_change(token_network, channel_identifier)
 
     def handle_channel_withdraw(self, event: Dict):
         token_network = self._get_token_network(event['address'])
@@ -213,6 +434,7 @@ class MetricsService(gevent.Greenlet):
             participant_address,
             total_withdraw
         )
+        self._record_channel_change(token_network, channel_identifier)
 
     def handle_channel_closed(self, event: Dict):
         token_network = self._get_token_network(event['address'])
@@ -236,6 +458,7 @@ class MetricsService(gevent.Greenlet):
             )
         
         token_network.handle_channel_closed_event(channel_identifier)
+        self._record_channel_change(token_network, channel_identifier)
 
     def handle_channel_settled(self, event: Dict):
         token_network = self._get_token_network(event['address'])
@@ -252,14 +475,47 @@ class MetricsService(gevent.Greenlet):
 
         self.state.handle_channel_settled_event()
         token_network.handle_channel_settled_event(channel_identifier)
+        self._record_channel_change(token_network, channel_identifier)
+
+    def _record_channel_change(
+        self,
+        token_network: TokenNetwork,
+        channel_identifier: ChannelIdentifier,
+    ):
+        channel = token_network.get_channel(channel_identifier)
+        if channel is None:
+            self.change_log.record_token_network(token_network.address)
+        else:
+            self.change_log.record_channel(
+                token_network.address,
+                channel_identifier,
+                (channel.participant1_id, channel.participant2_id),
+            )
+
+    def handle_token_infos_updated(self, token_infos: List[TokenInfo]):
+        """ Records the token networks whose token infos were resolved. """
+        updated = {id(token_info) for token_info in token_infos}
+        for token_network in self.token_networks.values():
+            if id(token_network.token_info) in updated:
+                self.change_log.record_token_network(token_network.address)
+        self.change_log.commit()
+
+    def handle_presence_update(self, nodes: Set[AddressId]):
+        """ Records the node entries of the nodes whose presence status changed. """
+        for token_network in self.token_networks.values():
+            for node in nodes:
+                if node in token_network.participants:
+                    self.change_log.record_node(token_network.address, node)
+        self.change_log.commit()
 
     def handle_token_network_created(self, event):
+        EVENTS_HANDLED.labels(event['event']).inc()
         token_network_address = event['args']['token_network_address']
         token_address = event['args']['token_address']
         event_block_number = event['blockNumber']
 
-        assert is_checksum_address(token_network_address)
-        assert is_checksum_address(token_address)
+        assert address_registry.is_checksum_address(token_network_address)
+        assert address_registry.is_checksum_address(token_address)
 
         if not self.follows_token_network(token_network_address):
             log.info(f'Found token network for token {token_address} @ {token_network_address}')
@@ -275,32 +531,20 @@ class MetricsService(gevent.Greenlet):
         token_address: Address,
         block_number: int = 0,
     ):
-        # get token infos
-        token_contract = self.web3.eth.contract(
-            address=token_address,
-            abi=self.contract_manager.get_contract_abi(CONTRACT_HUMAN_STANDARD_TOKEN),
+        # the token infos are resolved in the background
+        token_infos = TokenInfo(token_address, '', '', DEFAULT_TOKEN_DECIMALS)
+        if self.token_info_resolver is not None:
+            self.token_info_resolver.resolve(token_infos)
+
+        token_network = TokenNetwork(
+            token_network_address,
+            token_infos,
+            compact_channels=self.compact_channels,
         )
-        token_infos = get_token_info(token_contract)
-
-        token_network = TokenNetwork(token_network_address, token_infos)
         self.token_networks[token_network_address] = token_network
+        self.change_log.record_token_network(token_network_address)
 
         self.state.handle_token_network_created()
 
         log.info('Creating token network for %s, token=%r', token_network_address, token_infos)
-        token_network_listener = BlockchainListener(
-            web3=self.web3,
-            contract_manager=self.contract_manager,
-            contract_address=token_network_address,
-            contract_name=CONTRACT_TOKEN_NETWORK,
-            sync_start_block=block_number,
-            required_confirmations=self.required_confirmations,
-        )
-
-        # subscribe to event notifications from blockchain listener
-        token_network_listener.add_confirmed_listener(
-            create_channel_event_topics(),
-            self.handle_channel_event,
-        )
-        token_network_listener.start()
-        self.token_network_listeners.append(token_network_listener)
+        self.token_network_listener.add_contract_address(token_network_address, block_number)
@@ -1,11 +1,22 @@
 from .channel_view import ChannelView
+from .channel_store import ChannelStore
+from .channel_index import ChannelIndex
 from .token_network import TokenNetwork, TokenInfo, ParticipantsChannels
+from .node_ranking import NodeRanking
 from .payment_network_metrics import PaymentNetworkMetrics
+from .node_index import NodeIndex
+from .change_log import ChangeLog, TokenNetworkChanges
 
 __all__ = [
     'ChannelView',
+    'ChannelStore',
+    'ChannelIndex',
     'TokenNetwork',
     'TokenInfo',
     'ParticipantsChannels',
+    'NodeRanking',
     'PaymentNetworkMetrics',
+    'NodeIndex',
+    'ChangeLog',
+    'TokenNetworkChanges',
 ]
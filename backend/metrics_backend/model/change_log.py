@@ -0,0 +1,126 @@
+import time
+from collections import deque
+from itertools import islice
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from metrics_backend.utils import Address, ChannelIdentifier
+from metrics_backend.utils.address_registry import AddressId
+
+# the number of versions changes can be requested for
+MAX_CHANGE_LOG_VERSIONS = 1_000
+
+
+@dataclass
+class TokenNetworkChanges:
+    """ The channels and nodes of a token network which changed. """
+    channels: Set[ChannelIdentifier] = field(default_factory=set)
+    nodes: Set[AddressId] = field(default_factory=set)
+
+    def update(self, other: 'TokenNetworkChanges'):
+        self.channels.update(other.channels)
+        self.nodes.update(other.nodes)
+
+
+# token network address -> its changes
+Changes = Dict[Address, TokenNetworkChanges]
+
+
+class ChangeLog:
+    """ Records which parts of the model changed, per version.
+
+    Changes are collected until `commit` is called after a batch of events, which creates a
+    new version. Only the most recent `max_versions` versions are kept, older ones are
+    dropped as a whole.
+
+    Versions start at the creation time in milliseconds, so the versions of a restarted
+    process are higher than the ones handed out before and are never confused with them.
+    """
+
+    def __init__(self, max_versions: int = MAX_CHANGE_LOG_VERSIONS) -> None:
+        self.max_versions = max_versions
+        self.version = int(time.time() * 1000)
+        # the changes since this version are known
+        self.oldest_version = self.version
+
+        # the changes of version `oldest_version + 1 + i` at index i
+        self._versions: Deque[Changes] = deque()
+        self._pending: Changes = {}
+        # called with the new version after each commit
+        self.listeners: List[Callable[[int], None]] = []
+
+    def add_listener(self, callback: Callable[[int], None]):
+        self.listeners.append(callback)
+
+    def record_token_network(self, token_network_address: Address) -> TokenNetworkChanges:
+        """ Records a change of the token network itself, e.g. of its token info. """
+        changes = self._pending.get(token_network_address)
+        if changes is None:
+            changes = self._pending[token_network_address] = TokenNetworkChanges()
+        return changes
+
+    def record_channel(
+        self,
+        token_network_address: Address,
+        channel_identifier: ChannelIdentifier,
+        participants: Iterable[AddressId] = (),
+    ):
+        """ Records a change of a channel and of the node entries of its participants. """
+        changes = self.record_token_network(token_network_address)
+        changes.channels.add(channel_identifier)
+        changes.nodes.update(participants)
+
+    def record_node(self, token_network_address: Address, node: AddressId):
+        self.record_token_network(token_network_address).nodes.add(node)
+
+    def commit(self) -> int:
+        """ Creates a new version from the changes recorded since the last commit.
+
+        Returns:
+            The current version, which only changes if something was recorded
+        """
+        if len(self._pending) == 0:
+            return self.version
+
+        self._versions.append(self._pending)
+        self._pending = {}
+        self.version += 1
+        while len(self._versions) > self.max_versions:
+            self._versions.popleft()
+            self.oldest_version += 1
+        self._notify()
+        return self.version
+
+    def reset(self):
+        """ Forgets all changes, e.g. after the model was replaced. """
+        self._versions.clear()
+        self._pending = {}
+        self.version += 1
+        self.oldest_version = self.version
+        self._notify()
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener(self.version)
+
+    def knows(self, version: int) -> bool:
+        """ Tells if the changes since `version` are still known. """
+        return self.oldest_version <= version <= self.version
+
+    def changes_since(self, version: int) -> Optional[Changes]:
+        """ Returns all changes after `version` up to the current version.
+
+        Returns:
+            The merged changes or `None` if they are not known anymore
+        """
+        if not self.knows(version):
+            return None
+
+        merged: Changes = {}
+        for version_changes in islice(self._versions, version - self.oldest_version, None):
+            for token_network_address, changes in version_changes.items():
+                merged_changes = merged.get(token_network_address)
+                if merged_changes is None:
+                    merged_changes = merged[token_network_address] = TokenNetworkChanges()
+                merged_changes.update(changes)
+        return merged
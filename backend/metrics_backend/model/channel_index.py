@@ -0,0 +1,237 @@
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metrics_backend.utils import ChannelIdentifier
+from metrics_backend.utils.address_registry import AddressId
+
+from metrics_backend.model import ChannelView
+
+# the deposit of a channel and its identifier, the sort key of the deposit index
+DepositKey = Tuple[int, ChannelIdentifier]
+
+
+# a block of a SortedKeys is split in two when it grows beyond twice this size
+BLOCK_SIZE = 512
+
+
+def _insert(items: List, item):
+    # channels and participants mostly arrive in ascending order
+    if len(items) == 0 or item > items[-1]:
+        items.append(item)
+    else:
+        insort(items, item)
+
+
+def _remove(items: List, item):
+    index = bisect_left(items, item)
+    if index < len(items) and items[index] == item:
+        del items[index]
+
+
+class SortedKeys:
+    """ A sorted list of unique keys, split into blocks.
+
+    Inserting and removing a key only moves the keys of one block instead of the whole
+    list, which matters for the indexes with many keys arriving out of order, e.g. when
+    old channels are closed or deposits change.
+    """
+
+    __slots__ = ('_blocks', '_maxes', '_len')
+
+    def __init__(self) -> None:
+        self._blocks: List[List] = []
+        # the last key of each block
+        self._maxes: List = []
+        self._len = 0
+
+    def add(self, key):
+        blocks, maxes = self._blocks, self._maxes
+        if len(blocks) == 0:
+            blocks.append([key])
+            maxes.append(key)
+            self._len = 1
+            return
+
+        index = bisect_left(maxes, key)
+        if index == len(maxes):
+            index -= 1
+            blocks[index].append(key)
+            maxes[index] = key
+        else:
+            insort(blocks[index], key)
+        self._len += 1
+
+        block = blocks[index]
+        if len(block) > 2 * BLOCK_SIZE:
+            blocks.insert(index + 1, block[BLOCK_SIZE:])
+            del block[BLOCK_SIZE:]
+            maxes.insert(index, block[-1])
+
+    def remove(self, key):
+        """ Removes `key` if it is present. """
+        blocks, maxes = self._blocks, self._maxes
+        index = bisect_left(maxes, key)
+        if index == len(maxes):
+            return
+        block = blocks[index]
+        position = bisect_left(block, key)
+        if block[position] != key:
+            return
+
+        del block[position]
+        self._len -= 1
+        if len(block) == 0:
+            del blocks[index]
+            del maxes[index]
+        else:
+            maxes[index] = block[-1]
+
+    def iter_after(self, after=None) -> Iterator:
+        """ Iterates over the keys greater than `after`, all of them for `None`. """
+        blocks = self._blocks
+        index = 0 if after is None else bisect_right(self._maxes, after)
+        if index == len(blocks):
+            return
+        position = 0 if after is None else bisect_right(blocks[index], after)
+
+        yield from blocks[index][position:]
+        for block_index in range(index + 1, len(blocks)):
+            yield from blocks[block_index]
+
+    def iter_before(self, before=None) -> Iterator:
+        """ Iterates backwards over the keys smaller than `before`, all of them for `None`. """
+        blocks = self._blocks
+        if len(blocks) == 0:
+            return
+        index = len(blocks) - 1 if before is None else bisect_left(self._maxes, before)
+        if index == len(blocks) or before is None:
+            index = len(blocks) - 1
+            position = len(blocks[index])
+        else:
+            position = bisect_left(blocks[index], before)
+
+        yield from reversed(blocks[index][:position])
+        for block_index in range(index - 1, -1, -1):
+            yield from reversed(blocks[block_index])
+
+    def __iter__(self) -> Iterator:
+        return self.iter_after()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SortedKeys) and list(self) == list(other)
+
+
+class ChannelIndex:
+    """ Secondary indexes over the channels of a token network.
+
+    All indexes are sorted, so a page of channels starting at a cursor is found with a
+    binary search and costs only the size of the page. The channels of a participant are
+    few enough for a plain list.
+    """
+
+    def __init__(self) -> None:
+        self.by_state: Dict[ChannelView.State, SortedKeys] = {
+            state: SortedKeys() for state in ChannelView.State
+        }
+        self.by_participant: Dict[AddressId, List[ChannelIdentifier]] = {}
+        # ascending by deposit, then by identifier, one index per state as the channels keep
+        # their deposits when they are closed and settled
+        self.by_deposit: Dict[ChannelView.State, SortedKeys] = {
+            state: SortedKeys() for state in ChannelView.State
+        }
+        # all participants of the token network
+        self.participants = SortedKeys()
+
+    def add_channel(
+        self,
+        channel_identifier: ChannelIdentifier,
+        state: ChannelView.State,
+        participants: Iterable[AddressId],
+        deposit: int,
+    ):
+        self.by_state[state].add(channel_identifier)
+        for participant in participants:
+            _insert(self.by_participant.setdefault(participant, []), channel_identifier)
+        self.by_deposit[state].add((deposit, channel_identifier))
+
+    def remove_channel(
+        self,
+        channel_identifier: ChannelIdentifier,
+        state: ChannelView.State,
+        participants: Iterable[AddressId],
+        deposit: int,
+    ):
+        self.by_state[state].remove(channel_identifier)
+        for participant in participants:
+            channel_ids = self.by_participant[participant]
+            _remove(channel_ids, channel_identifier)
+            # e.g. a reused identifier, the participant may have no channels left
+            if len(channel_ids) == 0:
+                del self.by_participant[participant]
+        self.by_deposit[state].remove((deposit, channel_identifier))
+
+    def update_state(
+        self,
+        channel_identifier: ChannelIdentifier,
+        old_state: ChannelView.State,
+        new_state: ChannelView.State,
+        deposit: int,
+    ):
+        if old_state != new_state:
+            self.by_state[old_state].remove(channel_identifier)
+            self.by_state[new_state].add(channel_identifier)
+            self.by_deposit[old_state].remove((deposit, channel_identifier))
+            self.by_deposit[new_state].add((deposit, channel_identifier))
+
+    def update_deposit(
+        self,
+        channel_identifier: ChannelIdentifier,
+        state: ChannelView.State,
+        old: int,
+        new: int,
+    ):
+        if old != new:
+            self.by_deposit[state].remove((old, channel_identifier))
+            self.by_deposit[state].add((new, channel_identifier))
+
+    def add_participant(self, participant: AddressId):
+        self.participants.add(participant)
+
+    def channels_by_state(
+        self,
+        state: ChannelView.State,
+        after: Optional[ChannelIdentifier] = None,
+    ) -> Iterator[ChannelIdentifier]:
+        """ Iterates over the channels in `state` with an identifier greater than `after`. """
+        return self.by_state[state].iter_after(after)
+
+    def channels_of_participant(
+        self,
+        participant: AddressId,
+        after: Optional[ChannelIdentifier] = None,
+    ) -> Iterator[ChannelIdentifier]:
+        """ Iterates over the channels of `participant` with an identifier above `after`. """
+        channel_ids = self.by_participant.get(participant, [])
+        start = 0 if after is None else bisect_right(channel_ids, after)
+        return iter(channel_ids[start:])
+
+    def channels_by_deposit(
+        self,
+        state: Optional[ChannelView.State] = None,
+        before: Optional[DepositKey] = None,
+    ) -> Iterator[DepositKey]:
+        """ Iterates over the channels in `state`, or in any state for `None`, by descending
+        deposit, starting below `before`. """
+        if state is not None:
+            return self.by_deposit[state].iter_before(before)
+        return heapq.merge(
+            *[self.by_deposit[state].iter_before(before) for state in ChannelView.State],
+            reverse=True,
+        )
+
+    def participants_after(self, after: Optional[AddressId] = None) -> Iterator[AddressId]:
+        return self.participants.iter_after(after)
@@ -0,0 +1,263 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from metrics_backend.utils import Address, ChannelIdentifier
+from metrics_backend.utils.address_registry import AddressId, address_registry
+
+from metrics_backend.model import ChannelView
+
+# the state column stores the index of the state in this list
+CHANNEL_STATES: List[ChannelView.State] = list(ChannelView.State)
+STATE_CODES: Dict[ChannelView.State, int] = {
+    state: code for code, state in enumerate(CHANNEL_STATES)
+}
+
+UINT64_MASK = (1 << 64) - 1
+MAX_UINT64 = UINT64_MASK
+
+
+class IntColumn:
+    """ A column of token amounts.
+
+    Amounts below 2**128 are split into two 64 bit arrays, the rare other values are
+    kept in a dict.
+    """
+
+    __slots__ = ('_low', '_high', '_overflow')
+
+    def __init__(self) -> None:
+        self._low = array('Q')
+        self._high = array('Q')
+        self._overflow: Dict[int, int] = {}
+
+    def append(self, value: int):
+        self._low.append(0)
+        self._high.append(0)
+        self[len(self._low) - 1] = value
+
+    def __getitem__(self, row: int) -> int:
+        if row in self._overflow:
+            return self._overflow[row]
+        return self._high[row] << 64 | self._low[row]
+
+    def __setitem__(self, row: int, value: int):
+        if 0 <= value < 1 << 128:
+            self._low[row] = value & UINT64_MASK
+            self._high[row] = value >> 64
+            self._overflow.pop(row, None)
+        else:
+            self._overflow[row] = value
+
+    def nbytes(self) -> int:
+        return (
+            self._low.itemsize * len(self._low) +
+            self._high.itemsize * len(self._high)
+        )
+
+
+class ChannelRow:
+    """ A lightweight view on one channel of a ChannelStore, with the API of ChannelView. """
+
+    __slots__ = ('_store', '_row', 'channel_id')
+
+    def __init__(self, store: 'ChannelStore', row: int, channel_id: ChannelIdentifier) -> None:
+        self._store = store
+        self._row = row
+        self.channel_id = channel_id
+
+    @property
+    def participant1_id(self) -> AddressId:
+        return self._store.participant1[self._row]
+
+    @property
+    def participant2_id(self) -> AddressId:
+        return self._store.participant2[self._row]
+
+    @property
+    def participant1(self) -> Address:
+        return address_registry.checksum_address(self.participant1_id)
+
+    @property
+    def participant2(self) -> Address:
+        return address_registry.checksum_address(self.participant2_id)
+
+    @property
+    def state(self) -> ChannelView.State:
+        return CHANNEL_STATES[self._store.states[self._row]]
+
+    @property
+    def deposit_p1(self) -> int:
+        return self._store.total_deposit_p1[self._row] - self._store.total_withdraw_p1[self._row]
+
+    @property
+    def deposit_p2(self) -> int:
+        return self._store.total_deposit_p2[self._row] - self._store.total_withdraw_p2[self._row]
+
+    def update_deposit(
+        self,
+        participant: Address,
+        new_total_deposit: Optional[int] = None,
+    ):
+        if new_total_deposit is not None:
+            participant_id = address_registry.intern(participant)
+            if participant_id == self.participant1_id:
+                self._store.total_deposit_p1[self._row] = new_total_deposit
+            elif participant_id == self.participant2_id:
+                self._store.total_deposit_p2[self._row] = new_total_deposit
+
+    def withdraw(
+        self,
+        participant: Address,
+        new_total_withdraw: int,
+    ):
+        participant_id = address_registry.intern(participant)
+        if participant_id == self.participant1_id:
+            self._store.total_withdraw_p1[self._row] = new_total_withdraw
+        elif participant_id == self.participant2_id:
+            self._store.total_withdraw_p2[self._row] = new_total_withdraw
+
+    def update_state(self, new_state: ChannelView.State):
+        if new_state is not None:
+            self._store.states[self._row] = STATE_CODES[new_state]
+
+    def __repr__(self):
+        return '<ChannelView id={} p1={} p2={} state={} deposit_p1={} deposit_p2={}>'.format(
+            self.channel_id,
+            self.participant1,
+            self.participant2,
+            self.state,
+            self.deposit_p1,
+            self.deposit_p2,
+        )
+
+
+class ChannelStore(Mapping):
+    """ Struct-of-arrays storage for the channels of a token network.
+
+    It can be used in place of the `Dict[ChannelIdentifier, ChannelView]` of a
+    TokenNetwork. Channels are added as ChannelViews and read as ChannelRows. Each channel
+    only stores the ids of its participants in the address registry.
+
+    Channel identifiers are assigned by a counter in the contract, so the channels are
+    opened in ascending order and the identifier column doubles as a sorted index. Only if
+    an identifier arrives out of order, a dict index is built instead.
+    """
+
+    def __init__(self) -> None:
+        # identifier of each row, ascending unless there is an `index`
+        self.channel_ids = array('Q')
+        self.index: Optional[Dict[ChannelIdentifier, int]] = None
+
+        self.participant1 = array('I')
+        self.participant2 = array('I')
+        self.states = bytearray()
+        self.total_deposit_p1 = IntColumn()
+        self.total_deposit_p2 = IntColumn()
+        self.total_withdraw_p1 = IntColumn()
+        self.total_withdraw_p2 = IntColumn()
+
+    def _find_row(self, channel_identifier: ChannelIdentifier) -> Optional[int]:
+        if self.index is not None:
+            return self.index.get(channel_identifier)
+
+        if not 0 <= channel_identifier <= MAX_UINT64:
+            return None
+        row = bisect_left(self.channel_ids, channel_identifier)
+        if row < len(self.channel_ids) and self.channel_ids[row] == channel_identifier:
+            return row
+        return None
+
+    def _add_row(self, channel_identifier: ChannelIdentifier) -> int:
+        row = len(self.states)
+        if self.index is None:
+            in_order = 0 <= channel_identifier <= MAX_UINT64 and (
+                row == 0 or channel_identifier > self.channel_ids[-1]
+            )
+            if in_order:
+                self.channel_ids.append(channel_identifier)
+                return row
+
+            self.index = {
+                channel_id: channel_row  # type: ignore
+                for channel_row, channel_id in enumerate(self.channel_ids)
+            }
+            self.channel_ids = array('Q')
+        self.index[channel_identifier] = row
+        return row
+
+    def __setitem__(self, channel_identifier: ChannelIdentifier, view: ChannelView):
+        """ Stores a new channel, replacing the one with the same identifier if there is one. """
+        row = self._find_row(channel_identifier)
+        if row is None:
+            row = self._add_row(channel_identifier)
+            self.participant1.append(0)
+            self.participant2.append(0)
+            self.states.append(0)
+            for column in self._amount_columns():
+                column.append(0)
+
+        self.participant1[row] = view.participant1_id
+        self.participant2[row] = view.participant2_id
+        self.states[row] = STATE_CODES[view.state]
+        # the deposits of a view are its total deposits minus its total withdraws
+        self.total_deposit_p1[row] = view.deposit_p1
+        self.total_deposit_p2[row] = view.deposit_p2
+        self.total_withdraw_p1[row] = 0
+        self.total_withdraw_p2[row] = 0
+
+    def _amount_columns(self) -> List[IntColumn]:
+        return [
+            self.total_deposit_p1,
+            self.total_deposit_p2,
+            self.total_withdraw_p1,
+            self.total_withdraw_p2,
+        ]
+
+    def __getitem__(self, channel_identifier: ChannelIdentifier) -> ChannelRow:
+        row = self._find_row(channel_identifier)
+        if row is None:
+            raise KeyError(channel_identifier)
+        return ChannelRow(self, row, channel_identifier)
+
+    def get(self, channel_identifier: ChannelIdentifier, default=None) -> Optional[ChannelRow]:
+        row = self._find_row(channel_identifier)
+        if row is None:
+            return default
+        return ChannelRow(self, row, channel_identifier)
+
+    def __contains__(self, channel_identifier) -> bool:
+        return self._find_row(channel_identifier) is not None
+
+    def __iter__(self) -> Iterator[ChannelIdentifier]:
+        if self.index is not None:
+            return iter(self.index)
+        return iter(self.channel_ids)  # type: ignore
+
+    def items(self) -> Iterator[Tuple[ChannelIdentifier, ChannelRow]]:  # type: ignore
+        if self.index is not None:
+            rows = self.index.items()
+        else:
+            rows = (  # type: ignore
+                (channel_id, row) for row, channel_id in enumerate(self.channel_ids)
+            )
+        for channel_id, row in rows:
+            yield channel_id, ChannelRow(self, row, channel_id)
+
+    def values(self) -> Iterator[ChannelRow]:  # type: ignore
+        for _, channel in self.items():
+            yield channel
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def nbytes(self) -> int:
+        """ Returns the size of the columns, without a dict index. """
+        return (
+            self.channel_ids.itemsize * len(self.channel_ids) +
+            self.participant1.itemsize * len(self.participant1) +
+            self.participant2.itemsize * len(self.participant2) +
+            len(self.states) +
+            sum(column.nbytes() for column in self._amount_columns())
+        )
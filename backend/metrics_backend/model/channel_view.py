@@ -1,7 +1,7 @@
 from enum import Enum
 
-from eth_utils import is_checksum_address
 from metrics_backend.utils import Address, ChannelIdentifier
+from metrics_backend.utils.address_registry import address_registry
 
 
 class ChannelView:
@@ -19,11 +19,8 @@ class ChannelView:
         participant1: Address,
         participant2: Address,
     ) -> None:
-        assert is_checksum_address(participant1)
-        assert is_checksum_address(participant2)
-
-        self.participant1 = participant1
-        self.participant2 = participant2
+        self.participant1_id = address_registry.intern(participant1)
+        self.participant2_id = address_registry.intern(participant2)
 
         self.channel_id = channel_id
         self._deposit_p1 = 0
@@ -41,10 +38,11 @@ class ChannelView:
         new_total_deposit: int = None,
     ):
         if new_total_deposit is not None:
-            if participant == self.participant1:
+            participant_id = address_registry.intern(participant)
+            if participant_id == self.participant1_id:
                 self._deposit_p1 += new_total_deposit - self._total_deposit_p1
                 self._total_deposit_p1 = new_total_deposit
-            elif participant == self.participant2:
+            elif participant_id == self.participant2_id:
                 self._deposit_p2 += new_total_deposit - self._total_deposit_p2
                 self._total_deposit_p2 = new_total_deposit
 
@@ -53,10 +51,11 @@ class ChannelView:
         participant: Address,
         new_total_withdraw: int,
     ):
-        if participant == self.participant1:
+        participant_id = address_registry.intern(participant)
+        if participant_id == self.participant1_id:
             self._deposit_p1 -= new_total_withdraw - self._total_withdraw_p1
             self._total_withdraw_p1 = new_total_withdraw
-        elif participant == self.participant2:
+        elif participant_id == self.participant2_id:
             self._deposit_p2 -= new_total_withdraw - self._total_withdraw_p2
             self._total_withdraw_p2 = new_total_withdraw
 
@@ -64,6 +63,14 @@ class ChannelView:
         if new_state is not None:
             self.state = new_state
 
+    @property
+    def participant1(self) -> Address:
+        return address_registry.checksum_address(self.participant1_id)
+
+    @property
+    def participant2(self) -> Address:
+        return address_registry.checksum_address(self.participant2_id)
+
     @property
     def deposit_p1(self) -> int:
         return self._deposit_p1
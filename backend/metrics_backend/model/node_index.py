@@ -0,0 +1,58 @@
+from itertools import islice, takewhile
+from typing import Dict, Iterable, List
+
+from metrics_backend.utils import Address
+from metrics_backend.utils.address_registry import AddressId, address_registry
+
+from metrics_backend.model import TokenNetwork
+from metrics_backend.model.channel_index import SortedKeys
+
+
+class NodeIndex:
+    """ Indexes the nodes across all token networks.
+
+    Each node maps to the token networks it has channels in, the channels themselves are
+    found through the channel index of each of these token networks. The lower case
+    addresses of all nodes are kept sorted for prefix searches.
+    """
+
+    def __init__(self) -> None:
+        # node -> addresses of the token networks it has channels in, in order of appearance
+        self.token_networks: Dict[AddressId, Dict[Address, None]] = {}
+        # (lower case address, node)
+        self.addresses = SortedKeys()
+
+    @classmethod
+    def from_token_networks(cls, token_networks: Iterable[TokenNetwork]) -> 'NodeIndex':
+        node_index = cls()
+        for token_network in token_networks:
+            for node in token_network.participants:
+                node_index.add(node, token_network.address)
+        return node_index
+
+    def add(self, node: AddressId, token_network_address: Address):
+        """ Records that `node` has a channel in the token network. """
+        token_networks = self.token_networks.get(node)
+        if token_networks is None:
+            token_networks = self.token_networks[node] = {}
+            self.addresses.add((address_registry.checksum_address(node).lower(), node))
+        token_networks[token_network_address] = None
+
+    def token_networks_of(self, node: AddressId) -> List[Address]:
+        return list(self.token_networks.get(node, ()))
+
+    def search(self, prefix: str, limit: int) -> List[AddressId]:
+        """ Returns up to `limit` nodes whose address starts with `prefix`, in address order.
+
+        Args:
+            prefix: The beginning of an address in any case, with or without `0x`
+        """
+        prefix = prefix.lower()
+        if not prefix.startswith('0x'):
+            prefix = '0x' + prefix
+
+        matches = takewhile(
+            lambda key: key[0].startswith(prefix),
+            self.addresses.iter_after((prefix,)),
+        )
+        return [node for _, node in islice(matches, limit)]
@@ -0,0 +1,61 @@
+from bisect import bisect_left, insort
+from typing import Dict, List, Tuple
+
+from metrics_backend.utils.address_registry import AddressId
+
+
+class NodeRanking:
+    """ Ranks the nodes by their number of open channels.
+
+    Nodes are kept in one bucket per channel count, the counts of the non-empty buckets in
+    a sorted list. Changing the count of a node moves it to the neighbouring bucket, which
+    costs a binary search over the distinct counts, so the top nodes never need a sort.
+    The sums behind the averages are kept up to date as well.
+    """
+
+    def __init__(self) -> None:
+        # channel count -> nodes with that count, in the order they got there
+        self.buckets: Dict[int, Dict[AddressId, None]] = {}
+        # the channel counts of the non-empty buckets, ascending
+        self.counts: List[int] = []
+
+        self.num_nodes_with_open_channels = 0
+        self.summed_open_channels = 0
+
+    def update(self, node: AddressId, old_count: int, new_count: int):
+        """ Moves `node` from the bucket of `old_count` to the one of `new_count`. """
+        if old_count == new_count:
+            return
+
+        if old_count > 0:
+            old_bucket = self.buckets[old_count]
+            del old_bucket[node]
+            if len(old_bucket) == 0:
+                del self.buckets[old_count]
+                del self.counts[bisect_left(self.counts, old_count)]
+        else:
+            self.num_nodes_with_open_channels += 1
+
+        if new_count > 0:
+            new_bucket = self.buckets.get(new_count)
+            if new_bucket is None:
+                new_bucket = self.buckets[new_count] = {}
+                insort(self.counts, new_count)
+            new_bucket[node] = None
+        else:
+            self.num_nodes_with_open_channels -= 1
+
+        self.summed_open_channels += new_count - old_count
+
+    def top_nodes(self, k: int) -> List[Tuple[AddressId, int]]:
+        """ Returns the `k` nodes with the most open channels and their counts, most first.
+
+        Among nodes with the same count, the one which reached it last comes first.
+        """
+        top: List[Tuple[AddressId, int]] = []
+        for count in reversed(self.counts):
+            for node in reversed(self.buckets[count]):
+                if len(top) == k:
+                    return top
+                top.append((node, count))
+        return top
@@ -1,9 +1,10 @@
 import logging
-from typing import Dict
+from typing import Dict, List, Tuple
 from collections import defaultdict
 
-from eth_utils import is_checksum_address
 from metrics_backend.utils import Address
+from metrics_backend.model import NodeRanking
+from metrics_backend.utils.address_registry import AddressId, address_registry
 
 
 log = logging.getLogger(__name__)
@@ -19,32 +20,28 @@ class PaymentNetworkMetrics:
         self.num_channels_opened = 0
         self.num_channels_closed = 0
         self.num_channels_settled = 0
-        self.open_channels_by_participant: Dict[Address, int] = defaultdict(lambda: 0)
+        # keyed by the ids of the participants in the address registry
+        self.open_channels_by_participant: Dict[AddressId, int] = defaultdict(int)
+        self.ranking = NodeRanking()
 
     def handle_channel_opened_event(
         self,
         participant1: Address,
         participant2: Address,
     ):
-        assert is_checksum_address(participant1)
-        assert is_checksum_address(participant2)
-
         self.num_channels_opened += 1
-        self._add_opened_channel_to_participant(participant1)
-        self._add_opened_channel_to_participant(participant2)
+        self._add_opened_channel_to_participant(address_registry.intern(participant1))
+        self._add_opened_channel_to_participant(address_registry.intern(participant2))
 
     def handle_channel_closed_event(
         self,
         participant1: Address,
         participant2: Address,
     ):
-        assert is_checksum_address(participant1)
-        assert is_checksum_address(participant2)
-
         self.num_channels_opened -= 1
         self.num_channels_closed += 1
-        self._remove_opened_channel_from_participant(participant1)
-        self._remove_opened_channel_from_participant(participant2)
+        self._remove_opened_channel_from_participant(address_registry.intern(participant1))
+        self._remove_opened_channel_from_participant(address_registry.intern(participant2))
 
     def handle_channel_settled_event(self):
         self.num_channels_closed -= 1
@@ -53,9 +50,25 @@ class PaymentNetworkMetrics:
     def handle_token_network_created(self):
         self.num_token_networks += 1
 
-    def _add_opened_channel_to_participant(self, participant: Address):
+    @property
+    def num_nodes_with_open_channels(self) -> int:
+        return self.ranking.num_nodes_with_open_channels
+
+    @property
+    def summed_open_channels(self) -> int:
+        return self.ranking.summed_open_channels
+
+    def top_nodes(self, k: int) -> List[Tuple[AddressId, int]]:
+        """ Returns the `k` nodes with the most open channels and their counts, most first. """
+        return self.ranking.top_nodes(k)
+
+    def _add_opened_channel_to_participant(self, participant: AddressId):
         self.open_channels_by_participant[participant] += 1
+        count = self.open_channels_by_participant[participant]
+        self.ranking.update(participant, count - 1, count)
     
-    def _remove_opened_channel_from_participant(self, participant: Address):
+    def _remove_opened_channel_from_participant(self, participant: AddressId):
         if not self.open_channels_by_participant[participant] == 0:
             self.open_channels_by_participant[participant] -= 1
+            count = self.open_channels_by_participant[participant]
+            self.ranking.update(participant, count + 1, count)
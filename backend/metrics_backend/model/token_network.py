@@ -1,11 +1,11 @@
 import logging
 from typing import Dict
 
-from eth_utils import is_checksum_address
 from dataclasses import dataclass
 from metrics_backend.utils import Address, ChannelIdentifier
+from metrics_backend.utils.address_registry import AddressId, address_registry
 
-from metrics_backend.model import ChannelView
+from metrics_backend.model import ChannelIndex, ChannelStore, ChannelView
 
 
 log = logging.getLogger(__name__)
@@ -28,13 +28,43 @@ class ParticipantsChannels:
 class TokenNetwork:
     """ Manages a token network for pathfinding. """
 
-    def __init__(self, token_network_address: Address, token_info: TokenInfo) -> None:
-        """ Initializes a new TokenNetwork. """
+    def __init__(
+        self,
+        token_network_address: Address,
+        token_info: TokenInfo,
+        check_consistency: bool = False,
+        compact_channels: bool = False,
+    ) -> None:
+        """ Initializes a new TokenNetwork.
+
+        With `compact_channels`, the channels are kept in a columnar ChannelStore, which
+        needs a fraction of the memory of one ChannelView per channel.
+
+        With `check_consistency`, the aggregates and the channel index are compared against a
+        full recomputation after every event. This is slow and meant for tests.
+        """
 
         self.address = token_network_address
         self.token_info = token_info
-        self.channels: Dict[ChannelIdentifier, ChannelView] = dict()
-        self.participants: Dict[Address, ParticipantsChannels] = dict()
+        self.check_consistency = check_consistency
+        # the channel store stands in for the dict
+        self.channels: Dict[ChannelIdentifier, ChannelView] = (
+            ChannelStore() if compact_channels else dict()  # type: ignore
+        )
+        # keyed by the ids of the participants in the address registry
+        self.participants: Dict[AddressId, ParticipantsChannels] = dict()
+        # secondary indexes for paginated queries, kept up to date by the event handlers
+        self.channel_index = ChannelIndex()
+
+        # aggregates, kept up to date by the event handlers
+        self.num_channels_opened = 0
+        self.num_channels_closed = 0
+        self.num_channels_settled = 0
+        # sum of the deposits in open channels
+        self.total_deposits = 0
+        self.num_nodes_with_open_channels = 0
+        # sum of the open channels over all participants
+        self.num_participant_open_channels = 0
 
     def handle_channel_opened_event(
         self,
@@ -46,14 +76,32 @@ class TokenNetwork:
 
         Corresponds to the ChannelOpened event."""
 
-        assert is_checksum_address(participant1)
-        assert is_checksum_address(participant2)
+        participant1_id = address_registry.intern(participant1)
+        participant2_id = address_registry.intern(participant2)
+
+        previous_view = self.channels.get(channel_identifier)
+        if previous_view is not None:
+            self._remove_channel_from_aggregates(previous_view)
+            self.channel_index.remove_channel(
+                channel_identifier,
+                previous_view.state,
+                (previous_view.participant1_id, previous_view.participant2_id),
+                _channel_deposit(previous_view),
+            )
 
         view = ChannelView(channel_identifier, participant1, participant2)
         self.channels[channel_identifier] = view
+        self.num_channels_opened += 1
+        self.channel_index.add_channel(
+            channel_identifier,
+            view.state,
+            (participant1_id, participant2_id),
+            _channel_deposit(view),
+        )
 
-        self._add_opened_channel_to_participant(participant1)
-        self._add_opened_channel_to_participant(participant2)
+        self._add_opened_channel_to_participant(participant1_id)
+        self._add_opened_channel_to_participant(participant2_id)
+        self._check_aggregates()
 
     def handle_channel_new_deposit_event(
         self,
@@ -65,16 +113,30 @@ class TokenNetwork:
 
         Corresponds to the ChannelNewDeposit event."""
 
-        assert is_checksum_address(receiver)
+        address_registry.intern(receiver)
 
         try:
-            self.channels[channel_identifier].update_deposit(receiver, total_deposit)
+            channel = self.channels[channel_identifier]
         except KeyError:
             log.error(
                 "Received ChannelNewDeposit event for unknown channel '{}'".format(
                     channel_identifier
                 )
             )
+            return
+
+        deposit = _channel_deposit(channel)
+        channel.update_deposit(receiver, total_deposit)
+        new_deposit = _channel_deposit(channel)
+        if channel.state == ChannelView.State.OPENED:
+            self.total_deposits += new_deposit - deposit
+        self.channel_index.update_deposit(
+            channel_identifier,
+            channel.state,
+            deposit,
+            new_deposit,
+        )
+        self._check_aggregates()
     
     def handle_channel_withdraw_event(
         self,
@@ -86,7 +148,7 @@ class TokenNetwork:
 
         Corresponds to the ChannelWithdraw event."""
 
-        assert is_checksum_address(withdrawing_participant)
+        address_registry.intern(withdrawing_participant)
 
         if not channel_identifier in self.channels:
             log.error(
@@ -96,7 +158,19 @@ class TokenNetwork:
             )
             return
 
-        self.channels[channel_identifier].withdraw(withdrawing_participant, total_withdraw)
+        channel = self.channels[channel_identifier]
+        deposit = _channel_deposit(channel)
+        channel.withdraw(withdrawing_participant, total_withdraw)
+        new_deposit = _channel_deposit(channel)
+        if channel.state == ChannelView.State.OPENED:
+            self.total_deposits += new_deposit - deposit
+        self.channel_index.update_deposit(
+            channel_identifier,
+            channel.state,
+            deposit,
+            new_deposit,
+        )
+        self._check_aggregates()
 
     def handle_channel_closed_event(self, channel_identifier: ChannelIdentifier):
         """ Close a channel. This doesn't mean that the channel is settled yet, but it cannot
@@ -106,16 +180,17 @@ class TokenNetwork:
 
         try:
             channel = self.channels[channel_identifier]
-            channel.update_state(ChannelView.State.CLOSED)
+            self._update_channel_state(channel, ChannelView.State.CLOSED)
         
-            self._add_closed_channel_to_participant(channel.participant1)
-            self._add_closed_channel_to_participant(channel.participant2)
+            self._add_closed_channel_to_participant(channel.participant1_id)
+            self._add_closed_channel_to_participant(channel.participant2_id)
         except KeyError:
             log.error(
                 "Received ChannelClosed event for unknown channel '{}'".format(
                     channel_identifier
                 )
             )
+        self._check_aggregates()
 
     def handle_channel_settled_event(self, channel_identifier: ChannelIdentifier):
         """ Settle a channel.
@@ -124,16 +199,17 @@ class TokenNetwork:
 
         try:
             channel = self.channels[channel_identifier]
-            channel.update_state(ChannelView.State.SETTLED)
+            self._update_channel_state(channel, ChannelView.State.SETTLED)
         
-            self._add_settled_channel_to_participant(channel.participant1)
-            self._add_settled_channel_to_participant(channel.participant2)
+            self._add_settled_channel_to_participant(channel.participant1_id)
+            self._add_settled_channel_to_participant(channel.participant2_id)
         except KeyError:
             log.error(
                 "Received ChannelSettle event for unknown channel '{}'".format(
                     channel_identifier
                 )
             )
+        self._check_aggregates()
     
     def get_channel(self, channel_identifier: ChannelIdentifier):
         if not channel_identifier in self.channels.keys():
@@ -141,15 +217,129 @@ class TokenNetwork:
         else:
             return self.channels[channel_identifier]
 
-    def _add_opened_channel_to_participant(self, participant: Address):
+    def aggregates(self) -> Dict[str, int]:
+        """ Returns the incrementally maintained aggregates. """
+        return dict(
+            num_channels_opened=self.num_channels_opened,
+            num_channels_closed=self.num_channels_closed,
+            num_channels_settled=self.num_channels_settled,
+            total_deposits=self.total_deposits,
+            num_nodes_with_open_channels=self.num_nodes_with_open_channels,
+            num_participant_open_channels=self.num_participant_open_channels,
+        )
+
+    def recompute_aggregates(self) -> Dict[str, int]:
+        """ Computes the aggregates from scratch, by scanning all channels and participants. """
+        aggregates = dict(
+            num_channels_opened=0,
+            num_channels_closed=0,
+            num_channels_settled=0,
+            total_deposits=0,
+            num_nodes_with_open_channels=0,
+            num_participant_open_channels=0,
+        )
+        for view in self.channels.values():
+            if view.state == ChannelView.State.OPENED:
+                aggregates['num_channels_opened'] += 1
+                aggregates['total_deposits'] += _channel_deposit(view)
+            elif view.state == ChannelView.State.CLOSED:
+                aggregates['num_channels_closed'] += 1
+            elif view.state == ChannelView.State.SETTLED:
+                aggregates['num_channels_settled'] += 1
+
+        for participants_channels in self.participants.values():
+            aggregates['num_participant_open_channels'] += participants_channels.opened
+            if participants_channels.opened > 0:
+                aggregates['num_nodes_with_open_channels'] += 1
+        return aggregates
+
+    def recompute_channel_index(self) -> ChannelIndex:
+        """ Builds the channel index from scratch. """
+        channel_index = ChannelIndex()
+        for channel_identifier in sorted(self.channels):
+            view = self.channels[channel_identifier]
+            channel_index.add_channel(
+                channel_identifier,
+                view.state,
+                (view.participant1_id, view.participant2_id),
+                _channel_deposit(view),
+            )
+        for participant in self.participants:
+            channel_index.add_participant(participant)
+        return channel_index
+
+    def _check_aggregates(self):
+        if not self.check_consistency:
+            return
+
+        aggregates = self.aggregates()
+        expected = self.recompute_aggregates()
+        assert aggregates == expected, (
+            f'Aggregates of token network {self.address} are inconsistent: '
+            f'{aggregates} != {expected}'
+        )
+        assert vars(self.channel_index) == vars(self.recompute_channel_index()), (
+            f'Channel index of token network {self.address} is inconsistent'
+        )
+
+    def _update_channel_state(self, channel: ChannelView, new_state: ChannelView.State):
+        self._count_channel_state(channel.state, -1)
+        if channel.state == ChannelView.State.OPENED:
+            self.total_deposits -= _channel_deposit(channel)
+
+        old_state = channel.state
+        channel.update_state(new_state)
+        self.channel_index.update_state(
+            channel.channel_id,
+            old_state,
+            channel.state,
+            _channel_deposit(channel),
+        )
+
+        self._count_channel_state(channel.state, 1)
+        if channel.state == ChannelView.State.OPENED:
+            self.total_deposits += _channel_deposit(channel)
+
+    def _remove_channel_from_aggregates(self, channel: ChannelView):
+        """ Removes a channel which is about to be replaced, e.g. by a reused identifier. """
+        self._count_channel_state(channel.state, -1)
+        if channel.state == ChannelView.State.OPENED:
+            self.total_deposits -= _channel_deposit(channel)
+
+    def _count_channel_state(self, state: ChannelView.State, delta: int):
+        if state == ChannelView.State.OPENED:
+            self.num_channels_opened += delta
+        elif state == ChannelView.State.CLOSED:
+            self.num_channels_closed += delta
+        elif state == ChannelView.State.SETTLED:
+            self.num_channels_settled += delta
+
+    def _update_participant_open_channels(self, participant: AddressId, delta: int):
+        participants_channels = self.participants[participant]
+        was_open = participants_channels.opened > 0
+        participants_channels.opened += delta
+        self.num_participant_open_channels += delta
+
+        is_open = participants_channels.opened > 0
+        if is_open and not was_open:
+            self.num_nodes_with_open_channels += 1
+        elif was_open and not is_open:
+            self.num_nodes_with_open_channels -= 1
+
+    def _add_opened_channel_to_participant(self, participant: AddressId):
         if not participant in self.participants:
             self.participants[participant] = ParticipantsChannels(0, 0, 0)
-        self.participants[participant].opened += 1
+            self.channel_index.add_participant(participant)
+        self._update_participant_open_channels(participant, 1)
     
-    def _add_closed_channel_to_participant(self, participant: Address):
-        self.participants[participant].opened -= 1
+    def _add_closed_channel_to_participant(self, participant: AddressId):
+        self._update_participant_open_channels(participant, -1)
         self.participants[participant].closed += 1
     
-    def _add_settled_channel_to_participant(self, participant: Address):
+    def _add_settled_channel_to_participant(self, participant: AddressId):
         self.participants[participant].closed -= 1
         self.participants[participant].settled += 1
+
+
+def _channel_deposit(channel: ChannelView) -> int:
+    return channel.deposit_p1 + channel.deposit_p2
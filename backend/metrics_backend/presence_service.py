@@ -1,11 +1,12 @@
 import hashlib
 import logging
 import math
-from typing import Dict, List
+import time
+from typing import Callable, Dict, List, Set
 
 import gevent
 import requests
-from eth_utils.address import to_canonical_address, to_checksum_address
+from eth_utils.address import to_checksum_address
 from raiden_common.constants import BLOCK_ID_LATEST
 from raiden_common.network.pathfinding import get_random_pfs
 from raiden_common.network.proxies.service_registry import ServiceRegistry
@@ -14,6 +15,8 @@ from requests import ConnectionError, HTTPError, Timeout
 from web3 import Web3
 
 from metrics_backend.utils import Address
+from metrics_backend.utils.address_registry import AddressId, address_registry
+from metrics_backend.utils.instrumentation import PRESENCE_POLL_LATENCY, PRESENCE_POLLS
 
 log = logging.getLogger(__name__)
 
@@ -45,7 +48,15 @@ class PresenceService(gevent.Greenlet):
             contract_manager=contract_manager,
             block_identifier=BLOCK_ID_LATEST,
         )
-        self.nodes_presence_status: Dict[bytes, bool] = {}
+        # keyed by the ids of the nodes in the address registry
+        self.nodes_presence_status: Dict[AddressId, bool] = {}
+        # incremented whenever the presence status changes
+        self.version = 0
+        # called with the nodes whose presence status changed
+        self.update_callbacks: List[Callable[[Set[AddressId]], None]] = []
+
+    def add_update_listener(self, callback: Callable[[Set[AddressId]], None]):
+        self.update_callbacks.append(callback)
 
     def _run(self):
         self.running = True
@@ -66,12 +77,16 @@ class PresenceService(gevent.Greenlet):
         log.info("Presence service started, PFS: %s", pfs_url)
         log.info("Presence polling interval: %ss", self.poll_interval)
         while self.running:
+            start = time.monotonic()
             try:
                 response = requests.get(f"{pfs_url}/api/v1/online_addresses")
                 response.raise_for_status()
+                PRESENCE_POLL_LATENCY.observe(time.monotonic() - start)
+                PRESENCE_POLLS.labels("success").inc()
                 self.update_presence(response.json())
                 gevent.sleep(self.poll_interval)
             except (ConnectionError, HTTPError, Timeout):
+                PRESENCE_POLLS.labels("error").inc()
                 log.warning(
                     "Error while trying to request from the PFS. Retrying in %d seconds.",
                     self.error_poll_interval,
@@ -84,9 +99,15 @@ class PresenceService(gevent.Greenlet):
         self.running = False
 
     def update_presence(self, online_addresses: List[str]):
-        self.nodes_presence_status = {
-            to_canonical_address(address): True for address in online_addresses
+        nodes_presence_status = {
+            address_registry.intern_any(address): True for address in online_addresses
         }
+        if nodes_presence_status != self.nodes_presence_status:
+            changed_nodes = nodes_presence_status.keys() ^ self.nodes_presence_status.keys()
+            self.nodes_presence_status = nodes_presence_status
+            self.version += 1
+            for callback in self.update_callbacks:
+                callback(changed_nodes)
         log.info(
             "Presence update, number of online nodes: %d",
             len(online_addresses),
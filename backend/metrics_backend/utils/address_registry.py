@@ -0,0 +1,95 @@
+from typing import Dict, List, Optional, Union
+
+from eth_utils import is_checksum_address, to_canonical_address, to_checksum_address
+
+from metrics_backend.utils import Address
+
+# integer id of an interned address
+AddressId = int
+
+
+class AddressRegistry:
+    """ Interns addresses, handing out a compact integer id for each of them.
+
+    Every address is validated and converted only once, so the model can key on the ids
+    and look up the checksum and canonical forms when needed.
+    """
+
+    def __init__(self) -> None:
+        self.checksum_addresses: List[Address] = []
+        self.canonical_addresses: List[bytes] = []
+        # all seen forms of an address -> id
+        self._ids: Dict[Union[str, bytes], AddressId] = {}
+
+    def __len__(self) -> int:
+        return len(self.checksum_addresses)
+
+    def intern(self, address: str) -> AddressId:
+        """ Returns the id of a checksum address, which is validated the first time. """
+        address_id = self._ids.get(address)
+        if address_id is None:
+            assert is_checksum_address(address)
+            address_id = self._add(Address(address))
+        return address_id
+
+    def is_checksum_address(self, address: str) -> bool:
+        """ Like `eth_utils.is_checksum_address`, but each valid address is only checked once. """
+        if address in self._ids:
+            return self.checksum_addresses[self._ids[address]] == address
+        if not is_checksum_address(address):
+            return False
+        self._add(Address(address))
+        return True
+
+    def intern_any(self, address: Union[str, bytes]) -> AddressId:
+        """ Returns the id of an address in any form, e.g. lower case or canonical bytes. """
+        address_id = self._ids.get(address)
+        if address_id is None:
+            address_id = self.intern(to_checksum_address(address))
+            self._ids[address] = address_id
+        return address_id
+
+    def lookup(self, address: Union[str, bytes]) -> Optional[AddressId]:
+        """ Returns the id of an address in any form, `None` if it was never interned.
+
+        Raises:
+            ValueError: If `address` is not an address
+        """
+        address_id = self._ids.get(address)
+        if address_id is None:
+            address_id = self._ids.get(to_checksum_address(address))
+        return address_id
+
+    def _add(self, address: Address) -> AddressId:
+        address_id = len(self.checksum_addresses)
+        canonical_address = to_canonical_address(address)
+        self.checksum_addresses.append(address)
+        self.canonical_addresses.append(canonical_address)
+        self._ids[address] = address_id
+        self._ids[canonical_address] = address_id
+        return address_id
+
+    def checksum_address(self, address_id: AddressId) -> Address:
+        return self.checksum_addresses[address_id]
+
+    def canonical_address(self, address_id: AddressId) -> bytes:
+        return self.canonical_addresses[address_id]
+
+    def restore(self, checksum_addresses: List[Address]):
+        """ Restores the ids of a snapshot taken with `checksum_addresses`.
+
+        The ids handed out so far have to agree with the snapshot.
+        """
+        for address_id, address in enumerate(checksum_addresses):
+            if address_id < len(self.checksum_addresses):
+                if self.checksum_addresses[address_id] != address:
+                    raise ValueError(
+                        f'Address id {address_id} is already used for '
+                        f'{self.checksum_addresses[address_id]}, not {address}'
+                    )
+            else:
+                self._add(address)
+
+
+# shared by the whole process, the model only stores the ids
+address_registry = AddressRegistry()
@@ -0,0 +1,103 @@
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import gevent.lock
+from hexbytes import HexBytes
+from web3 import Web3
+
+from metrics_backend.utils.rpc import batch_request
+
+log = logging.getLogger(__name__)
+
+# number of blocks cached in addition to the required confirmations
+HEADER_CACHE_MARGIN = 10
+
+
+class BlockHeaderCache:
+    """ Keeps the hashes of the most recent blocks, shared by all BlockchainListeners.
+
+    The cache is extended whenever a listener sees a new head. Each new header has to link
+    to the cached hash of its parent, otherwise the chain was reorganized and the whole
+    window is fetched again. Missing headers are always fetched in a single batch request.
+    """
+
+    def __init__(self, web3: Web3, size: int) -> None:
+        """ Creates a new BlockHeaderCache
+
+        Args:
+            web3: A Web3 instance
+            size: The number of most recent blocks kept in the cache
+        """
+        self.web3 = web3
+        self.size = max(size, 1)
+        self.head_number: Optional[int] = None
+        # block number -> (block hash, parent hash)
+        self._headers: 'OrderedDict[int, Tuple[HexBytes, HexBytes]]' = OrderedDict()
+        self._lock = gevent.lock.Semaphore()
+
+    def update_head(self, head_number: int):
+        """ Extends the cache up to `head_number`, refetching it on a reorg. """
+        with self._lock:
+            if self.head_number is not None and head_number <= self.head_number:
+                # a reorg may replace the head at the same height, without a new block whose
+                # parent wouldn't link to the cached chain
+                cached = self._headers.get(head_number)
+                header = self._fetch([head_number]).get(head_number)
+                if cached is None or header is None or header[0] == cached[0]:
+                    return
+                log.info('Block %d was replaced, refetching headers', head_number)
+                self.head_number = None
+
+            lowest = max(head_number - self.size + 1, 0)
+            if self.head_number is None or self.head_number < lowest - 1:
+                self._headers.clear()
+                start = lowest
+            else:
+                start = self.head_number + 1
+
+            headers = self._fetch(range(start, head_number + 1))
+            parent = self._headers.get(start - 1)
+            first = headers.get(start)
+            if parent is not None and first is not None and first[1] != parent[0]:
+                log.info('Block %d does not link to the cached chain, refetching headers', start)
+                self._headers.clear()
+                headers = self._fetch(range(lowest, head_number + 1))
+
+            for number in sorted(headers):
+                self._headers[number] = headers[number]
+            while len(self._headers) > 0 and next(iter(self._headers)) < lowest:
+                self._headers.popitem(last=False)
+            self.head_number = head_number
+
+    def get_hashes(self, block_numbers: Iterable[int]) -> Dict[int, Optional[HexBytes]]:
+        """ Returns the hashes of the given blocks, `None` for blocks that don't exist.
+
+        Blocks outside of the cached window are fetched in a single batch request.
+        """
+        block_numbers = list(block_numbers)
+        missing = [number for number in block_numbers if number not in self._headers]
+        fetched = self._fetch(missing) if len(missing) > 0 else {}
+
+        hashes: Dict[int, Optional[HexBytes]] = {}
+        for number in block_numbers:
+            header = self._headers.get(number) or fetched.get(number)
+            hashes[number] = header[0] if header is not None else None
+        return hashes
+
+    def _fetch(self, block_numbers: Iterable[int]) -> Dict[int, Tuple[HexBytes, HexBytes]]:
+        block_numbers = list(block_numbers)
+        responses = batch_request(
+            self.web3,
+            [('eth_getBlockByNumber', [hex(number), False]) for number in block_numbers],
+        )
+
+        headers: Dict[int, Tuple[HexBytes, HexBytes]] = {}
+        for number, response in zip(block_numbers, responses):
+            if 'error' in response:
+                raise ValueError(response['error'])
+            block = response.get('result')
+            if block is None:
+                continue
+            headers[number] = (HexBytes(block['hash']), HexBytes(block['parentHash']))
+        return headers
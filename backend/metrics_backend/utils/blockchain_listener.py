@@ -1,16 +1,18 @@
+import heapq
 import logging
 import sys
+import time
 import requests
-from typing import Callable, Dict, Union, List, Tuple
+from typing import Callable, Dict, Union, List, Optional, Tuple
 
-from eth_abi.codec import ABICodec
 from web3 import Web3
-from web3._utils.events import get_event_data
-from web3._utils.abi import filter_by_type
-from eth_utils import to_checksum_address, encode_hex, decode_hex
+from eth_utils import to_checksum_address, encode_hex
+from eth_typing import ChecksumAddress
 from eth_utils.abi import event_abi_to_log_topic
 import gevent
 import gevent.event
+import gevent.lock
+import gevent.pool
 from raiden_contracts.contract_manager import ContractManager
 from raiden_contracts.constants import (
     CONTRACT_TOKEN_NETWORK_REGISTRY,
@@ -18,8 +20,24 @@ from raiden_contracts.constants import (
 )
 from web3.types import FilterParams
 
+from metrics_backend.utils.block_headers import BlockHeaderCache, HEADER_CACHE_MARGIN
+from metrics_backend.utils.chunk_size import AdaptiveChunkSize, is_log_range_error
+from metrics_backend.utils.event_decoder import get_event_decoder
+from metrics_backend.utils.event_log import EventLogWriter
+from metrics_backend.utils.head_subscription import HeadSubscription
+from metrics_backend.utils.instrumentation import (
+    LISTENER_CHUNK_SIZE,
+    LISTENER_CONFIRMED_HEAD,
+    LISTENER_HEAD_LAG,
+    REORGS,
+)
+
 log = logging.getLogger(__name__)
 
+# while subscribed, the node is asked for its head after this many poll intervals without a new
+# one, in case the notifications stall while the connection stays open
+HEAD_SUBSCRIPTION_POLL_FACTOR = 12
+
 
 def create_channel_event_topics() -> List:
     return [
@@ -35,16 +53,9 @@ def create_registry_event_topics(contract_manager: ContractManager) -> List:
     return [encode_hex(event_abi_to_log_topic(new_network_abi))]
 
 
-def decode_event(codec: ABICodec, topic_to_event_abi: Dict[bytes, Dict], log_entry: Dict) -> Dict:
-    topic = log_entry["topics"][0]
-    event_abi = topic_to_event_abi[topic]
-
-    return get_event_data(codec, event_abi, log_entry)
-
-
 def get_events(
         web3: Web3,
-        contract_address: str,
+        contract_address: Union[str, List[str]],
         topics: List,
         from_block: Union[int, str] = 0,
         to_block: Union[int, str] = 'latest',
@@ -55,7 +66,7 @@ def get_events(
         web3: A Web3 instance
         contract_manager: A contract manager
         contract_name: The name of the contract
-        contract_address: The address of the contract to be filtered, can be `None`
+        contract_address: The address of the contract to be filtered, or a list of addresses
         topics: The topics to filter for
         from_block: The block to start search events
         to_block: The block to stop searching for events
@@ -63,10 +74,16 @@ def get_events(
     Returns:
         All matching events
     """
+    address: Union[ChecksumAddress, List[ChecksumAddress]]
+    if isinstance(contract_address, list):
+        address = [to_checksum_address(address) for address in contract_address]
+    else:
+        address = to_checksum_address(contract_address)
+
     filter_params = FilterParams({
         'fromBlock': from_block,
         'toBlock': to_block,
-        'address': to_checksum_address(contract_address),
+        'address': address,
         'topics': topics,
     })
 
@@ -74,19 +91,31 @@ def get_events(
 
 
 class BlockchainListener(gevent.Greenlet):
-    """ A class listening for events on a given contract. """
+    """ A class listening for events on a set of contracts sharing the same ABI.
+
+    All followed contracts are polled together, so a single `eth_getLogs` request is issued
+    per block range, independent of the number of contracts. Contracts added while the
+    listener is running are caught up separately, starting at their creation block, and join
+    the shared range once they reached the listener's confirmed head. The contracts catching
+    up are requested together as well.
+    """
 
     def __init__(
             self,
             web3: Web3,
             contract_manager: ContractManager,
             contract_name: str,
-            contract_address: str,
+            contract_address: Optional[str] = None,
             *,  # require all following arguments to be keyword arguments
             required_confirmations: int = 4,
             sync_chunk_size: int = 1_000,
+            max_sync_chunk_size: int = 100_000,
+            backfill_workers: int = 4,
             poll_interval: int = 5,
             sync_start_block: int = 0,
+            block_headers: Optional[BlockHeaderCache] = None,
+            event_log: Optional[EventLogWriter] = None,
+            head_subscription: Optional[HeadSubscription] = None,
     ) -> None:
         """Creates a new BlockchainListener
 
@@ -94,26 +123,52 @@ class BlockchainListener(gevent.Greenlet):
             web3: A Web3 instance
             contract_manager: A contract manager
             contract_name: The name of the contract
+            contract_address: The address of the first contract to follow, can be `None`
             required_confirmations: The number of confirmations required to call a block confirmed
-            sync_chunk_size: The size of the chunks used during syncing
+            sync_chunk_size: The initial size of the chunks used during syncing, it is adapted
+                to the number of events and the latency of the node
+            max_sync_chunk_size: The maximum size of the chunks used during syncing
+            backfill_workers: The number of chunks fetched concurrently while syncing
             poll_interval: The interval used between polls
             sync_start_block: The block number syncing is started at
+            block_headers: A cache of recent block hashes, can be shared between listeners
+            event_log: A log the raw confirmed events are appended to
+            head_subscription: A subscription to new heads, updates are triggered by new
+                blocks instead of polling while it is active
         """
         super().__init__()
 
         self.contract_manager = contract_manager
         self.contract_name = contract_name
-        self.contract_address = contract_address
+        self.event_decoder = get_event_decoder(contract_manager, contract_name, web3.codec)
+        self.contract_addresses: List[str] = []
+        if contract_address is not None:
+            self.contract_addresses.append(contract_address)
+        # contracts which still have to be synced up to the confirmed head, with their head
+        self.catching_up: Dict[str, int] = {}
 
         self.required_confirmations = required_confirmations
         self.web3 = web3
+        if block_headers is None:
+            block_headers = BlockHeaderCache(web3, required_confirmations + HEADER_CACHE_MARGIN)
+        self.block_headers = block_headers
+        self.event_log = event_log
+        self.head_subscription = head_subscription
+        # set when the subscription didn't report a new head in time
+        self.head_stalled = False
 
         self.confirmed_callbacks: Dict[int, Tuple[List, Callable]] = {}
         self.unconfirmed_callbacks: Dict[int, Tuple[List, Callable]] = {}
+        # called after the confirmed events of a block range were handled
+        self.batch_callbacks: List[Callable] = []
+        # cleared while the callbacks of an update run, until the heads include their events
+        self.is_consistent = True
 
         self.wait_sync_event = gevent.event.Event()
         self.is_connected = gevent.event.Event()
-        self.sync_chunk_size = sync_chunk_size
+        self.chunk_size = AdaptiveChunkSize(sync_chunk_size, max_size=max_sync_chunk_size)
+        self.backfill_workers = max(1, backfill_workers)
+        self.backfill_pool = gevent.pool.Pool(self.backfill_workers)
         self.running = False
         self.poll_interval = poll_interval
 
@@ -123,6 +178,8 @@ class BlockchainListener(gevent.Greenlet):
         self.confirmed_head_hash = None
 
         self.counter = 0
+        # held while an update runs, so the heads always match the handled events
+        self.update_lock = gevent.lock.Semaphore()
 
     def add_confirmed_listener(self, topics: List, callback: Callable):
         """ Add a callback to listen for confirmed events. """
@@ -134,40 +191,168 @@ class BlockchainListener(gevent.Greenlet):
         self.unconfirmed_callbacks[self.counter] = (topics, callback)
         self.counter += 1
 
+    def add_batch_listener(self, callback: Callable):
+        """ Add a callback, called without arguments after each batch of confirmed events. """
+        self.batch_callbacks.append(callback)
+
+    def add_contract_address(self, contract_address: str, sync_start_block: int = 0):
+        """ Start following another contract, syncing it from `sync_start_block` on.
+
+        The contract is caught up on its own until it reached the confirmed head of the
+        listener. Only the confirmed listeners are called for the catch-up range.
+        """
+        if contract_address in self.contract_addresses or contract_address in self.catching_up:
+            return
+
+        self.catching_up[contract_address] = sync_start_block
+
     def _run(self):
         self.running = True
         log.info('Starting blockchain polling (interval %ss)', self.poll_interval)
         while self.running:
             try:
-                self._update()
+                with self.update_lock:
+                    self._update()
                 self.is_connected.set()
-                if self.wait_sync_event.is_set():
-                    gevent.sleep(self.poll_interval)
-            except requests.exceptions.ConnectionError as e:
+                # contracts are caught up without waiting for the next block
+                if self.wait_sync_event.is_set() and len(self.catching_up) == 0:
+                    self._wait_for_new_block()
+                else:
+                    # let other greenlets take the update lock between sync steps
+                    gevent.sleep(0)
+            except (requests.RequestException, ValueError) as e:
+                if not self.is_consistent:
+                    # the callbacks handled a part of the events, a retry would repeat them
+                    raise
                 endpoint = self.web3.currentProvider.endpoint_uri
-                log.warning(
-                    'Ethereum node (%s) refused connection. Retrying in %d seconds.' %
-                    (endpoint, self.poll_interval),
-                )
+                if isinstance(e, requests.exceptions.ConnectionError):
+                    log.warning(
+                        'Ethereum node (%s) refused connection. Retrying in %d seconds.' %
+                        (endpoint, self.poll_interval),
+                    )
+                else:
+                    log.warning(
+                        'Request to Ethereum node (%s) failed (%s). Retrying in %d seconds.' %
+                        (endpoint, e, self.poll_interval),
+                    )
                 gevent.sleep(self.poll_interval)
                 self.is_connected.clear()
         log.info('Stopped blockchain polling')
 
+    def _wait_for_new_block(self):
+        """ Waits for the subscription to report a new head, polls without a subscription. """
+        subscription = self.head_subscription
+        if subscription is None:
+            gevent.sleep(self.poll_interval)
+        elif subscription.wait_for_new_head(
+            self.unconfirmed_head_number,
+            timeout=self.poll_interval * HEAD_SUBSCRIPTION_POLL_FACTOR,
+        ):
+            block_number = subscription.current_block_number()
+            self.head_stalled = (
+                block_number is None or block_number <= self.unconfirmed_head_number
+            )
+        else:
+            # poll, unless the subscription is (re-)established in the meantime
+            subscription.is_subscribed.wait(self.poll_interval)
+
+    def _get_current_block(self) -> int:
+        if self.head_subscription is not None and not self.head_stalled:
+            block_number = self.head_subscription.current_block_number()
+            if block_number is not None:
+                return block_number
+
+        return self.web3.eth.blockNumber
+
     def stop(self):
         """ Stops the BlockchainListener. """
         self.running = False
 
+    def get_state(self) -> Dict:
+        """ Returns the sync state of the listener, call it while holding `update_lock`. """
+        return dict(
+            confirmed_head_number=self.confirmed_head_number,
+            confirmed_head_hash=self.confirmed_head_hash,
+            contract_addresses=list(self.contract_addresses),
+            catching_up=dict(self.catching_up),
+        )
+
+    def restore_state(self, state: Dict):
+        """ Resumes syncing from a state returned by `get_state`. """
+        self.confirmed_head_number = state['confirmed_head_number']
+        self.confirmed_head_hash = state['confirmed_head_hash']
+        self.unconfirmed_head_number = self.confirmed_head_number
+        self.unconfirmed_head_hash = self.confirmed_head_hash
+        self.contract_addresses = list(state['contract_addresses'])
+        self.catching_up = dict(state['catching_up'])
+
     def wait_sync(self):
         """Blocks until event polling is up-to-date with a most recent block of the blockchain. """
         self.wait_sync_event.wait()
 
+    def _catch_up_contracts(self):
+        """ Sync newly added contracts up to the confirmed head, one chunk per update.
+
+        All contracts catching up are synced together, with one request per block range
+        starting after the lowest of their heads. The events up to the head of a contract were
+        handled already and are skipped. So the contracts added one after another, e.g. while
+        the registry is synced, converge into a single range.
+        """
+        if len(self.catching_up) == 0:
+            return
+
+        # contracts added while filtering are caught up in the next pass
+        head_numbers = dict(self.catching_up)
+        head_number = min(head_numbers.values())
+        new_head_number = min(head_number + self.sync_range_size, self.confirmed_head_number)
+        if head_number < new_head_number and len(self.confirmed_callbacks) > 0:
+            contract_addresses = [
+                contract_address
+                for contract_address, contract_head_number in head_numbers.items()
+                if contract_head_number < new_head_number
+            ]
+            filters = self.get_filter_params(head_number, new_head_number)
+            log.info(
+                'Catching up %d contracts: %s-%s ...',
+                len(contract_addresses),
+                filters['from_block'],
+                filters['to_block'],
+            )
+            self.filter_events(
+                filters,
+                self.confirmed_callbacks,
+                contract_addresses,
+                {
+                    contract_address: head_numbers[contract_address] + 1
+                    for contract_address in contract_addresses
+                },
+            )
+
+        for contract_address, contract_head_number in head_numbers.items():
+            contract_head_number = max(contract_head_number, new_head_number)
+            if contract_head_number >= self.confirmed_head_number:
+                del self.catching_up[contract_address]
+                self.contract_addresses.append(contract_address)
+                log.info(
+                    'Contract %s caught up at block %d',
+                    contract_address,
+                    contract_head_number,
+                )
+            else:
+                self.catching_up[contract_address] = contract_head_number
+        self.is_consistent = True
+
     def _update(self):
-        current_block = self.web3.eth.blockNumber
+        current_block = self._get_current_block()
 
         # reset unconfirmed channels in case of reorg
         self.reset_unconfirmed_on_reorg(current_block)
 
-        new_unconfirmed_head_number = self.unconfirmed_head_number + self.sync_chunk_size
+        self._catch_up_contracts()
+        # contracts added while filtering are caught up in the next pass
+        contract_addresses = list(self.contract_addresses)
+
+        new_unconfirmed_head_number = self.unconfirmed_head_number + self.sync_range_size
         new_unconfirmed_head_number = min(new_unconfirmed_head_number, current_block)
         new_confirmed_head_number = max(
             new_unconfirmed_head_number - self.required_confirmations,
@@ -179,9 +364,24 @@ class BlockchainListener(gevent.Greenlet):
                 self.unconfirmed_head_number >= new_unconfirmed_head_number):
             return
 
+        # fetched before the callbacks run, so a failed request can be retried
+        head_hashes = self.block_headers.get_hashes(
+            [new_unconfirmed_head_number, new_confirmed_head_number],
+        )
+        new_unconfirmed_head_hash = head_hashes[new_unconfirmed_head_number]
+        new_confirmed_head_hash = head_hashes[new_confirmed_head_number]
+        if new_unconfirmed_head_hash is None or new_confirmed_head_hash is None:
+            log.critical("RPC endpoint didn't return proper info for an existing block "
+                         "(%d,%d)" % (new_unconfirmed_head_number, new_confirmed_head_number))
+            log.critical("It is possible that the blockchain isn't fully synced. "
+                         "This often happens when Parity is run with --fast or --warp sync.")
+            log.critical("Cannot continue - check status of the ethereum node.")
+            sys.exit(1)
+
         run_confirmed_filters = (
             self.confirmed_head_number < new_confirmed_head_number and
-            len(self.confirmed_callbacks) > 0
+            len(self.confirmed_callbacks) > 0 and
+            len(contract_addresses) > 0
         )
         if run_confirmed_filters:
             # create filters depending on current head number
@@ -196,12 +396,13 @@ class BlockchainListener(gevent.Greenlet):
                 current_block,
             )
             # filter the events and run callbacks
-            self.filter_events(filters_confirmed, self.confirmed_callbacks)
+            self.filter_events(filters_confirmed, self.confirmed_callbacks, contract_addresses)
             log.debug('Finished.')
 
         run_unconfirmed_filters = (
             self.unconfirmed_head_number < new_unconfirmed_head_number and
-            len(self.unconfirmed_callbacks) > 0
+            len(self.unconfirmed_callbacks) > 0 and
+            len(contract_addresses) > 0
         )
         if run_unconfirmed_filters:
             # create filters depending on current head number
@@ -216,55 +417,194 @@ class BlockchainListener(gevent.Greenlet):
                 current_block,
             )
             # filter the events and run callbacks
-            self.filter_events(filters_unconfirmed, self.unconfirmed_callbacks)
+            self.filter_events(filters_unconfirmed, self.unconfirmed_callbacks, contract_addresses)
             log.debug('Finished.')
 
         # update head hash and number
-        try:
-            new_unconfirmed_head_hash = self.web3.eth.getBlock(new_unconfirmed_head_number).hash
-            new_confirmed_head_hash = self.web3.eth.getBlock(new_confirmed_head_number).hash
-        except AttributeError:
-            log.critical("RPC endpoint didn't return proper info for an existing block "
-                         "(%d,%d)" % (new_unconfirmed_head_number, new_confirmed_head_number))
-            log.critical("It is possible that the blockchain isn't fully synced. "
-                         "This often happens when Parity is run with --fast or --warp sync.")
-            log.critical("Cannot continue - check status of the ethereum node.")
-            sys.exit(1)
-
         self.unconfirmed_head_number = new_unconfirmed_head_number
         self.unconfirmed_head_hash = new_unconfirmed_head_hash
         self.confirmed_head_number = new_confirmed_head_number
         self.confirmed_head_hash = new_confirmed_head_hash
+        self.is_consistent = True
+
+        listener = self.contract_name
+        LISTENER_HEAD_LAG.labels(listener).set(current_block - self.unconfirmed_head_number)
+        LISTENER_CONFIRMED_HEAD.labels(listener).set(self.confirmed_head_number)
+        LISTENER_CHUNK_SIZE.labels(listener).set(self.chunk_size.size)
 
         if not self.wait_sync_event.is_set() and new_unconfirmed_head_number == current_block:
             self.wait_sync_event.set()
 
-    def filter_events(self, filter_params: Dict, name_to_callback: Dict):
+    @property
+    def sync_range_size(self) -> int:
+        """ The maximum number of blocks handled in one update, one chunk per backfill worker. """
+        return self.chunk_size.size * self.backfill_workers
+
+    def _fetch_events(
+        self,
+        filter_params: Dict,
+        name_to_callback: Dict,
+        contract_addresses: List[str],
+    ) -> Dict[int, List]:
+        """ Fetch the raw events for every callback in the given block range. """
+        return {
+            id: self._get_events_adaptive(
+                contract_addresses,
+                topics,
+                filter_params['from_block'],
+                filter_params['to_block'],
+            )
+            for id, (topics, _) in name_to_callback.items()
+        }
+
+    def _get_events_adaptive(
+        self,
+        contract_addresses: List[str],
+        topics: List,
+        from_block: int,
+        to_block: int,
+    ) -> List:
+        """ Fetch the events of a block range, splitting it if the node rejects its size.
+
+        The outcome of each request is used to tune the chunk size of the following ones.
+        """
+        num_blocks = to_block - from_block + 1
+        start = time.monotonic()
+        try:
+            events = get_events(
+                web3=self.web3,
+                contract_address=contract_addresses,
+                topics=topics,
+                from_block=from_block,
+                to_block=to_block,
+            )
+        except ValueError as e:
+            if num_blocks == 1 or not is_log_range_error(e):
+                raise
+
+            self.chunk_size.record_failure(num_blocks)
+            middle = from_block + num_blocks // 2
+            log.debug(
+                'Range %s-%s rejected by the node, splitting it: %s',
+                from_block,
+                to_block,
+                e,
+            )
+            return (
+                self._get_events_adaptive(contract_addresses, topics, from_block, middle - 1) +
+                self._get_events_adaptive(contract_addresses, topics, middle, to_block)
+            )
+
+        self.chunk_size.record_success(num_blocks, len(events), time.monotonic() - start)
+        return events
+
+    def _fetch_events_concurrently(
+        self,
+        filter_params: Dict,
+        name_to_callback: Dict,
+        contract_addresses: List[str],
+    ) -> Dict[int, List]:
+        """ Split the block range into chunks and fetch them through the backfill pool.
+
+        The events of each callback are returned in chain order, as the chunks are
+        contiguous and their results are concatenated in the order of the chunks.
+        """
+        from_block = filter_params['from_block']
+        to_block = filter_params['to_block']
+        chunk_size = self.chunk_size.size
+        chunks = [
+            dict(
+                from_block=chunk_start,
+                to_block=min(chunk_start + chunk_size - 1, to_block),
+            )
+            for chunk_start in range(from_block, to_block + 1, chunk_size)
+        ]
+        if len(chunks) == 1:
+            return self._fetch_events(filter_params, name_to_callback, contract_addresses)
+
+        def fetch_chunk(chunk: Dict) -> Union[Dict[int, List], Exception]:
+            # a worker raising would be reported to the hub's error handler, which exits
+            try:
+                return self._fetch_events(chunk, name_to_callback, contract_addresses)
+            except (requests.RequestException, ValueError) as e:
+                return e
+
+        log.debug('Fetching %d chunks concurrently: %s-%s', len(chunks), from_block, to_block)
+        results = self.backfill_pool.imap(fetch_chunk, chunks)
+
+        events: Dict[int, List] = {id: [] for id in name_to_callback}
+        for chunk_events in results:
+            if isinstance(chunk_events, Exception):
+                raise chunk_events
+            for id, raw_events in chunk_events.items():
+                events[id].extend(raw_events)
+        return events
+
+    def filter_events(
+        self,
+        filter_params: Dict,
+        name_to_callback: Dict,
+        contract_addresses: List[str],
+        from_blocks: Optional[Dict[str, int]] = None,
+    ):
         """ Filter events for given event names
 
+        All events of the range are fetched before any callback is executed. The callbacks
+        are then run strictly in (blockNumber, logIndex) order.
+
         Params:
             filter_params: arguments for the filter call
             name_to_callback: dict that maps event name to callbacks executed
                 if the event is emmited
+            contract_addresses: the contracts to filter, all of them in the same request
+            from_blocks: the first block of each contract whose events are handled, if it is
+                after the start of the range
         """
-        for id, (topics, callback) in name_to_callback.items():
-            events = get_events(
-                web3=self.web3,
-                contract_address=self.contract_address,
-                topics=topics,
-                **filter_params,
-            )
+        events_by_callback = self._fetch_events_concurrently(
+            filter_params,
+            name_to_callback,
+            contract_addresses,
+        )
 
-            events_abi = filter_by_type("event", self.contract_manager.get_contract_abi(self.contract_name))
-            topic_to_event_abi = {event_abi_to_log_topic(event_abi): event_abi for event_abi in events_abi}
-            for raw_event in events:
-                decoded_event = decode_event(
-                    codec=self.web3.codec,
-                    topic_to_event_abi=topic_to_event_abi,
-                    log_entry=raw_event,
-                )
-                log.debug('Received confirmed event: \n%s', decoded_event)
-                callback(decoded_event)
+        ordered_events = heapq.merge(
+            *[
+                [
+                    ((raw_event['blockNumber'], raw_event['logIndex'], id), raw_event)
+                    for raw_event in raw_events
+                ]
+                for id, raw_events in events_by_callback.items()
+            ],
+            key=lambda item: item[0],
+        )
+        if from_blocks is not None:
+            from_blocks = {
+                to_checksum_address(contract_address): from_block
+                for contract_address, from_block in from_blocks.items()
+            }
+        # only the confirmed events are logged
+        event_log = self.event_log if name_to_callback is self.confirmed_callbacks else None
+        last_logged = None
+        self.is_consistent = False
+        for (block_number, log_index, id), raw_event in ordered_events:
+            if from_blocks is not None and block_number < from_blocks[raw_event['address']]:
+                continue
+
+            # a log matching several callbacks is only stored once
+            if event_log is not None and last_logged != (block_number, log_index):
+                event_log.append(raw_event)
+                last_logged = (block_number, log_index)
+
+            _, callback = name_to_callback[id]
+            decoded_event = self.event_decoder.decode(raw_event)
+            log.debug('Received confirmed event: \n%s', decoded_event)
+            callback(decoded_event)
+
+        if event_log is not None:
+            event_log.flush()
+
+        if name_to_callback is self.confirmed_callbacks:
+            for batch_callback in self.batch_callbacks:
+                batch_callback()
 
     def _detected_chain_reorg(self, current_block: int):
         log.debug(
@@ -275,6 +615,7 @@ class BlockchainListener(gevent.Greenlet):
             current_block,
             current_block - self.unconfirmed_head_number,
         )
+        REORGS.labels(self.contract_name).inc()
         # here we should probably have a callback or a user-overriden method
         self.unconfirmed_head_number = self.confirmed_head_number
         self.unconfirmed_head_hash = self.confirmed_head_hash
@@ -283,13 +624,15 @@ class BlockchainListener(gevent.Greenlet):
         """Test if chain reorganization happened (head number used in previous pass is greater than
         current_block parameter) and in that case reset unconfirmed event list."""
         if self.wait_sync_event.is_set():  # but not on first sync
+            self.block_headers.update_head(current_block)
+            head_hashes = self.block_headers.get_hashes(
+                [self.unconfirmed_head_number, self.confirmed_head_number],
+            )
 
             # block number increased or stayed the same
             if current_block >= self.unconfirmed_head_number:
                 # if the hash of our head changed, there was a chain reorg
-                current_unconfirmed_hash = self.web3.eth.getBlock(
-                    self.unconfirmed_head_number,
-                )["hash"]
+                current_unconfirmed_hash = head_hashes[self.unconfirmed_head_number]
                 if current_unconfirmed_hash != self.unconfirmed_head_hash:
                     self._detected_chain_reorg(current_block)
             # block number decreased, there was a chain reorg
@@ -298,20 +641,8 @@ class BlockchainListener(gevent.Greenlet):
 
             # now we have to check that the confirmed_head_hash stayed the same
             # otherwise the program aborts
-            try:
-                current_head_hash = self.web3.eth.getBlock(self.confirmed_head_number)["hash"]
-                if current_head_hash != self.confirmed_head_hash:
-                    log.critical(
-                        'Events considered confirmed have been reorganized. '
-                        'Expected block hash %s for block number %d, but got block hash %s. '
-                        "The BlockchainListener's number of required confirmations is %d.",
-                        self.confirmed_head_hash,
-                        self.confirmed_head_number,
-                        current_head_hash,
-                        self.required_confirmations,
-                    )
-                    sys.exit(1)  # unreachable as long as confirmation level is set high enough
-            except AttributeError:
+            current_head_hash = head_hashes[self.confirmed_head_number]
+            if current_head_hash is None:
                 log.critical(
                     'Events considered confirmed have been reorganized. '
                     'The block %d with hash %s does not exist any more.',
@@ -319,13 +650,24 @@ class BlockchainListener(gevent.Greenlet):
                     self.confirmed_head_hash,
                 )
                 sys.exit(1)  # unreachable as long as confirmation level is set high enough
+            if current_head_hash != self.confirmed_head_hash:
+                log.critical(
+                    'Events considered confirmed have been reorganized. '
+                    'Expected block hash %s for block number %d, but got block hash %s. '
+                    "The BlockchainListener's number of required confirmations is %d.",
+                    self.confirmed_head_hash,
+                    self.confirmed_head_number,
+                    current_head_hash,
+                    self.required_confirmations,
+                )
+                sys.exit(1)  # unreachable as long as confirmation level is set high enough
 
-    # filter for events after block_number
-    # to_block is incremented because eth-tester doesn't include events from the end block
-    # see https://github.com/raiden-network/raiden/pull/1321
+    # filter for events after from_block, up to and including to_block
+    # `eth_getLogs` includes both ends, so consecutive ranges must not share a block,
+    # otherwise the events of the boundary block are handled twice
     def get_filter_params(self, from_block: int, to_block: int) -> Dict[str, int]:
         assert from_block <= to_block
         return {
             'from_block': from_block + 1,
-            'to_block': to_block + 1,
+            'to_block': to_block,
         }
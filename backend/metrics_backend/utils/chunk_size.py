@@ -0,0 +1,84 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+# fragments of the error messages nodes and RPC providers return for oversized log queries
+LOG_RANGE_ERROR_MESSAGES = (
+    'query returned more than',
+    'response size exceeded',
+    'log response size exceeded',
+    'block range',
+    'limit exceeded',
+    'query timeout exceeded',
+)
+LIMIT_EXCEEDED_ERROR_CODE = -32005
+
+
+def is_log_range_error(error: Exception) -> bool:
+    """ Checks if an `eth_getLogs` error is caused by a too large block range. """
+    if not isinstance(error, ValueError) or len(error.args) == 0:
+        return False
+
+    details = error.args[0]
+    if isinstance(details, dict):
+        if details.get('code') == LIMIT_EXCEEDED_ERROR_CODE:
+            return True
+        message = str(details.get('message', ''))
+    else:
+        message = str(details)
+
+    message = message.lower()
+    return any(fragment in message for fragment in LOG_RANGE_ERROR_MESSAGES)
+
+
+class AdaptiveChunkSize:
+    """ Tunes the number of blocks requested per `eth_getLogs` call.
+
+    The size grows on sparse history and shrinks when the responses get large or slow, or
+    when the node rejects the query.
+    """
+
+    def __init__(
+        self,
+        initial_size: int = 1_000,
+        *,
+        min_size: int = 10,
+        max_size: int = 100_000,
+        target_num_logs: int = 2_000,
+        target_duration: float = 2.0,
+    ) -> None:
+        """ Creates a new AdaptiveChunkSize
+
+        Args:
+            initial_size: The number of blocks used for the first requests
+            min_size: The lower bound of the chunk size
+            max_size: The upper bound of the chunk size
+            target_num_logs: The number of logs a single response should stay below
+            target_duration: The number of seconds a single request should stay below
+        """
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size)
+        self.size = min(max(initial_size, self.min_size), self.max_size)
+        self.target_num_logs = target_num_logs
+        self.target_duration = target_duration
+
+    def record_success(self, num_blocks: int, num_logs: int, duration: float):
+        """ Adjusts the size after a successful request over `num_blocks` blocks. """
+        if num_logs > self.target_num_logs or duration > self.target_duration:
+            self._set_size(self.size // 2)
+        # partial chunks, e.g. close to the head, don't tell anything about the history
+        elif num_blocks >= self.size:
+            if num_logs < self.target_num_logs // 4 and duration < self.target_duration / 4:
+                self._set_size(self.size * 4)
+            elif num_logs < self.target_num_logs // 2 and duration < self.target_duration / 2:
+                self._set_size(self.size * 2)
+
+    def record_failure(self, num_blocks: int):
+        """ Shrinks the size after the node rejected a request over `num_blocks` blocks. """
+        self._set_size(min(self.size, num_blocks) // 2)
+
+    def _set_size(self, size: int):
+        size = min(max(size, self.min_size), self.max_size)
+        if size != self.size:
+            log.info('Adjusting eth_getLogs chunk size: %d -> %d blocks', self.size, size)
+            self.size = size
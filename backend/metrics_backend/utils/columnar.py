@@ -0,0 +1,112 @@
+""" A compact MessagePack encoding of the `/json` document.
+
+The channels and the nodes of a token network are encoded as columns, one array per
+field, instead of one map per channel which repeats all field names. Addresses are
+encoded once as 20 bytes in the `addresses` array of the document, and everywhere else as
+their index into it. Token amounts don't fit into MessagePack integers, they are encoded
+as big endian unsigned integers of as many bytes as needed. Channel states are encoded as
+their index into `channel_states`. The overall metrics are the same as in JSON.
+"""
+from typing import Dict, Iterable, List
+
+import msgpack
+
+from metrics_backend.model import ChannelView, TokenNetwork
+from metrics_backend.utils.address_registry import AddressId, address_registry
+from metrics_backend.utils.serialisation import token_network_summary_to_dict
+
+# the channel states in the order of their indexes
+CHANNEL_STATES = ('opened', 'closed', 'settled')
+_STATE_INDEXES = {
+    ChannelView.State.OPENED: 0,
+    ChannelView.State.CLOSED: 1,
+    ChannelView.State.SETTLED: 2,
+}
+# number of entries of `networks_to_msgpack`
+NUM_NETWORKS_ENTRIES = 3
+
+
+def amount_to_bytes(amount: int) -> bytes:
+    return amount.to_bytes((amount.bit_length() + 7) // 8, 'big')
+
+
+class AddressTable:
+    """ The addresses of a document, each one gets an index the first time it is used. """
+
+    def __init__(self) -> None:
+        self.indexes: Dict[AddressId, int] = {}
+        self.addresses: List[bytes] = []
+
+    def index(self, address_id: AddressId) -> int:
+        index = self.indexes.get(address_id)
+        if index is None:
+            index = self.indexes[address_id] = len(self.addresses)
+            self.addresses.append(address_registry.canonical_address(address_id))
+        return index
+
+
+def token_network_to_columns(
+    token_network: TokenNetwork,
+    nodes_presence_status: Dict[AddressId, bool],
+    address_table: AddressTable,
+) -> Dict:
+    """ Returns the token network like `token_network_to_dict`, with columns of channels
+    and nodes. """
+    index = address_table.index
+    summary = token_network_summary_to_dict(token_network)
+    summary['address'] = index(address_registry.intern(token_network.address))
+    summary['token'] = dict(
+        summary['token'],
+        address=index(address_registry.intern(token_network.token_info.address)),
+    )
+    summary['total_deposits'] = amount_to_bytes(summary['total_deposits'])
+
+    # the views of a channel store are created while iterating, they have to be kept
+    views = list(token_network.channels.values())
+    channels = dict(
+        channel_identifier=list(token_network.channels.keys()),
+        status=[_STATE_INDEXES[view.state] for view in views],
+        participant1=[index(view.participant1_id) for view in views],
+        participant2=[index(view.participant2_id) for view in views],
+        deposit1=[amount_to_bytes(view.deposit_p1) for view in views],
+        deposit2=[amount_to_bytes(view.deposit_p2) for view in views],
+    )
+
+    participants = token_network.participants
+    counts = participants.values()
+    nodes = dict(
+        address=[index(address_id) for address_id in participants],
+        online=[nodes_presence_status.get(address_id, False) for address_id in participants],
+        opened=[participants_channels.opened for participants_channels in counts],
+        closed=[participants_channels.closed for participants_channels in counts],
+        settled=[participants_channels.settled for participants_channels in counts],
+    )
+
+    return dict(summary, channels=channels, nodes=nodes)
+
+
+def networks_to_msgpack(
+    token_networks: Iterable[TokenNetwork],
+    nodes_presence_status: Dict[AddressId, bool],
+) -> bytes:
+    """ Encodes the `channel_states`, `addresses` and `networks` entries of the document.
+
+    The result is the content of a map without its header, the other entries can be
+    encoded separately and put in front of it.
+    """
+    packer = msgpack.Packer()
+    address_table = AddressTable()
+    # the networks are encoded one at a time, their columns are not kept
+    networks = [
+        packer.pack(token_network_to_columns(network, nodes_presence_status, address_table))
+        for network in token_networks
+    ]
+    return b''.join([
+        packer.pack('channel_states'),
+        packer.pack(CHANNEL_STATES),
+        packer.pack('addresses'),
+        packer.pack(address_table.addresses),
+        packer.pack('networks'),
+        packer.pack_array_header(len(networks)),
+        *networks,
+    ])
@@ -0,0 +1,158 @@
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from eth_abi.codec import ABICodec
+from eth_utils import decode_hex, to_checksum_address
+from eth_utils.abi import event_abi_to_log_topic
+from raiden_contracts.constants import ChannelEvent, EVENT_TOKEN_NETWORK_CREATED
+from raiden_contracts.contract_manager import ContractManager
+from web3._utils.abi import filter_by_type
+from web3._utils.events import get_event_data
+from web3.datastructures import AttributeDict
+
+# events decoded without going through web3's generic ABI machinery
+FAST_PATH_EVENTS = frozenset([
+    ChannelEvent.OPENED.value,
+    ChannelEvent.DEPOSIT.value,
+    ChannelEvent.WITHDRAW.value,
+    ChannelEvent.CLOSED.value,
+    ChannelEvent.SETTLED.value,
+    EVENT_TOKEN_NETWORK_CREATED,
+])
+
+WORD_SIZE = 32
+
+WordDecoder = Callable[[bytes], object]
+
+
+@lru_cache(maxsize=65536)
+def _decode_address(word: bytes) -> str:
+    # addresses repeat a lot, so the checksum computation is cached
+    return to_checksum_address(word[12:])
+
+
+def _decode_uint(word: bytes) -> int:
+    return int.from_bytes(word, 'big')
+
+
+def _decode_int(word: bytes) -> int:
+    return int.from_bytes(word, 'big', signed=True)
+
+
+def _decode_bool(word: bytes) -> bool:
+    return word[-1] != 0
+
+
+def _word_decoder(abi_type: str) -> Optional[WordDecoder]:
+    """ Returns a decoder for a type stored in a single word, `None` for any other type. """
+    if abi_type == 'address':
+        return _decode_address
+    if abi_type == 'bool':
+        return _decode_bool
+    if re.fullmatch(r'uint\d*', abi_type):
+        return _decode_uint
+    if re.fullmatch(r'int\d*', abi_type):
+        return _decode_int
+
+    match = re.fullmatch(r'bytes(\d+)', abi_type)
+    if match is not None:
+        size = int(match.group(1))
+        return lambda word: word[:size]
+
+    return None
+
+
+class FastEventDecoder:
+    """ Decodes an event with static arguments by slicing its topics and data words. """
+
+    def __init__(self, event_abi: Dict) -> None:
+        self.name = event_abi['name']
+        self.topic_decoders: List[Tuple[str, WordDecoder]] = []
+        self.data_decoders: List[Tuple[str, WordDecoder]] = []
+
+        for argument in event_abi['inputs']:
+            decoder = _word_decoder(argument['type'])
+            if decoder is None:
+                raise ValueError(f'Unsupported type {argument["type"]} in event {self.name}')
+
+            if argument['indexed']:
+                self.topic_decoders.append((argument['name'], decoder))
+            else:
+                self.data_decoders.append((argument['name'], decoder))
+
+    @staticmethod
+    def supports(event_abi: Dict) -> bool:
+        return (
+            not event_abi.get('anonymous', False) and
+            all(_word_decoder(argument['type']) is not None for argument in event_abi['inputs'])
+        )
+
+    def __call__(self, log_entry: Dict) -> Dict:
+        topics = log_entry['topics']
+        data = log_entry['data']
+        if isinstance(data, str):
+            data = decode_hex(data)
+
+        if len(topics) != len(self.topic_decoders) + 1:
+            raise ValueError(
+                f'Expected {len(self.topic_decoders) + 1} log topics for {self.name}, '
+                f'got {len(topics)}'
+            )
+        if len(data) < len(self.data_decoders) * WORD_SIZE:
+            raise ValueError(f'Log data of {self.name} is too short ({len(data)} bytes)')
+
+        args = {}
+        for (name, decoder), topic in zip(self.topic_decoders, topics[1:]):
+            args[name] = decoder(bytes(topic))
+        for index, (name, decoder) in enumerate(self.data_decoders):
+            offset = index * WORD_SIZE
+            args[name] = decoder(data[offset:offset + WORD_SIZE])
+
+        return AttributeDict({
+            'args': AttributeDict(args),
+            'event': self.name,
+            'logIndex': log_entry['logIndex'],
+            'transactionIndex': log_entry['transactionIndex'],
+            'transactionHash': log_entry['transactionHash'],
+            'address': log_entry['address'],
+            'blockHash': log_entry['blockHash'],
+            'blockNumber': log_entry['blockNumber'],
+        })
+
+
+class EventDecoder:
+    """ Decodes the events of a contract, using the fast path wherever possible. """
+
+    def __init__(
+        self,
+        codec: ABICodec,
+        contract_abi: List[Dict],
+        fast_path_events: frozenset = FAST_PATH_EVENTS,
+    ) -> None:
+        self.codec = codec
+        self.decoders: Dict[bytes, Callable[[Dict], Dict]] = {}
+
+        for event_abi in filter_by_type('event', contract_abi):
+            topic = event_abi_to_log_topic(event_abi)
+            if event_abi['name'] in fast_path_events and FastEventDecoder.supports(event_abi):
+                self.decoders[topic] = FastEventDecoder(event_abi)
+            else:
+                self.decoders[topic] = self._generic_decoder(event_abi)
+
+    def _generic_decoder(self, event_abi: Dict) -> Callable[[Dict], Dict]:
+        return lambda log_entry: get_event_data(self.codec, event_abi, log_entry)
+
+    def decode(self, log_entry: Dict) -> Dict:
+        topic = bytes(log_entry['topics'][0])
+        return self.decoders[topic](log_entry)
+
+
+@lru_cache(maxsize=None)
+def get_event_decoder(
+    contract_manager: ContractManager,
+    contract_name: str,
+    codec: ABICodec,
+) -> EventDecoder:
+    """ Returns the decoder for a contract, it is only built once per contract name. """
+    return EventDecoder(codec, contract_manager.get_contract_abi(contract_name))
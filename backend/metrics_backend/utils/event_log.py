@@ -0,0 +1,183 @@
+import logging
+import mmap
+import os
+import re
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from eth_utils import decode_hex, to_canonical_address, to_checksum_address
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024  # bytes
+SEGMENT_FILE_PATTERN = re.compile(r'events-(\d{6})\.log')
+
+# block number, log index, contract address, number of topics, data length
+RECORD_HEADER = struct.Struct('<QI20sBI')
+TOPIC_SIZE = 32
+
+# segment number and offset in the segment
+EventLogPosition = Tuple[int, int]
+
+
+def segment_file_name(segment: int) -> str:
+    return f'events-{segment:06d}.log'
+
+
+def list_segments(directory: str) -> List[int]:
+    """ Returns the numbers of the segments in `directory`, in ascending order. """
+    if not os.path.isdir(directory):
+        return []
+
+    segments = []
+    for file_name in os.listdir(directory):
+        match = SEGMENT_FILE_PATTERN.fullmatch(file_name)
+        if match is not None:
+            segments.append(int(match.group(1)))
+    return sorted(segments)
+
+
+def has_events(directory: str) -> bool:
+    """ Returns whether any segment in `directory` has events. """
+    return any(
+        os.path.getsize(os.path.join(directory, segment_file_name(segment))) > 0
+        for segment in list_segments(directory)
+    )
+
+
+def encode_record(raw_event: Dict) -> bytes:
+    """ Encodes a raw log entry as returned by `eth_getLogs`. """
+    topics = [bytes(topic) for topic in raw_event['topics']]
+    data = raw_event['data']
+    if isinstance(data, str):
+        data = decode_hex(data)
+
+    header = RECORD_HEADER.pack(
+        raw_event['blockNumber'],
+        raw_event['logIndex'],
+        to_canonical_address(raw_event['address']),
+        len(topics),
+        len(data),
+    )
+    return b''.join([header, *topics, data])
+
+
+class EventLogWriter:
+    """ Appends raw confirmed events to segment files in a directory. """
+
+    def __init__(self, directory: str, segment_size: int = DEFAULT_SEGMENT_SIZE) -> None:
+        self.directory = directory
+        self.segment_size = segment_size
+        self._file: Optional[BinaryIO] = None
+        self._segment = 0
+        self._offset = 0
+
+    def open(self, position: Optional[EventLogPosition] = None):
+        """ Opens the log for appending at `position`, dropping all events after it.
+
+        Without a position, a new log is started, the directory must not have any events.
+
+        Raises:
+            ValueError: If there is no position, but events from a previous run
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if position is None:
+            # the events may be the only record of the chain, they are never dropped
+            if has_events(self.directory):
+                raise ValueError(
+                    f'{self.directory} has events, but there is no position to continue at'
+                )
+            position = (0, 0)
+        segment, offset = position
+
+        # the events after the position are synced again
+        for existing_segment in list_segments(self.directory):
+            if existing_segment > segment:
+                os.remove(os.path.join(self.directory, segment_file_name(existing_segment)))
+
+        path = os.path.join(self.directory, segment_file_name(segment))
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        self._file.truncate(offset)
+        self._file.seek(offset)
+        self._segment = segment
+        self._offset = offset
+        log.info(f'Appending events to {path} at offset {offset}')
+
+    def append(self, raw_event: Dict):
+        record = encode_record(raw_event)
+        if self._offset > 0 and self._offset + len(record) > self.segment_size:
+            self._rotate()
+
+        assert self._file is not None, 'the event log is not open'
+        self._file.write(record)
+        self._offset += len(record)
+
+    def _rotate(self):
+        self._file.close()
+        self._segment += 1
+        self._offset = 0
+        path = os.path.join(self.directory, segment_file_name(self._segment))
+        self._file = open(path, 'w+b')
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def position(self) -> Optional[EventLogPosition]:
+        """ Returns the position after the last appended event, `None` if it's not open. """
+        if self._file is None:
+            return None
+        self.flush()
+        return self._segment, self._offset
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def iter_event_log(directory: str) -> Iterator[Dict]:
+    """ Reads the raw events in the order they were appended, using memory-mapped segments.
+
+    A truncated record at the end of a segment, e.g. after a crash, ends the segment.
+    """
+    checksum_addresses: Dict[bytes, str] = {}
+
+    for segment in list_segments(directory):
+        path = os.path.join(directory, segment_file_name(segment))
+        if os.path.getsize(path) == 0:
+            continue
+
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            size = len(data)
+            while offset + RECORD_HEADER.size <= size:
+                block_number, log_index, address, num_topics, data_length = (
+                    RECORD_HEADER.unpack_from(data, offset)
+                )
+                topics_start = offset + RECORD_HEADER.size
+                data_start = topics_start + num_topics * TOPIC_SIZE
+                end = data_start + data_length
+                if end > size:
+                    log.warning(f'Truncated event record at offset {offset} of {path}')
+                    break
+
+                checksum_address = checksum_addresses.get(address)
+                if checksum_address is None:
+                    checksum_address = to_checksum_address(address)
+                    checksum_addresses[address] = checksum_address
+
+                yield dict(
+                    address=checksum_address,
+                    topics=[
+                        data[start:start + TOPIC_SIZE]
+                        for start in range(topics_start, data_start, TOPIC_SIZE)
+                    ],
+                    data=data[data_start:end],
+                    blockNumber=block_number,
+                    logIndex=log_index,
+                    transactionIndex=None,
+                    transactionHash=None,
+                    blockHash=None,
+                )
+                offset = end
@@ -0,0 +1,137 @@
+import json
+import logging
+from typing import Optional
+
+import gevent
+import gevent.event
+import websocket
+
+log = logging.getLogger(__name__)
+
+SUBSCRIPTION_REQUEST_ID = 1
+
+
+class HeadSubscription(gevent.Greenlet):
+    """ Follows the chain head through an `eth_subscribe('newHeads')` WebSocket subscription.
+
+    The connection is re-established whenever it drops. Users fall back to polling while
+    there is no subscription, see `wait_for_new_head`.
+    """
+
+    def __init__(
+        self,
+        ws_uri: str,
+        *,
+        reconnect_interval: int = 5,
+        timeout: int = 120,
+    ) -> None:
+        """ Creates a new HeadSubscription
+
+        Args:
+            ws_uri: The WebSocket URI of the Ethereum node, it should be the same node that
+                serves the HTTP RPC requests
+            reconnect_interval: The number of seconds to wait before reconnecting
+            timeout: The number of seconds without a new head after which the subscription
+                is considered dropped
+        """
+        super().__init__()
+        self.ws_uri = ws_uri
+        self.reconnect_interval = reconnect_interval
+        self.timeout = timeout
+
+        self.running = False
+        self.latest_block_number: Optional[int] = None
+        self.is_subscribed = gevent.event.Event()
+        self._new_head = gevent.event.Event()
+        self._connection: Optional[websocket.WebSocket] = None
+
+    def _run(self):
+        self.running = True
+        log.info(f'Subscribing to new heads at {self.ws_uri}')
+        while self.running:
+            try:
+                self._follow_heads()
+            except (websocket.WebSocketException, OSError, ValueError, KeyError) as e:
+                if self.running:
+                    log.warning(
+                        f'Head subscription dropped ({e!r}), polling until it is re-established '
+                        f'in {self.reconnect_interval} seconds'
+                    )
+            finally:
+                self._close()
+
+            if self.running:
+                gevent.sleep(self.reconnect_interval)
+        log.info('Stopped head subscription')
+
+    def stop(self):
+        self.running = False
+        self._close()
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+        if self.is_subscribed.is_set():
+            self.is_subscribed.clear()
+            # the head may be outdated once the subscription is re-established
+            self.latest_block_number = None
+            # wake up all waiters, so they fall back to polling
+            self._notify_waiters()
+
+    def _follow_heads(self):
+        self._connection = websocket.create_connection(self.ws_uri, timeout=self.timeout)
+        self._connection.send(json.dumps(dict(
+            jsonrpc='2.0',
+            id=SUBSCRIPTION_REQUEST_ID,
+            method='eth_subscribe',
+            params=['newHeads'],
+        )))
+
+        subscription_id = None
+        while self.running:
+            raw_message = self._connection.recv()
+            if not raw_message:
+                raise websocket.WebSocketConnectionClosedException('Connection closed by node')
+            message = json.loads(raw_message)
+
+            if message.get('id') == SUBSCRIPTION_REQUEST_ID:
+                if 'error' in message:
+                    raise ValueError(message['error'])
+                subscription_id = message['result']
+                self.is_subscribed.set()
+                log.info(f'Subscribed to new heads, subscription {subscription_id}')
+            elif message.get('method') == 'eth_subscription':
+                params = message['params']
+                if params['subscription'] == subscription_id:
+                    self._handle_new_head(int(params['result']['number'], 16))
+
+    def _handle_new_head(self, block_number: int):
+        log.debug(f'New head {block_number}')
+        self.latest_block_number = block_number
+        self._notify_waiters()
+
+    def _notify_waiters(self):
+        new_head, self._new_head = self._new_head, gevent.event.Event()
+        new_head.set()
+
+    def wait_for_new_head(self, block_number: int, timeout: float) -> bool:
+        """ Blocks until a head after `block_number` arrives, or at most `timeout` seconds.
+
+        Returns:
+            Whether the subscription is active. If not, the caller has to poll.
+        """
+        if not self.is_subscribed.is_set():
+            return False
+
+        new_head = self._new_head
+        if self.latest_block_number is None or self.latest_block_number <= block_number:
+            new_head.wait(timeout)
+        return self.is_subscribed.is_set()
+
+    def current_block_number(self) -> Optional[int]:
+        """ Returns the latest head, or `None` while there is no subscription. """
+        if not self.is_subscribed.is_set():
+            return None
+        return self.latest_block_number
@@ -0,0 +1,95 @@
+import time
+from typing import Any, Callable, Dict
+
+from prometheus_client import Counter, Gauge, Histogram
+from web3 import Web3
+
+RPC_REQUESTS = Counter(
+    'explorer_rpc_requests_total',
+    'JSON-RPC calls sent to the Ethereum node',
+    ['method'],
+)
+RPC_ERRORS = Counter(
+    'explorer_rpc_errors_total',
+    'JSON-RPC calls which failed or returned an error',
+    ['method'],
+)
+RPC_LATENCY = Histogram(
+    'explorer_rpc_latency_seconds',
+    'Latency of JSON-RPC requests, batch requests are observed as method "batch"',
+    ['method'],
+)
+
+LISTENER_HEAD_LAG = Gauge(
+    'explorer_listener_head_lag_blocks',
+    'Number of blocks the unconfirmed head of a listener is behind the chain head',
+    ['listener'],
+)
+LISTENER_CONFIRMED_HEAD = Gauge(
+    'explorer_listener_confirmed_head',
+    'Confirmed head block of a listener',
+    ['listener'],
+)
+LISTENER_CHUNK_SIZE = Gauge(
+    'explorer_listener_chunk_size_blocks',
+    'Current number of blocks per eth_getLogs request of a listener',
+    ['listener'],
+)
+REORGS = Counter(
+    'explorer_reorgs_total',
+    'Chain reorganizations of unconfirmed blocks seen by a listener',
+    ['listener'],
+)
+
+EVENTS_HANDLED = Counter(
+    'explorer_events_handled_total',
+    'Decoded contract events applied to the model',
+    ['event'],
+)
+
+API_BUILD_SECONDS = Histogram(
+    'explorer_api_build_seconds',
+    'Time to build an API response from the model',
+    ['endpoint'],
+)
+API_RESPONSE_BYTES = Histogram(
+    'explorer_api_response_bytes',
+    'Size of API responses',
+    ['endpoint'],
+    buckets=[2 ** exponent for exponent in range(10, 30, 2)],
+)
+STREAM_CLIENTS = Gauge(
+    'explorer_stream_clients',
+    'Clients connected to the server-sent event stream',
+)
+
+PRESENCE_POLLS = Counter(
+    'explorer_presence_polls_total',
+    'Polls of the online addresses from the pathfinding service',
+    ['outcome'],
+)
+PRESENCE_POLL_LATENCY = Histogram(
+    'explorer_presence_poll_latency_seconds',
+    'Latency of polling the online addresses from the pathfinding service',
+)
+
+
+def rpc_metrics_middleware(make_request: Callable, web3: Web3) -> Callable:
+    """ web3 middleware counting and timing every JSON-RPC call. """
+
+    def middleware(method: str, params: Any) -> Dict:
+        RPC_REQUESTS.labels(method).inc()
+        start = time.monotonic()
+        try:
+            response = make_request(method, params)
+        except Exception:
+            RPC_ERRORS.labels(method).inc()
+            raise
+        finally:
+            RPC_LATENCY.labels(method).observe(time.monotonic() - start)
+
+        if 'error' in response:
+            RPC_ERRORS.labels(method).inc()
+        return response
+
+    return middleware
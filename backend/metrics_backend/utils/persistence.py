@@ -0,0 +1,62 @@
+import logging
+import os
+import pickle
+from typing import Dict, Optional
+
+log = logging.getLogger(__name__)
+
+# bump whenever the pickled model changes incompatibly, older snapshots are ignored then
+SNAPSHOT_FORMAT_VERSION = 6
+SNAPSHOT_FILE = 'snapshot.pickle'
+
+
+def snapshot_path(state_dir: str) -> str:
+    return os.path.join(state_dir, SNAPSHOT_FILE)
+
+
+def write_atomically(path: str, data: bytes):
+    """ Writes to a temp file first, then renames it, so `path` is complete at all times. """
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    # rename is atomic
+    os.replace(temp_path, path)
+
+
+def encode_snapshot(snapshot: Dict) -> bytes:
+    """ Serialises a snapshot of the service state. """
+    return pickle.dumps(
+        dict(format_version=SNAPSHOT_FORMAT_VERSION, **snapshot),
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+
+
+def save_snapshot(path: str, data: bytes):
+    """ Atomically writes a snapshot returned by `encode_snapshot` to `path`. """
+    write_atomically(path, data)
+    log.info(f'Wrote snapshot ({len(data)} bytes) to {path}')
+
+
+def load_snapshot(path: str) -> Optional[Dict]:
+    """ Loads the snapshot at `path`, returns `None` if there is no usable snapshot. """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        log.warning(f'Could not read snapshot {path}: {e}')
+        return None
+
+    if snapshot.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        log.warning(
+            f'Ignoring snapshot {path} with format version {snapshot.get("format_version")}, '
+            f'expected {SNAPSHOT_FORMAT_VERSION}'
+        )
+        return None
+
+    return snapshot
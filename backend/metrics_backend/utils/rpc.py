@@ -0,0 +1,73 @@
+import time
+from typing import Any, Dict, List, Tuple
+
+import requests
+from web3 import HTTPProvider, Web3
+
+from metrics_backend.utils.instrumentation import RPC_ERRORS, RPC_LATENCY, RPC_REQUESTS
+
+DEFAULT_BATCH_TIMEOUT = 30  # seconds
+
+
+def batch_request(web3: Web3, calls: List[Tuple[str, List]]) -> List[Dict[str, Any]]:
+    """ Sends JSON-RPC calls to the node in a single batch request.
+
+    Providers which don't speak HTTP get the calls one after another.
+
+    Args:
+        web3: A Web3 instance
+        calls: The method and params of every call
+
+    Returns:
+        The JSON-RPC response of every call, in the order of `calls`. Each response has
+        either a `result` or an `error` entry.
+    """
+    if len(calls) == 0:
+        return []
+
+    provider = web3.provider
+    if not isinstance(provider, HTTPProvider):
+        return [_request(web3, method, params) for method, params in calls]
+
+    payload = [
+        dict(jsonrpc='2.0', id=request_id, method=method, params=params)
+        for request_id, (method, params) in enumerate(calls)
+    ]
+
+    for method, _ in calls:
+        RPC_REQUESTS.labels(method).inc()
+
+    request_kwargs = dict(provider.get_request_kwargs())
+    request_kwargs.setdefault('timeout', DEFAULT_BATCH_TIMEOUT)
+    start = time.monotonic()
+    try:
+        response = requests.post(provider.endpoint_uri, json=payload, **request_kwargs)
+        response.raise_for_status()
+        responses = response.json()
+    except Exception:
+        for method, _ in calls:
+            RPC_ERRORS.labels(method).inc()
+        raise
+    finally:
+        RPC_LATENCY.labels('batch').observe(time.monotonic() - start)
+
+    if not isinstance(responses, list):
+        # some nodes answer a batch they don't support with a single error
+        raise ValueError(responses.get('error', responses))
+
+    by_id = {item.get('id'): item for item in responses}
+    results = [
+        by_id.get(request_id, dict(error=dict(message='Missing response in batch')))
+        for request_id in range(len(calls))
+    ]
+    for (method, _), result in zip(calls, results):
+        if 'error' in result:
+            RPC_ERRORS.labels(method).inc()
+    return results
+
+
+def _request(web3: Web3, method: str, params: List) -> Dict[str, Any]:
+    try:
+        return dict(result=web3.manager.request_blocking(method, params))
+    except ValueError as e:
+        return dict(error=e.args[0] if e.args else str(e))
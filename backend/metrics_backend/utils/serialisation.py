@@ -1,14 +1,21 @@
-from functools import reduce
-from typing import Dict, List
+import json
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
 
-from eth_utils.address import to_canonical_address
 from metrics_backend.model import (
     ChannelView,
     ParticipantsChannels,
     PaymentNetworkMetrics,
-    TokenNetwork
+    TokenInfo,
+    TokenNetwork,
+    TokenNetworkChanges,
 )
 from metrics_backend.utils import Address
+from metrics_backend.utils.address_registry import AddressId, address_registry
+
+DEFAULT_TOP_NODES = 5
+# number of channels or nodes encoded at once by the streaming encoder
+JSON_CHUNK_SIZE = 1_000
 
 
 def _state_to_str(state: ChannelView.State) -> str:
@@ -21,65 +28,156 @@ def _state_to_str(state: ChannelView.State) -> str:
     else:
         return 'unknown'
 
-def _calculate_channels_per_node(
-    channels_by_participants: Dict[Address, ParticipantsChannels],
-    num_participants: int,
-) -> float:
-    num_channels = reduce(
-        lambda acc, channels:acc + channels.opened,
-        channels_by_participants.values(),
-        0,
+
+def channel_to_dict(channel_id: int, view: ChannelView) -> Dict:
+    return dict(
+        channel_identifier=channel_id,
+        status=_state_to_str(view.state),
+        participant1=view.participant1,
+        participant2=view.participant2,
+        deposit1=view.deposit_p1,
+        deposit2=view.deposit_p2,
+    )
+
+
+def node_to_dict(participants_channels: ParticipantsChannels, online_status: bool) -> Dict:
+    return dict(
+        online=online_status,
+        opened=participants_channels.opened,
+        closed=participants_channels.closed,
+        settled=participants_channels.settled,
+    )
+
+
+def token_info_to_dict(token_info: TokenInfo) -> Dict:
+    return dict(
+        address=token_info.address,
+        name=token_info.name,
+        symbol=token_info.symbol,
+        decimals=token_info.decimals,
     )
-    return num_channels / num_participants if num_participants > 0 else 0
 
 def token_network_to_dict(
     token_network: TokenNetwork,
-    nodes_presence_status: Dict[bytes, bool]
+    nodes_presence_status: Dict[AddressId, bool]
 ) -> Dict:
     """ Returns a JSON serialized version of the token network. """
-    num_channels_opened = 0
-    num_channels_closed = 0
-    num_channels_settled = 0
-
-    channels = []
+    channels = [
+        channel_to_dict(channel_id, view)
+        for channel_id, view in token_network.channels.items()
+    ]
     nodes: Dict[Address, Dict[str, int]] = dict()
-    total_deposits = 0
-
-    for channel_id, view in token_network.channels.items():
-        channel = dict(
-            channel_identifier=channel_id,
-            status=_state_to_str(view.state),
-            participant1=view.participant1,
-            participant2=view.participant2,
-            deposit1=view.deposit_p1,
-            deposit2=view.deposit_p2,
-        )
-        channels.append(channel)
-
-        if view.state == ChannelView.State.OPENED:
-            num_channels_opened += 1
-            total_deposits += view.deposit_p1
-            total_deposits += view.deposit_p2
-        elif view.state == ChannelView.State.CLOSED:
-            num_channels_closed += 1
-        elif view.state == ChannelView.State.SETTLED:
-            num_channels_settled += 1
-    
-    for address, participants_channels in token_network.participants.items():
-        online_status = nodes_presence_status.get(to_canonical_address(address), False)
-        nodes[address] = dict(
-            online=online_status,
-            opened=participants_channels.opened,
-            closed=participants_channels.closed,
-            settled=participants_channels.settled,
+    for address_id, participants_channels in token_network.participants.items():
+        online_status = nodes_presence_status.get(address_id, False)
+        nodes[address_registry.checksum_address(address_id)] = node_to_dict(
+            participants_channels,
+            online_status,
         )
 
-    num_nodes_with_open_channels = reduce(
-        lambda acc, channels:acc + (1 if channels.opened > 0 else 0),
-        token_network.participants.values(),
-        0,
+    return dict(
+        token_network_summary_to_dict(token_network),
+        channels=channels,
+        nodes=nodes,
+    )
+
+
+def _json_items(items: Iterable, chunk_size: int, encode_chunk) -> Iterator[bytes]:
+    """ Encodes the items of a JSON array or object `chunk_size` at a time, without the
+    brackets. `encode_chunk` returns the JSON of a list of items. """
+    items = iter(items)
+    separator = b''
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield separator + encode_chunk(chunk)[1:-1].encode()
+        separator = b', '
+
+
+def token_network_to_json(
+    token_network: TokenNetwork,
+    nodes_presence_status: Dict[AddressId, bool],
+    chunk_size: int = JSON_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """ Encodes the token network in chunks, the same as `token_network_to_dict` with
+    `json.dumps`.
+
+    Only the dicts of one chunk of channels or nodes exist at a time, so the memory needed
+    doesn't grow with the size of the token network.
+    """
+    summary_json = json.dumps(token_network_summary_to_dict(token_network)).encode()
+    yield summary_json[:-1] + b', "channels": ['
+    yield from _json_items(
+        token_network.channels.items(),
+        chunk_size,
+        lambda chunk: json.dumps([
+            channel_to_dict(channel_id, view) for channel_id, view in chunk
+        ]),
+    )
+    yield b'], "nodes": {'
+    yield from _json_items(
+        token_network.participants.items(),
+        chunk_size,
+        lambda chunk: json.dumps({
+            address_registry.checksum_address(address_id): node_to_dict(
+                participants_channels,
+                nodes_presence_status.get(address_id, False),
+            )
+            for address_id, participants_channels in chunk
+        }),
+    )
+    yield b'}}'
+
+
+def networks_to_json(
+    token_networks: Iterable[TokenNetwork],
+    nodes_presence_status: Dict[AddressId, bool],
+) -> Iterator[bytes]:
+    """ Encodes the `networks` of `/json` in chunks, straight from the model. """
+    yield b'['
+    for index, network in enumerate(token_networks):
+        if index > 0:
+            yield b', '
+        yield from token_network_to_json(network, nodes_presence_status)
+    yield b']'
+
+
+def token_network_changes_to_dict(
+    token_network: TokenNetwork,
+    changes: TokenNetworkChanges,
+    nodes_presence_status: Dict[AddressId, bool]
+) -> Dict:
+    """ Returns a JSON serialized version of the token network with the changed channels
+    and nodes only. """
+    channels = [
+        channel_to_dict(channel_id, token_network.channels[channel_id])
+        for channel_id in sorted(changes.channels)
+        if channel_id in token_network.channels
+    ]
+    nodes: Dict[Address, Dict[str, int]] = dict()
+    for address_id in changes.nodes:
+        participants_channels = token_network.participants.get(address_id)
+        if participants_channels is not None:
+            online_status = nodes_presence_status.get(address_id, False)
+            nodes[address_registry.checksum_address(address_id)] = node_to_dict(
+                participants_channels,
+                online_status,
+            )
+
+    return dict(
+        token_network_summary_to_dict(token_network),
+        channels=channels,
+        nodes=nodes,
     )
 
+
+def token_network_summary_to_dict(token_network: TokenNetwork) -> Dict:
+    """ Returns the token and the aggregates of a token network. """
+    # the aggregates are maintained by the token network, no need to scan the channels
+    num_channels_opened = token_network.num_channels_opened
+    total_deposits = token_network.total_deposits
+    num_nodes_with_open_channels = token_network.num_nodes_with_open_channels
+
     if num_channels_opened > 0:
         avg_deposit_per_channel = total_deposits / num_channels_opened
     else:
@@ -87,62 +185,49 @@ def token_network_to_dict(
 
     if num_nodes_with_open_channels > 0:
         avg_deposit_per_node = total_deposits / num_nodes_with_open_channels
+        avg_channels_per_node = (
+            token_network.num_participant_open_channels / num_nodes_with_open_channels
+        )
     else:
         avg_deposit_per_node = 0
-        
-    avg_channels_per_node = _calculate_channels_per_node(
-        token_network.participants,
-        num_nodes_with_open_channels,
-    )
+        avg_channels_per_node = 0
 
     return dict(
         address=token_network.address,
-        token=dict(
-            address=token_network.token_info.address,
-            name=token_network.token_info.name,
-            symbol=token_network.token_info.symbol,
-            decimals=token_network.token_info.decimals,
-        ),
-        num_channels_total=len(channels),
+        token=token_info_to_dict(token_network.token_info),
+        num_channels_total=len(token_network.channels),
         num_channels_opened=num_channels_opened,
-        num_channels_closed=num_channels_closed,
-        num_channels_settled=num_channels_settled,
+        num_channels_closed=token_network.num_channels_closed,
+        num_channels_settled=token_network.num_channels_settled,
         total_deposits=total_deposits,
         avg_deposit_per_channel=avg_deposit_per_channel,
         avg_deposit_per_node=avg_deposit_per_node,
         avg_channels_per_node=avg_channels_per_node,
-        channels=channels,
-        nodes=nodes,
     )
 
-def metrics_to_dict(payment_network_metrics: PaymentNetworkMetrics) -> Dict:
-    """ Returns a JSON serialized version of the overall metrics. """
-    
-    open_channels_by_participant = payment_network_metrics.open_channels_by_participant
 
-    summed_open_channels = reduce(
-        lambda acc, channels:acc + channels,
-        open_channels_by_participant.values(),
-        0,
-    )
-    num_nodes_with_open_channels = reduce(
-        lambda acc, channels:acc + (1 if channels > 0 else 0),
-        open_channels_by_participant.values(),
-        0,
-    )
+def metrics_to_dict(
+    payment_network_metrics: PaymentNetworkMetrics,
+    top: int = DEFAULT_TOP_NODES,
+) -> Dict:
+    """ Returns a JSON serialized version of the overall metrics.
+
+    Args:
+        top: The number of nodes in `top_nodes_by_channels`
+    """
+    summed_open_channels = payment_network_metrics.summed_open_channels
+    num_nodes_with_open_channels = payment_network_metrics.num_nodes_with_open_channels
 
     if num_nodes_with_open_channels > 0:
         avg_channels_per_node = summed_open_channels / num_nodes_with_open_channels
     else:
         avg_channels_per_node = 0
 
-    top_nodes_by_channels = sorted(
-        [
-            {'address': node, 'channels': num} 
-            for node, num in open_channels_by_participant.items()
-        ],
-        key=lambda participant:participant['channels']
-    )[-5:]
+    # ascending, the node with the most channels comes last
+    top_nodes_by_channels = [
+        {'address': address_registry.checksum_address(node), 'channels': num}
+        for node, num in reversed(payment_network_metrics.top_nodes(top))
+    ]
 
     return dict(
         num_token_networks=payment_network_metrics.num_token_networks,
@@ -1,43 +1,262 @@
-from web3.contract import Contract
-from web3.exceptions import BadFunctionCallOutput
+import json
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import gevent
+import gevent.event
+import requests
+from eth_abi.exceptions import DecodingError
+from eth_utils import decode_hex
+from web3 import Web3
 
 from metrics_backend.model import TokenInfo
+from metrics_backend.utils import Address
+from metrics_backend.utils.persistence import write_atomically
+from metrics_backend.utils.rpc import batch_request
 
+log = logging.getLogger(__name__)
 
-def get_token_name(token_contract: Contract) -> str:
-    try:
-        return token_contract.functions.name().call()
-    except BadFunctionCallOutput:
-        return ''
-    # temporary fix for #138, until we understand why this happens
-    except ValueError:
-        return ''
+DEFAULT_TOKEN_DECIMALS = 18
+TOKEN_INFO_CACHE_FILE = 'token-info.json'
 
+# 4 byte selectors of the ERC20 metadata functions
+NAME_SELECTOR = '0x06fdde03'
+SYMBOL_SELECTOR = '0x95d89b41'
+DECIMALS_SELECTOR = '0x313ce567'
 
-def get_token_symbol(token_contract: Contract) -> str:
-    try:
-        return token_contract.functions.symbol().call()
-    except BadFunctionCallOutput:
-        return ''
-    # temporary fix for #138, until we understand why this happens
-    except (ValueError, OverflowError):
-        return ''
+
+# JSON-RPC error code of a reverted `eth_call`, some nodes use the generic -32000 instead
+EXECUTION_REVERTED_CODE = 3
+
+
+def _is_revert(error) -> bool:
+    if not isinstance(error, dict):
+        return 'revert' in str(error)
+    return error.get('code') == EXECUTION_REVERTED_CODE or 'revert' in error.get('message', '')
 
 
-def get_token_decimals(token_contract: Contract) -> int:
+def _decode_call_result(web3: Web3, response: Dict, abi_type: str):
+    """ Decodes the result of an `eth_call`, returns `None` if the token has no such value.
+
+    Raises:
+        ValueError: If the node failed to answer the call, e.g. because of a rate limit
+    """
+    error = response.get('error')
+    if error is not None:
+        # the contract answered, but without the function
+        if _is_revert(error):
+            return None
+        raise ValueError(error)
+
+    data = decode_hex(response.get('result') or '0x')
+    if len(data) == 0:
+        # no contract or no such function
+        return None
+
     try:
-        return token_contract.functions.decimals().call()
-    except BadFunctionCallOutput:
-        return 18
-    # temporary fix for #138, until we understand why this happens
-    except ValueError:
-        return 18
-
-
-def get_token_info(token_contract: Contract) -> TokenInfo:
-    return TokenInfo(
-        token_contract.address,
-        get_token_name(token_contract),
-        get_token_symbol(token_contract),
-        get_token_decimals(token_contract),
-    )
+        return web3.codec.decode_abi([abi_type], data)[0]
+    except (DecodingError, ValueError, OverflowError):
+        return None
+
+
+def fetch_token_infos(
+    web3: Web3,
+    token_addresses: List[Address],
+) -> List[Optional[Tuple[TokenInfo, bool]]]:
+    """ Fetches the metadata of several tokens in a single batch request.
+
+    Returns:
+        The token info of every token and whether any of its fields had to fall back to
+        the defaults, because the token doesn't have it. `None` for the tokens whose calls
+        the node failed to answer, they should be fetched again later.
+    """
+    calls = []
+    for token_address in token_addresses:
+        for selector in (NAME_SELECTOR, SYMBOL_SELECTOR, DECIMALS_SELECTOR):
+            calls.append(('eth_call', [dict(to=token_address, data=selector), 'latest']))
+    responses = batch_request(web3, calls)
+
+    token_infos: List[Optional[Tuple[TokenInfo, bool]]] = []
+    for index, token_address in enumerate(token_addresses):
+        name_response, symbol_response, decimals_response = responses[3 * index:3 * index + 3]
+        try:
+            name = _decode_call_result(web3, name_response, 'string')
+            symbol = _decode_call_result(web3, symbol_response, 'string')
+            decimals = _decode_call_result(web3, decimals_response, 'uint8')
+        except ValueError as e:
+            log.debug(f'Could not fetch the token info of {token_address}: {e}')
+            token_infos.append(None)
+            continue
+
+        is_fallback = name is None or symbol is None or decimals is None
+        token_infos.append((
+            TokenInfo(
+                token_address,
+                name if name is not None else '',
+                symbol if symbol is not None else '',
+                decimals if decimals is not None else DEFAULT_TOKEN_DECIMALS,
+            ),
+            is_fallback,
+        ))
+    return token_infos
+
+
+class TokenInfoCache:
+    """ Token metadata keyed by chain id and token address, optionally persisted as JSON.
+
+    Tokens which needed fallback values are cached as well, so they are not queried again.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self._entries: Dict[str, Dict] = {}
+
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                log.warning(f'Could not read token info cache {path}: {e}')
+
+    @staticmethod
+    def _key(chain_id: int, token_address: str) -> str:
+        return f'{chain_id}:{token_address}'
+
+    def get(self, chain_id: int, token_address: Address) -> Optional[TokenInfo]:
+        entry = self._entries.get(self._key(chain_id, token_address))
+        if entry is None:
+            return None
+        return TokenInfo(token_address, entry['name'], entry['symbol'], entry['decimals'])
+
+    def add(self, chain_id: int, token_info: TokenInfo, is_fallback: bool):
+        self._entries[self._key(chain_id, token_info.address)] = dict(
+            name=token_info.name,
+            symbol=token_info.symbol,
+            decimals=token_info.decimals,
+            fallback=is_fallback,
+        )
+
+    def save(self):
+        if self.path is None:
+            return
+        write_atomically(self.path, json.dumps(self._entries, indent=2).encode())
+
+
+class TokenInfoResolver(gevent.Greenlet):
+    """ Fills in `TokenInfo`s in the background, so event handlers don't wait for the node.
+
+    All tokens queued in the meantime are resolved with a single batch request.
+    """
+
+    def __init__(
+        self,
+        web3: Web3,
+        cache: Optional[TokenInfoCache] = None,
+        *,
+        retry_interval: int = 30,
+        on_update: Optional[Callable[[List[TokenInfo]], None]] = None,
+    ) -> None:
+        """ Creates a new TokenInfoResolver
+
+        Args:
+            web3: A Web3 instance
+            cache: The token info cache, an in-memory cache is used if it is not given
+            retry_interval: The number of seconds to wait after a failed batch request
+            on_update: Called with the token infos updated in one round
+        """
+        super().__init__()
+        self.web3 = web3
+        self.cache = cache if cache is not None else TokenInfoCache()
+        self.retry_interval = retry_interval
+        self.on_update = on_update
+
+        self.running = False
+        self._chain_id: Optional[int] = None
+        self._pending: List[TokenInfo] = []
+        self._has_pending = gevent.event.Event()
+
+    def resolve(self, token_info: TokenInfo):
+        """ Queues `token_info` to be updated in place with the token's metadata. """
+        self._pending.append(token_info)
+        self._has_pending.set()
+
+    def _run(self):
+        self.running = True
+        while self.running:
+            self._has_pending.wait()
+            if not self.running:
+                break
+
+            try:
+                self._resolve_pending()
+            except (requests.RequestException, ValueError) as e:
+                log.warning(
+                    f'Could not fetch token infos ({e}), retrying in {self.retry_interval}s'
+                )
+                gevent.sleep(self.retry_interval)
+
+    def stop(self):
+        self.running = False
+        self._has_pending.set()
+
+    def _resolve_pending(self):
+        if self._chain_id is None:
+            self._chain_id = self.web3.eth.chainId
+
+        # take the queue, tokens added while fetching are resolved in the next round
+        pending, self._pending = self._pending, []
+        self._has_pending.clear()
+
+        unknown = []
+        updated = []
+        for token_info in pending:
+            cached = self.cache.get(self._chain_id, token_info.address)
+            if cached is not None:
+                _update_token_info(token_info, cached)
+                updated.append(token_info)
+            else:
+                unknown.append(token_info)
+        self._notify_update(updated)
+
+        if len(unknown) == 0:
+            return
+
+        try:
+            fetched = fetch_token_infos(self.web3, [info.address for info in unknown])
+        except Exception:
+            # queue them again for the retry
+            self._pending.extend(unknown)
+            self._has_pending.set()
+            raise
+
+        resolved = []
+        failed = []
+        for token_info, result in zip(unknown, fetched):
+            if result is None:
+                failed.append(token_info)
+                continue
+            fetched_info, is_fallback = result
+            _update_token_info(token_info, fetched_info)
+            self.cache.add(self._chain_id, fetched_info, is_fallback)
+            resolved.append(token_info)
+            log.info(f'Resolved token info {fetched_info!r} (fallback: {is_fallback})')
+        self._notify_update(resolved)
+        if len(resolved) > 0:
+            self.cache.save()
+
+        if len(failed) > 0:
+            # errors of the node are not cached, the tokens are queued again for the retry
+            self._pending.extend(failed)
+            self._has_pending.set()
+            raise ValueError(f'the node failed to answer the calls for {len(failed)} tokens')
+
+    def _notify_update(self, token_infos: List[TokenInfo]):
+        if self.on_update is not None and len(token_infos) > 0:
+            self.on_update(token_infos)
+
+
+def _update_token_info(token_info: TokenInfo, source: TokenInfo):
+    token_info.name = source.name
+    token_info.symbol = source.symbol
+    token_info.decimals = source.decimals